@@ -0,0 +1,43 @@
+"""
+Times filling and emptying carts of increasing size.
+
+Run from the repository root with ``python -m benchmarks.bench_cart``. Adding and removing are
+constant time per item, so the time per item should stay flat as the cart grows.
+"""
+import time
+
+from shopping.engine.structures import ShoppingCart
+
+
+def time_cart(size, products=1000):
+    """
+    Adds and then removes ``size`` items spread over a fixed number of products.
+
+    :param size: The number of items to add and remove.
+    :type size: int
+    :param products: The number of distinct products in the cart.
+    :type products: int
+    :return: The elapsed (add, remove) times in seconds.
+    :rtype: tuple
+    """
+    items = [f'Product {i % products}' for i in range(size)]
+    cart = ShoppingCart()
+    start = time.perf_counter()
+    for item in items:
+        cart.add_to_cart(item)
+    added = time.perf_counter() - start
+    start = time.perf_counter()
+    for item in reversed(items):
+        cart.remove_from_cart(item)
+    return added, time.perf_counter() - start
+
+
+def main():
+    print(f'{"items":>10} {"add us/item":>12} {"remove us/item":>15}')
+    for size in (1_000, 10_000, 100_000, 500_000):
+        added, removed = time_cart(size)
+        print(f'{size:>10} {added / size * 1e6:>12.2f} {removed / size * 1e6:>15.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Times importing a 1,000-line order into the GUI's cart, with Tk replaced by mocks, one line at a time
+with the old full listbox redraw per change, and as one batch with diff-based listbox updates.
+Listbox rows deleted and inserted are counted as the widget work a real Tk listbox would do.
+
+Run from the repository root with ``python -m benchmarks.bench_cart_import``.
+"""
+import time
+from unittest.mock import MagicMock, patch
+
+from shopping import gui
+from shopping.engine.structures import ProductTree
+
+from .bench_product_tree import synthetic_rows
+
+END = 'end'  # tk.END, which is mocked along with the rest of Tk
+
+
+class CountingListbox:
+    """Stands in for tk.Listbox, counting the rows it is asked to delete and insert."""
+
+    def __init__(self):
+        self.rows = []
+        self.touched = 0
+
+    def pack(self, **options):
+        pass
+
+    def delete(self, first, last=None):
+        last = len(self.rows) - 1 if last in (None, END) else last
+        self.touched += max(last - first + 1, 0)
+        del self.rows[first:last + 1]
+
+    def insert(self, index, *items):
+        index = len(self.rows) if index == END else index
+        self.touched += len(items)
+        self.rows[index:index] = items
+
+
+def full_redraw(app):
+    """The refresh before batching: every row deleted and inserted again after every change."""
+    app.cart_listbox.delete(0, END)
+    app.cart_listbox.insert(END, *app.shopping_cart.get_cart_items())
+
+
+def run(lines, batched):
+    """Imports an order into a fresh GUI and returns the elapsed time and the listbox rows touched."""
+    tree = ProductTree()
+    tree.add_products(synthetic_rows(len(lines), departments=2, categories=5))
+    with patch.object(gui, 'tk') as tk, patch.object(gui, 'ttk'), patch.object(gui, 'messagebox'), \
+            patch.object(gui, 'csv_to_products', return_value=tree), patch.object(gui, 'replay_orders'), \
+            patch.object(gui, 'OrderLog'), patch.object(gui, 'CartStore'), patch.object(gui, 'CatalogSync'):
+        tk.END = END
+        # The cart listbox is created first, then the search results listbox
+        tk.Listbox.side_effect = [CountingListbox(), MagicMock()]
+        app = gui.GUI(MagicMock())
+        start = time.perf_counter()
+        if batched:
+            app.inventory.add_many(app.shopping_cart, lines)
+        else:
+            app.shopping_cart.unsubscribe(app.on_cart_changed)
+            for product, quantity in lines:
+                app.inventory.add_to_cart(app.shopping_cart, product, quantity)
+                full_redraw(app)
+                app.update_total_labels()
+        elapsed = time.perf_counter() - start
+        assert app.cart_listbox.rows == app.shopping_cart.get_cart_items()
+    return elapsed, app.cart_listbox.touched
+
+
+def main(size=1_000):
+    lines = [(f'Product {i}', 1) for i in range(size)]
+    for label, batched in (('per line', False), ('batched', True)):
+        elapsed, touched = run(lines, batched)
+        print(f'{label:>8}: {elapsed:.3f} s, {touched:,} listbox rows touched for a {size}-line order')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Times saving 10,000 session carts to a CartStore and restoring them, against rebuilding the same
+carts by replaying every unit through InventoryEngine.add_to_cart, and compares the store's size
+with the same carts written as JSON.
+
+Run from the repository root with ``python -m benchmarks.bench_cart_store``.
+"""
+import json
+import os
+import random
+import tempfile
+import time
+
+from shopping.carts import CartStore
+from shopping.engine.inventory import InventoryEngine
+from shopping.engine.structures import ProductTree, ShoppingCart
+
+from .bench_product_tree import synthetic_rows
+
+
+def make_sessions(products, sessions, seed=0):
+    """Generates each session's cart lines: one to eight products with one to three units each."""
+    rng = random.Random(seed)
+    return {f'session-{i}': [(product, rng.randint(1, 3)) for product in rng.sample(products, rng.randint(1, 8))]
+            for i in range(sessions)}
+
+
+def load_tree(size):
+    """Builds a catalog with enough stock that no cart comes up short."""
+    tree = ProductTree()
+    tree.add_products((department, category, product, price, 1_000_000)
+                      for department, category, product, price, _ in synthetic_rows(size))
+    return tree
+
+
+def replay(tree, saved):
+    """Rebuilds the carts one unit at a time, as a client re-adding its cart would."""
+    engine = InventoryEngine(tree)
+    carts = {}
+    for session, lines in saved.items():
+        cart = carts[session] = ShoppingCart(tree)
+        for product, quantity in lines:
+            for _ in range(quantity):
+                engine.add_to_cart(cart, product)
+    return carts
+
+
+def restore(tree, store):
+    """Rebuilds the carts from the store, holding their stock in one pass per cart."""
+    engine = InventoryEngine(tree)
+    carts = {}
+    for session, lines in store.iter_saved():
+        engine.restore(carts.setdefault(session, ShoppingCart(tree)), lines)
+    return carts
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(size=10_000, sessions=10_000):
+    products = [product for _, _, product, _, _ in synthetic_rows(size)]
+    saved = make_sessions(products, sessions)
+    units = sum(quantity for lines in saved.values() for _, quantity in lines)
+    print(f'{sessions:,} carts, {units:,} units')
+
+    carts, replay_seconds = timed(replay, load_tree(size), saved)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'carts.db')
+        store = CartStore(path)
+        _, save_seconds = timed(store.save_many, carts)
+        store.close()
+        json_bytes = len(json.dumps(saved).encode('utf-8'))
+        store_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+        store, open_seconds = timed(CartStore, path)
+        lines_bytes = store.connection.execute('SELECT sum(length(lines)) FROM carts').fetchone()[0]
+        restored, restore_seconds = timed(restore, load_tree(size), store)
+        _, load_all_seconds = timed(store.load_all, load_tree(size))
+        store.close()
+
+    assert all(restored[session].get_cart_items() == cart.get_cart_items() for session, cart in carts.items())
+    print(f'{"replay add_to_cart":>28} {replay_seconds:8.3f} s')
+    print(f'{"save_many":>28} {save_seconds:8.3f} s')
+    print(f'{"open store":>28} {open_seconds:8.3f} s')
+    print(f'{"restore with stock holds":>28} {restore_seconds:8.3f} s  ({replay_seconds / restore_seconds:.1f}x)')
+    print(f'{"load_all without holds":>28} {load_all_seconds:8.3f} s')
+    print(f'{"store size":>28} {store_bytes / 1024:8.0f} KiB  (cart lines {lines_bytes / 1024:.0f} KiB, '
+          f'JSON {json_bytes / 1024:.0f} KiB)')
+
+
+if __name__ == '__main__':
+    main()
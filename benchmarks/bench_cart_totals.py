@@ -0,0 +1,41 @@
+"""
+Times building and totaling a cart priced against a large catalog.
+
+Run from the repository root with ``python -m benchmarks.bench_cart_totals``. Adding items resolves
+each price through the tree's product index; reading the running totals is then constant time,
+compared here with a full recompute over the cart.
+"""
+import time
+
+from shopping.engine.structures import ProductTree, ShoppingCart
+
+from .bench_product_tree import synthetic_rows
+
+
+def main(catalog_size=100_000, cart_size=500):
+    tree = ProductTree()
+    for row in synthetic_rows(catalog_size):
+        tree.add_product(*row)
+    cart = ShoppingCart(tree)
+
+    start = time.perf_counter()
+    for i in range(cart_size):
+        cart.add_to_cart(f'Product {i * (catalog_size // cart_size)}')
+    added = time.perf_counter() - start
+
+    start = time.perf_counter()
+    total_price, total_quantity = cart.recompute_totals()
+    recomputed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    total_price, total_quantity = cart.total_price, cart.total_quantity
+    running = time.perf_counter() - start
+
+    print(f'{cart_size} items against {catalog_size} SKUs (total ${total_price:.2f}, {total_quantity} items)')
+    print(f'  add to cart:      {added * 1000:.3f} ms')
+    print(f'  full recompute:   {recomputed * 1000:.3f} ms')
+    print(f'  running totals:   {running * 1000:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Times building the GUI for catalogs of increasing size, with Tk replaced by mocks so it runs without
+a display. Widget creation calls are counted to show that startup no longer depends on the number of
+products.
+
+Run from the repository root with ``python -m benchmarks.bench_gui_startup``.
+"""
+import time
+from unittest.mock import MagicMock, patch
+
+from shopping import gui
+from shopping.engine.structures import ProductTree
+
+from .bench_product_tree import synthetic_rows
+
+
+def time_startup(size):
+    """
+    Builds the GUI over a synthetic catalog.
+
+    :param size: The number of products in the catalog.
+    :type size: int
+    :return: The elapsed time in seconds and the number of ttk widgets created.
+    :rtype: tuple
+    """
+    tree = ProductTree()
+    tree.add_products(synthetic_rows(size))
+    with patch.object(gui, 'csv_to_products', return_value=tree), patch.object(gui, 'tk'), \
+            patch.object(gui, 'ttk') as ttk, patch.object(gui, 'replay_orders'), patch.object(gui, 'OrderLog'), \
+            patch.object(gui, 'CartStore'), patch.object(gui, 'CatalogSync'):
+        start = time.perf_counter()
+        gui.GUI(MagicMock())
+        elapsed = time.perf_counter() - start
+        widgets = sum(getattr(ttk, name).call_count for name in ('Frame', 'Label', 'Button', 'Treeview', 'Notebook'))
+    return elapsed, widgets
+
+
+def main():
+    print(f'{"SKUs":>10} {"seconds":>10} {"widgets":>10}')
+    for size in (1_000, 10_000, 100_000):
+        elapsed, widgets = time_startup(size)
+        print(f'{size:>10} {elapsed:>10.3f} {widgets:>10}')
+
+
+if __name__ == '__main__':
+    main()
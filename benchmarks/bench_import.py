@@ -0,0 +1,55 @@
+"""
+Tracks what importing the package costs, from ``python -X importtime``, for the engine-only path a
+headless server uses, the loader, and the GUI, which is the only one that should pull in Tk.
+
+Run from the repository root with ``python -m benchmarks.bench_import``.
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+PATHS = ('shopping', 'shopping.engine', 'shopping.store_products', 'shopping.service', 'shopping.gui')
+
+
+def import_time(module):
+    """
+    Imports a module in a fresh interpreter.
+
+    :param module: The module to import.
+    :type module: str
+    :return: The total import time in microseconds, excluding the interpreter's own startup imports,
+    and whether tkinter was imported.
+    :rtype: tuple
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             f'import sys, {module}; print("tkinter" in sys.modules)'],
+                            capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    total = 0
+    startup = True
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        if name.strip() == 'site':
+            # Everything before site finishes is interpreter startup
+            startup = False
+            continue
+        if not startup and not name[1:].startswith(' '):
+            total += int(cumulative)
+    return total, result.stdout.strip() == 'True'
+
+
+def main(repeat=5):
+    print(f'{"module":>24} {"median ms":>10} {"tkinter":>8}')
+    for module in PATHS:
+        timings = [import_time(module) for _ in range(repeat)]
+        median = statistics.median(total for total, _ in timings)
+        print(f'{module:>24} {median / 1000:>10.1f} {str(timings[0][1]):>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Measures what instrumentation costs on a hot path: ShoppingCart.add_to_cart as shipped, then wrapped
+the way ``instrumented`` wraps it when ``SHOPPING_INSTRUMENT=1``. With instrumentation off the
+decorator returns the function itself, so the first timing is also the disabled cost.
+
+Run from the repository root with ``python -m benchmarks.bench_instrumentation``. To profile a real
+run, set ``SHOPPING_INSTRUMENT=1`` and ``SHOPPING_INSTRUMENT_OUTPUT=timings.prom`` (or ``.json``).
+"""
+import time
+
+from shopping.engine import instrumentation
+from shopping.engine.structures import ProductTree, ShoppingCart
+
+
+def time_adds(add_to_cart, product_tree, count):
+    """Times ``count`` calls of an add_to_cart function on a fresh cart."""
+    cart = ShoppingCart(product_tree)
+    start = time.perf_counter()
+    for _ in range(count):
+        add_to_cart(cart, 'Kettle')
+    return time.perf_counter() - start
+
+
+def main(count=200_000):
+    product_tree = ProductTree()
+    product_tree.add_product('Home', 'Kitchen', 'Kettle', 25.5, 7)
+    plain = getattr(ShoppingCart.add_to_cart, '__wrapped__', ShoppingCart.add_to_cart)
+
+    instrumentation.enable()
+    wrapped = instrumentation.instrumented('cart.add_to_cart')(plain)
+    for label, function in (('off', plain), ('on', wrapped)):
+        elapsed = time_adds(function, product_tree, count)
+        print(f'{label:>3}: {elapsed / count * 1e9:.0f} ns per add_to_cart')
+    print(instrumentation.registry.to_prometheus().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Compares the streaming catalog loader against reading every row through csv.DictReader and
+add_product.
+
+Run from the repository root with ``python -m benchmarks.bench_loader``.
+"""
+import csv
+import os
+import tempfile
+import time
+
+from shopping.engine.structures import ProductTree
+from shopping.store_products import csv_to_products
+
+from .bench_product_tree import synthetic_rows
+
+
+def write_catalog(path, size):
+    """
+    Writes a synthetic catalog CSV in the same layout as StoreDatabase.csv.
+
+    :param path: Where to write the file.
+    :type path: str
+    :param size: The number of products to write.
+    :type size: int
+    """
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Department', 'Category', 'Product', 'Price', 'Quantity'])
+        for department, category, product, price, quantity in sorted(synthetic_rows(size)):
+            writer.writerow([department, category, product, f'{price:,.2f}', quantity])
+
+
+def dict_reader_load(path):
+    """Loads a catalog the way csv_to_products originally did."""
+    product_tree = ProductTree()
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        for row in csv.DictReader(file):
+            product_tree.add_product(row.get('Department'), row.get('Category'), row.get('Product'),
+                                     float(row.get('Price', '0').replace(',', '')), int(row.get('Quantity', '0')))
+    return product_tree
+
+
+def main(size=500_000):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'catalog.csv')
+        write_catalog(path, size)
+        for name, load in (('DictReader', dict_reader_load), ('streaming', csv_to_products)):
+            start = time.perf_counter()
+            load(path)
+            print(f'{name:>10}: {time.perf_counter() - start:.3f} s for {size} rows')
+
+
+if __name__ == '__main__':
+    main()
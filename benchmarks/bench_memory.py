@@ -0,0 +1,41 @@
+"""
+Measures how much memory a loaded catalog takes with tracemalloc.
+
+Run from the repository root with ``python -m benchmarks.bench_memory``.
+"""
+import gc
+import tracemalloc
+
+from shopping.engine.structures import ProductTree
+
+from .bench_product_tree import synthetic_rows
+
+
+def measure(size):
+    """
+    Builds a catalog of ``size`` products and measures the memory allocated for it.
+
+    :param size: The number of products to load.
+    :type size: int
+    :return: The number of bytes allocated while building the tree, names included.
+    :rtype: int
+    """
+    rows = synthetic_rows(size)
+    gc.collect()
+    tracemalloc.start()
+    tree = ProductTree()
+    tree.add_products(rows)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tree
+    return current
+
+
+def main(size=1_000_000):
+    current = measure(size)
+    print(f'{size} SKUs: {current / 1e6:.1f} MB, {current / size:.0f} bytes per SKU, '
+          f'{current / size:.0f} MB per million SKUs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Measures sustained checkouts per second through the checkout pipeline, where every order is fsynced
+to the order log before it is confirmed.
+
+Run from the repository root with ``python -m benchmarks.bench_orders``. More concurrent checkouts
+share each fsync, so throughput grows with the number of threads while every order stays durable.
+"""
+import os
+import tempfile
+import threading
+import time
+
+from shopping.engine.structures import ProductTree, ShoppingCart
+from shopping.orders import CheckoutPipeline, OrderLog, read_orders
+
+
+def run(threads, orders_per_thread, directory):
+    """
+    Checks out one-item carts from several threads at once.
+
+    :return: The orders per second and the average number of orders per fsync.
+    :rtype: tuple
+    """
+    tree = ProductTree()
+    tree.add_products(('Department', 'Category', f'Product {i}', 1.0, orders_per_thread) for i in range(threads))
+    path = os.path.join(directory, f'orders-{threads}.log')
+    order_log = OrderLog(path)
+    pipeline = CheckoutPipeline(tree, order_log)
+
+    def shop(product):
+        cart = ShoppingCart(tree)
+        for _ in range(orders_per_thread):
+            pipeline.engine.add_to_cart(cart, product)
+            pipeline.checkout(cart)
+
+    workers = [threading.Thread(target=shop, args=(f'Product {i}',)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    order_log.close()
+
+    orders = sum(1 for _ in read_orders(path))
+    assert orders == threads * orders_per_thread
+    return orders / elapsed, orders / order_log.batches
+
+
+def main(orders_per_thread=200):
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{"threads":>8} {"orders/s":>10} {"orders/fsync":>13}')
+        for threads in (1, 4, 16, 64):
+            rate, per_batch = run(threads, orders_per_thread, directory)
+            print(f'{threads:>8} {rate:>10,.0f} {per_batch:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
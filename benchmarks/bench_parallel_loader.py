@@ -0,0 +1,30 @@
+"""
+Measures how the catalog loader scales when the CSV is parsed by 1, 2, 4 and 8 worker processes.
+
+Run from the repository root with ``python -m benchmarks.bench_parallel_loader``.
+"""
+import os
+import tempfile
+import time
+
+from shopping.store_products import csv_to_products
+
+from .bench_loader import write_catalog
+
+
+def main(size=1_000_000, worker_counts=(1, 2, 4, 8)):
+    print(f'{os.cpu_count()} CPUs')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'catalog.csv')
+        write_catalog(path, size)
+        baseline = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            csv_to_products(path, use_snapshot=False, workers=workers)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f'{workers} workers: {elapsed:.3f} s for {size} rows, {baseline / elapsed:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Measures what pricing a cart costs per click with thousands of active promotions: the incremental
+CartPricing, pricing every line again from the compiled tables, and a naive evaluator that checks
+every rule against every line. Each mutation adds or removes one unit of a random product in a cart
+of 100 lines. The naive evaluator is slow enough that it only gets a few mutations.
+
+Run from the repository root with ``python -m benchmarks.bench_pricing``.
+"""
+import random
+import time
+
+from shopping.engine.pricing import (
+    ZERO,
+    BuyGetFree,
+    CartPricing,
+    LinePricing,
+    PercentOff,
+    PricingEngine,
+    TieredDiscount,
+)
+from shopping.engine.structures import ProductTree, ShoppingCart
+
+from .bench_product_tree import synthetic_rows
+
+
+def make_rules(rows, count, seed=0):
+    """Generates a mix of product, category and department promotions of every kind."""
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        department, category, product, _, _ = rng.choice(rows)
+        scope = rng.choice(({'product': product}, {'product': product},
+                            {'department': department, 'category': category}, {'department': department}))
+        kind = i % 3
+        if kind == 0:
+            rules.append(PercentOff(rng.choice((5, 10, 15, 20)), **scope))
+        elif kind == 1:
+            rules.append(BuyGetFree(rng.randint(1, 3), 1, **scope))
+        else:
+            rules.append(TieredDiscount([(5, 2), (10, 5), (rng.randint(15, 30), 10)], **scope))
+    return rules
+
+
+def naive_price(product_tree, rules, cart):
+    """Checks every rule against every line, as pricing without compiled tables would."""
+    discount = ZERO
+    for product, line in cart.lines.items():
+        location = product_tree.locate(product)
+        place = location[:2] if location is not None else None
+        scopes = {('product', product), ('store',)}
+        if place is not None:
+            scopes |= {('category',) + place, ('department', place[0])}
+        percent, deals, tiers = ZERO, [], []
+        for rule in rules:
+            if rule.scope in scopes:
+                if isinstance(rule, PercentOff):
+                    percent = max(percent, rule.percent)
+                elif isinstance(rule, BuyGetFree):
+                    deals.append((rule.buy, rule.free))
+                else:
+                    tiers.extend(rule.tiers)
+        discount += LinePricing(place, percent, tuple(deals), sorted(tiers)).discount(line.quantity, line.subtotal)
+    return cart.total_price - discount
+
+
+def mutations(cart, products, count, seed=1):
+    """Yields after each random one-unit change to the cart."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        product = rng.choice(products)
+        if cart.get_quantity(product) and rng.random() < 0.4:
+            cart.remove_from_cart(product)
+        else:
+            cart.add_to_cart(product)
+        yield
+
+
+def latencies(cart, products, count, price):
+    """Times pricing after each mutation, returning the sorted latencies in seconds and the last total."""
+    times = []
+    total = None
+    for _ in mutations(cart, products, count):
+        start = time.perf_counter()
+        total = price()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times, total
+
+
+def main(size=200_000, rule_count=5_000, lines=100, count=2_000, naive_count=50):
+    rows = list(synthetic_rows(size))
+    tree = ProductTree()
+    tree.add_products((department, category, product, price, 1_000_000)
+                      for department, category, product, price, _ in rows)
+    rules = make_rules(rows, rule_count)
+    start = time.perf_counter()
+    engine = PricingEngine(tree, rules, tax_rate='0.08')
+    print(f'compiled {rule_count:,} rules in {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    products = [row[2] for row in random.Random(2).sample(rows, lines)]
+    results = {}
+    for label in ('incremental', 'full reprice', 'naive'):
+        cart = ShoppingCart(tree)
+        cart.add_many((product, 1) for product in products)
+        pricing = CartPricing(engine, cart)
+        if label == 'incremental':
+            price = pricing.refresh
+        elif label == 'full reprice':
+            def price(cart=cart):
+                return CartPricing(engine, cart).total
+        else:
+            def price(cart=cart):
+                subtotal = naive_price(tree, rules, cart)
+                return subtotal + engine.tax(subtotal)
+        times, total = latencies(cart, products, naive_count if label == 'naive' else count, price)
+        results[label] = total
+        p50, p99 = times[len(times) // 2], times[int(len(times) * 0.99)]
+        print(f'{label:>13}: p50 {p50 * 1e6:9.1f} us   p99 {p99 * 1e6:9.1f} us')
+    # The naive run, last, stops early, so it is checked against the compiled pricing of its own cart
+    assert results['incremental'] == results['full reprice'], results
+    assert results['naive'] == CartPricing(engine, cart).total, results
+
+
+if __name__ == '__main__':
+    main()
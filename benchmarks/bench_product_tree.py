@@ -0,0 +1,56 @@
+"""
+Times how long it takes to load synthetic catalogs of increasing size into a ProductTree.
+
+Run from the repository root with ``python -m benchmarks.bench_product_tree``. With indexed
+lookups the time per SKU should stay roughly flat as the catalog grows.
+"""
+import time
+
+from shopping.engine.structures import ProductTree
+
+
+def synthetic_rows(size, departments=10, categories=20):
+    """
+    Generates catalog rows spread evenly over a fixed number of departments and categories.
+
+    :param size: The number of products to generate.
+    :type size: int
+    :param departments: The number of departments.
+    :type departments: int
+    :param categories: The number of categories per department.
+    :type categories: int
+    :return: An iterator of (department, category, product, price, quantity) tuples.
+    :rtype: iterator
+    """
+    for i in range(size):
+        department = f'Department {i % departments}'
+        category = f'Category {(i // departments) % categories}'
+        yield department, category, f'Product {i}', round(1 + (i % 500) * 0.37, 2), i % 100
+
+
+def time_load(size):
+    """
+    Loads a synthetic catalog into a fresh ProductTree.
+
+    :param size: The number of products to load.
+    :type size: int
+    :return: The elapsed time in seconds.
+    :rtype: float
+    """
+    rows = list(synthetic_rows(size))
+    tree = ProductTree()
+    start = time.perf_counter()
+    for row in rows:
+        tree.add_product(*row)
+    return time.perf_counter() - start
+
+
+def main():
+    print(f'{"SKUs":>10} {"seconds":>10} {"us/SKU":>10}')
+    for size in (10_000, 50_000, 100_000, 200_000, 400_000):
+        elapsed = time_load(size)
+        print(f'{size:>10} {elapsed:>10.3f} {elapsed / size * 1e6:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Times the inventory queries on a large synthetic catalog.
+
+Run from the repository root with ``python -m benchmarks.bench_queries``. The first query pays for
+building the catalog columns (and range filters for their sort); the rest reuse them until the tree changes.
+"""
+import time
+
+from shopping.engine.structures import ProductTree
+
+from .bench_product_tree import synthetic_rows
+
+
+def timed(label, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print(f'{label:>28}: {(time.perf_counter() - start) * 1000:8.2f} ms')
+    return result
+
+
+def main(size=1_000_000):
+    tree = ProductTree()
+    tree.add_products(synthetic_rows(size))
+    print(f'{size} SKUs')
+    timed('build columns', tree.get_columns)
+    timed('price range (first, sorts)', tree.products_in_price_range, 10, 20)
+    timed('price range 10-20', tree.products_in_price_range, 10, 20)
+    timed('quantity below 5 (first)', tree.low_stock, 5)
+    timed('quantity below 5', tree.low_stock, 5)
+    timed('top 100 by value', tree.top_by_value, 100)
+    timed('department report', tree.value_report, 'department')
+    timed('category report', tree.value_report, 'category')
+
+
+if __name__ == '__main__':
+    main()
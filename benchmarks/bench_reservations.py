@@ -0,0 +1,60 @@
+"""
+Stress-tests the inventory engine with many threads, each shopping with its own cart, and checks that
+no product was ever oversold.
+
+Run from the repository root with ``python -m benchmarks.bench_reservations``.
+"""
+import random
+import threading
+import time
+
+from shopping.engine.inventory import InventoryEngine
+from shopping.engine.structures import ProductTree, ShoppingCart
+
+
+def shopper(engine, products, operations, seed, results):
+    """Adds and removes random products, checking out every few items."""
+    rng = random.Random(seed)
+    cart = ShoppingCart(engine.product_tree)
+    reserved = sold = 0
+    for i in range(operations):
+        product = rng.choice(products)
+        if rng.random() < 0.8:
+            reserved += engine.add_to_cart(cart, product)
+        else:
+            engine.remove_from_cart(cart, product)
+        if i % 10 == 9:
+            quantity = cart.total_quantity
+            if engine.checkout(cart):
+                sold += quantity
+    engine.release_cart(cart)
+    results.append((reserved, sold))
+
+
+def main(threads=8, operations=20_000, products=200, stock=500):
+    tree = ProductTree()
+    names = [f'Product {i}' for i in range(products)]
+    tree.add_products(('Department', 'Category', name, 1.0, stock) for name in names)
+    engine = InventoryEngine(tree)
+
+    results = []
+    workers = [threading.Thread(target=shopper, args=(engine, names, operations, seed, results))
+               for seed in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    reserved = sum(result[0] for result in results)
+    sold = sum(result[1] for result in results)
+    remaining = sum(tree.get_product_node(name).quantity for name in names)
+    oversold = [name for name in names if tree.get_product_node(name).quantity < 0]
+    print(f'{threads} threads, {reserved} reservations in {elapsed:.2f} s: {reserved / elapsed:,.0f} per second')
+    print(f'sold {sold}, remaining {remaining}, stock accounted for: {sold + remaining == products * stock}, '
+          f'oversold products: {len(oversold)}')
+
+
+if __name__ == '__main__':
+    main()
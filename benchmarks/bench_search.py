@@ -0,0 +1,29 @@
+"""
+Times building the product search index and running prefix and fuzzy searches against it.
+
+Run from the repository root with ``python -m benchmarks.bench_search``.
+"""
+import time
+
+from shopping.engine.search import SearchIndex
+
+from .bench_product_tree import synthetic_rows
+
+
+def main(size=1_000_000):
+    names = [row[2] for row in synthetic_rows(size)]
+    start = time.perf_counter()
+    index = SearchIndex(names)
+    print(f'{size} products, prefix index built in {time.perf_counter() - start:.2f} s')
+
+    for label, search, query in (('prefix', index.prefix_search, 'product 12345'),
+                                 ('prefix', index.prefix_search, 'product 9'),
+                                 ('fuzzy (builds trigrams)', index.fuzzy_search, 'prodct 12345'),
+                                 ('fuzzy', index.fuzzy_search, 'prodct 54321')):
+        start = time.perf_counter()
+        results = search(query, 10)
+        print(f'{label:>24} {query!r:>16}: {(time.perf_counter() - start) * 1000:9.3f} ms, {results[:3]}')
+
+
+if __name__ == '__main__':
+    main()
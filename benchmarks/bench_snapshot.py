@@ -0,0 +1,37 @@
+"""
+Compares a cold catalog load from CSV with a load from its binary snapshot.
+
+Run from the repository root with ``python -m benchmarks.bench_snapshot``.
+"""
+import os
+import tempfile
+import time
+
+from shopping import snapshot
+from shopping.store_products import csv_to_products
+
+from .bench_loader import write_catalog
+
+
+def main(size=500_000):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'catalog.csv')
+        write_catalog(path, size)
+
+        start = time.perf_counter()
+        csv_to_products(path, use_snapshot=False)
+        print(f'     CSV: {time.perf_counter() - start:.3f} s for {size} rows')
+
+        start = time.perf_counter()
+        csv_to_products(path, use_snapshot=True)
+        print(f'   write: {time.perf_counter() - start:.3f} s (CSV load plus snapshot)')
+        print(f'    size: {os.path.getsize(path) / 1e6:.1f} MB CSV, '
+              f'{os.path.getsize(snapshot.snapshot_path(path)) / 1e6:.1f} MB snapshot')
+
+        start = time.perf_counter()
+        csv_to_products(path, use_snapshot=True)
+        print(f'snapshot: {time.perf_counter() - start:.3f} s for {size} rows')
+
+
+if __name__ == '__main__':
+    main()
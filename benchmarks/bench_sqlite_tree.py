@@ -0,0 +1,101 @@
+"""
+Compares the in-memory ProductTree with the SQLite-backed SQLiteProductTree side by side: loading a
+catalog in batches, Python heap held afterwards (SQLite's own page cache, 2 MB by default, is not
+counted), one pass over every category's products, product lookups where most requests go to a few
+popular products, and single-product writes.
+
+Run from the repository root with ``python -m benchmarks.bench_sqlite_tree``.
+"""
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from shopping.engine.sqlite_tree import SQLiteProductTree
+from shopping.engine.structures import ProductTree
+from shopping.store_products import CHUNK_SIZE
+
+from .bench_product_tree import synthetic_rows
+
+
+def load(make_tree, rows):
+    """Loads rows in CHUNK_SIZE batches, as the CSV loaders do, returning the tree and the seconds taken."""
+    start = time.perf_counter()
+    tree = make_tree()
+    for offset in range(0, len(rows), CHUNK_SIZE):
+        tree.add_products(rows[offset:offset + CHUNK_SIZE])
+    return tree, time.perf_counter() - start
+
+
+def heap_bytes(make_tree, rows):
+    """Loads rows into a fresh tree under tracemalloc, returning the Python heap the tree still holds."""
+    gc.collect()
+    tracemalloc.start()
+    tree, _ = load(make_tree, rows)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if hasattr(tree, 'close'):
+        tree.close()
+    return current
+
+
+def browse(tree):
+    for department in tree.get_departments():
+        for category in tree.get_categories(department):
+            tree.get_products(department, category)
+
+
+def lookups(tree, names, count, seed=0):
+    """Looks products up, with 90% of lookups going to 1% of the products."""
+    rng = random.Random(seed)
+    popular = names[:max(1, len(names) // 100)]
+    for _ in range(count):
+        tree.get_product_node(rng.choice(popular) if rng.random() < 0.9 else rng.choice(names))
+
+
+def writes(tree, rows, count, seed=0):
+    """Changes single products' stock and price."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        department, category, product, price, quantity = rng.choice(rows)
+        tree.add_product(department, category, product, price + 1, quantity + 1)
+        tree.remove_product(department, category, product)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main(size=200_000, reads=100_000, changes=5_000):
+    rows = list(synthetic_rows(size))
+    names = [row[2] for row in rows]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'catalog.sqlite3')
+        print(f'{size:,} products{"":>14}{"ProductTree":>14}{"SQLite":>14}')
+        memory_heap = heap_bytes(ProductTree, rows)
+        sqlite_heap = heap_bytes(lambda: SQLiteProductTree(os.path.join(directory, 'heap.sqlite3')), rows)
+        memory_tree, memory_load = load(ProductTree, rows)
+        sqlite_tree, sqlite_load = load(lambda: SQLiteProductTree(path), rows)
+        results = [
+            ('load (s)', memory_load, sqlite_load),
+            ('Python heap (MB)', memory_heap / 1e6, sqlite_heap / 1e6),
+            ('browse pass (s)', timed(browse, memory_tree), timed(browse, sqlite_tree)),
+            (f'{reads:,} lookups (s)', timed(lookups, memory_tree, names, reads),
+             timed(lookups, sqlite_tree, names, reads)),
+            (f'{changes:,} writes (s)', timed(writes, memory_tree, rows, changes),
+             timed(writes, sqlite_tree, rows, changes)),
+        ]
+        for label, memory_value, sqlite_value in results:
+            print(f'{label:>28}{memory_value:14.3f}{sqlite_value:14.3f}')
+        stats = sqlite_tree.cache_stats()
+        print(f'hot-product cache hit rate {stats["hit_rate"]:.1%}, '
+              f'database {os.path.getsize(path) / 1e6:.1f} MB on disk')
+        sqlite_tree.close()
+
+
+if __name__ == '__main__':
+    main()
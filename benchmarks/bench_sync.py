@@ -0,0 +1,59 @@
+"""
+Compares applying a new catalog export with CatalogSync against loading the whole export again,
+when 5% of the prices changed, and polling a catalog that only had rows appended.
+
+Run from the repository root with ``python -m benchmarks.bench_sync``.
+"""
+import csv
+import os
+import random
+import tempfile
+import time
+
+from shopping.store_products import CatalogSync, csv_to_products
+
+from .bench_loader import write_catalog
+
+
+def change_prices(path, fraction, seed=0):
+    """Rewrites a catalog CSV with the prices of a random ``fraction`` of its rows raised by a cent."""
+    rng = random.Random(seed)
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        rows = list(csv.reader(file))
+    for row in rows[1:]:
+        if rng.random() < fraction:
+            row[3] = f"{float(row[3].replace(',', '')) + 0.01:,.2f}"
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        csv.writer(file).writerows(rows)
+
+
+def main(size=500_000, fraction=0.05, appended=1000):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'catalog.csv')
+        write_catalog(path, size)
+        product_tree = csv_to_products(path, use_snapshot=False)
+        catalog_sync = CatalogSync(product_tree, path)
+        start = time.perf_counter()
+        catalog_sync.baseline()
+        print(f'baseline: {time.perf_counter() - start:.3f} s for {size} rows')
+
+        change_prices(path, fraction)
+        start = time.perf_counter()
+        delta = catalog_sync.sync()
+        print(f'    sync: {time.perf_counter() - start:.3f} s for {len(delta.price_updated)} changed prices')
+
+        start = time.perf_counter()
+        csv_to_products(path, use_snapshot=False)
+        print(f'  reload: {time.perf_counter() - start:.3f} s for {size} rows')
+
+        with open(path, 'a', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file)
+            for i in range(appended):
+                writer.writerow(['New', 'Arrivals', f'New Product {i}', '9.99', 5])
+        start = time.perf_counter()
+        delta = catalog_sync.poll()
+        print(f'    poll: {time.perf_counter() - start:.3f} s for {len(delta.inserted)} appended rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Compares reading the department, category and product views of a catalog with and without the
+product tree's read view cache, and shows what a stream of stock changes does to the hit rate.
+
+Run from the repository root with ``python -m benchmarks.bench_views``.
+"""
+import random
+import time
+
+from shopping.engine.structures import ProductTree
+
+from .bench_product_tree import synthetic_rows
+
+
+def browse(product_tree, rounds):
+    """Reads every department, category and product view ``rounds`` times, as the store tabs do."""
+    for _ in range(rounds):
+        for department in product_tree.get_departments():
+            for category in product_tree.get_categories(department):
+                product_tree.get_products(department, category)
+
+
+def main(size=200_000, rounds=20, changes=1000):
+    rows = list(synthetic_rows(size))
+    for label, cache_size in (('uncached', 0), ('cached', 4096)):
+        product_tree = ProductTree(view_cache_size=cache_size)
+        product_tree.add_products(rows)
+        start = time.perf_counter()
+        browse(product_tree, rounds)
+        print(f'{label:>8}: {time.perf_counter() - start:.3f} s for {rounds} passes over {size} products')
+
+    product_tree = ProductTree()
+    product_tree.add_products(rows)
+    products = list(product_tree.product_index)
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for _ in range(changes):
+        product_tree.reserve(rng.choice(products))
+        browse(product_tree, 1)
+    elapsed = time.perf_counter() - start
+    stats = product_tree.view_cache.stats()
+    print(f'  mixed: {elapsed:.3f} s for {changes} stock changes each followed by a pass, '
+          f'hit rate {stats["hit_rate"]:.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+Runs the pytest-benchmark suite in ``benchmarks/test_benchmarks.py``, saves the results, and compares
+them with the last saved run, failing if any benchmark's mean got slower than the allowed threshold.
+
+Run from the repository root with ``python -m benchmarks.run_suite [--threshold PERCENT]``. Any other
+arguments are passed to pytest, for example ``-k cart`` to run only the cart benchmarks.
+"""
+import argparse
+import glob
+import os
+import sys
+
+import pytest
+
+STORAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.benchmarks')
+SUITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_benchmarks.py')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and compare with the last run.")
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help="Fail if a mean is this many percent slower than the last saved run.")
+    arguments, pytest_arguments = parser.parse_known_args()
+    options = [SUITE, '--benchmark-only', f'--benchmark-storage=file://{STORAGE}', '--benchmark-autosave',
+               '--benchmark-sort=name']
+    if glob.glob(os.path.join(STORAGE, '**', '*.json'), recursive=True):
+        options += ['--benchmark-compare', f'--benchmark-compare-fail=mean:{arguments.threshold:g}%']
+    sys.exit(pytest.main(options + pytest_arguments))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+A pytest-benchmark suite over synthetic catalogs of 1k to 1M SKUs and carts of 1 to 10k items, timing
+the catalog loader, ProductTree updates and reads, ShoppingCart changes, and the GUI's total labels
+with Tk replaced by mocks.
+
+Run ``python -m benchmarks.run_suite`` to save each run and fail when it is slower than the last one
+saved. The module is skipped when pytest-benchmark is not installed.
+"""
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+# Skip before importing the project, so collection never depends on more than pytest-benchmark
+pytest.importorskip('pytest_benchmark')
+
+from shopping.engine.pricing import CartPricing  # noqa: E402
+from shopping.engine.structures import ProductTree, ShoppingCart  # noqa: E402
+from shopping.store_products import csv_to_products  # noqa: E402
+
+from .bench_loader import write_catalog  # noqa: E402
+from .bench_product_tree import synthetic_rows  # noqa: E402
+
+CATALOG_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+CART_SIZES = (1, 100, 10_000)
+CART_CATALOG_SIZE = 1_000
+
+
+def rounds_for(size):
+    """Fewer rounds for the largest inputs, which take seconds each."""
+    return 1 if size >= 1_000_000 else 3 if size >= 100_000 else 10
+
+
+@pytest.fixture(scope='session')
+def catalog_files(tmp_path_factory):
+    """Writes a synthetic catalog CSV for every size, once per run."""
+    directory = tmp_path_factory.mktemp('catalogs')
+    paths = {}
+    for size in CATALOG_SIZES:
+        paths[size] = os.path.join(directory, f'catalog-{size}.csv')
+        write_catalog(paths[size], size)
+    return paths
+
+
+@pytest.fixture(scope='session')
+def catalog_trees():
+    """Builds a product tree for every size, once per run. Benchmarks must not change them."""
+    trees = {}
+    for size in CATALOG_SIZES:
+        trees[size] = ProductTree()
+        trees[size].add_products(synthetic_rows(size))
+    return trees
+
+
+def filled_cart(product_tree, items):
+    """Returns a cart holding ``items`` units spread over the tree's products."""
+    cart = ShoppingCart(product_tree)
+    products = list(product_tree.product_index)
+    for i in range(items):
+        cart.add_to_cart(products[i % len(products)])
+    return cart
+
+
+@pytest.mark.parametrize('size', CATALOG_SIZES)
+def test_csv_to_products(benchmark, catalog_files, size):
+    tree = benchmark.pedantic(csv_to_products, args=(catalog_files[size],), kwargs={'use_snapshot': False},
+                              rounds=rounds_for(size))
+    assert len(tree.product_index) == size
+
+
+@pytest.mark.parametrize('size', CATALOG_SIZES)
+def test_add_product(benchmark, size):
+    tree = ProductTree()
+    tree.add_products(synthetic_rows(size))
+    counter = iter(range(10 ** 9))
+    benchmark(lambda: tree.add_product('Department 0', 'Category 0', f'New Product {next(counter)}', 9.99, 1))
+
+
+@pytest.mark.parametrize('size', CATALOG_SIZES)
+@pytest.mark.parametrize('cached', (True, False), ids=('cached', 'uncached'))
+def test_get_products(benchmark, catalog_trees, size, cached):
+    tree = catalog_trees[size]
+    if not cached:
+        benchmark.pedantic(ProductTree.product_details, args=(tree.find_node('Department 0', 'Category 0'),),
+                           rounds=rounds_for(size) * 10)
+    else:
+        products = benchmark(tree.get_products, 'Department 0', 'Category 0')
+        assert len(products) == size // 200
+
+
+@pytest.mark.parametrize('items', CART_SIZES)
+def test_cart_add(benchmark, catalog_trees, items):
+    tree = catalog_trees[CART_CATALOG_SIZE]
+    benchmark.pedantic(lambda cart: cart.add_to_cart('Product 0'), setup=lambda: ((filled_cart(tree, items),), {}),
+                       rounds=rounds_for(items) * 10)
+
+
+@pytest.mark.parametrize('items', CART_SIZES)
+def test_cart_remove(benchmark, catalog_trees, items):
+    tree = catalog_trees[CART_CATALOG_SIZE]
+    benchmark.pedantic(lambda cart: cart.remove_from_cart('Product 0'),
+                       setup=lambda: ((filled_cart(tree, items),), {}), rounds=rounds_for(items) * 10)
+
+
+@pytest.mark.parametrize('items', CART_SIZES)
+def test_cart_items(benchmark, catalog_trees, items):
+    cart = filled_cart(catalog_trees[CART_CATALOG_SIZE], items)
+    assert len(benchmark(cart.get_cart_items)) == items
+
+
+@pytest.mark.parametrize('items', CART_SIZES)
+def test_update_total_labels(benchmark, catalog_trees, items):
+    # Imported here: shopping.gui loads tkinter, which a headless host may not have
+    gui = pytest.importorskip('shopping.gui')
+    tree = catalog_trees[CART_CATALOG_SIZE]
+    with patch.object(gui, 'tk'), patch.object(gui, 'ttk'), patch.object(gui, 'messagebox'), \
+            patch.object(gui, 'csv_to_products', return_value=tree), patch.object(gui, 'replay_orders'), \
+            patch.object(gui, 'OrderLog'), patch.object(gui, 'CartStore'), patch.object(gui, 'CatalogSync'), \
+            patch.object(gui, 'read_promotions', return_value=([], 0)):
+        app = gui.GUI(MagicMock())
+        tree.unsubscribe(app.on_stock_changed)
+        app.shopping_cart = filled_cart(tree, items)
+        app.shopping_cart.subscribe(app.on_cart_changed)
+        app.cart_pricing = CartPricing(app.pricing_engine, app.shopping_cart)
+        benchmark(app.update_total_labels)
+        assert app.cart_pricing.total == app.shopping_cart.total_price
+        app.total_quantity_label.config.assert_called_with(text=f"Total Quantity: {items}")
@@ -1,3 +1,18 @@
-from . import store_products
-from . import engine
-from . import gui
\ No newline at end of file
+"""
+The shopping package. Its modules are imported the first time they are used, as in
+``shopping.store_products``, so code that only needs the engine or the loader never imports Tk.
+"""
+import importlib
+
+SUBMODULES = frozenset({'carts', 'engine', 'gui', 'loadgen', 'orders', 'service', 'snapshot', 'store_products'})
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        # import_module stores the module on the package, so this only runs once per module
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | SUBMODULES)
@@ -0,0 +1,211 @@
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from .engine.instrumentation import instrumented
+from .engine.structures import ShoppingCart
+
+CART_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'carts.db')
+STATEMENT_CACHE_SIZE = 64
+LINE = struct.Struct('<II')  # A saved cart line: product id, quantity
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS products (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)',
+    'CREATE TABLE IF NOT EXISTS carts (session TEXT PRIMARY KEY, lines BLOB NOT NULL, saved_at REAL NOT NULL)'
+    ' WITHOUT ROWID',
+)
+
+
+def encode_lines(lines):
+    """
+    Packs cart lines into a blob of little-endian uint32 (product id, quantity) pairs.
+
+    :param lines: (product id, quantity) pairs.
+    :return: The packed lines.
+    """
+    flat = [number for line in lines for number in line]
+    return struct.pack(f'<{len(flat)}I', *flat)
+
+
+def decode_lines(blob):
+    """
+    Unpacks a blob written by ``encode_lines``.
+
+    :param blob: The packed lines.
+    :return: A list of (product id, quantity) pairs.
+    """
+    return list(LINE.iter_unpack(blob))
+
+
+class CartStore:
+    """
+    This class represents shopping carts saved in a local SQLite database, keyed by session.
+
+    Each cart is one row holding its lines as packed (product id, quantity) pairs, and product names
+    are stored once in their own table. The store keeps a single connection open, with SQLite's
+    statement cache, and caches product ids in memory, so saving and restoring carts costs one
+    statement per batch rather than one per item.
+
+    :param path: The database file.
+    :type path: str
+    :param product_ids: Product ids keyed by product name.
+    :type product_ids: dict
+    :param product_names: Product names keyed by product id.
+    :type product_names: dict
+    """
+
+    def __init__(self, path=CART_STORE_PATH):
+        """
+        Opens the store, creating the database if it does not exist yet.
+
+        :param path: The database file.
+        :type path: str
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+        self.product_ids = dict(self.connection.execute('SELECT name, id FROM products'))
+        self.product_names = {product_id: name for name, product_id in self.product_ids.items()}
+
+    def product_id(self, name):
+        """
+        Retrieves the id of a product name, giving it one if it is new. The caller must hold ``lock``
+        and be inside a transaction.
+
+        :param name: The product name.
+        :type name: str
+        :return: The product's id.
+        :rtype: int
+        """
+        product_id = self.product_ids.get(name)
+        if product_id is None:
+            product_id = self.connection.execute('INSERT INTO products (name) VALUES (?)', (name,)).lastrowid
+            self.product_ids[name] = product_id
+            self.product_names[product_id] = name
+        return product_id
+
+    def save(self, session, cart):
+        """
+        Saves one session's cart, replacing what was saved before. An empty cart deletes the session.
+
+        :param session: The session id.
+        :type session: str
+        :param cart: The cart to save.
+        :type cart: ShoppingCart
+        """
+        self.save_many({session: cart})
+
+    @instrumented('carts.save_many')
+    def save_many(self, carts):
+        """
+        Saves several sessions' carts in one transaction. Empty carts delete their sessions.
+
+        :param carts: Carts keyed by session id.
+        :type carts: dict
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            rows = []
+            empty = []
+            for session, cart in carts.items():
+                if cart.lines:
+                    lines = ((self.product_id(product), line.quantity) for product, line in cart.lines.items())
+                    rows.append((session, encode_lines(lines), now))
+                else:
+                    empty.append((session,))
+            self.connection.executemany('INSERT OR REPLACE INTO carts (session, lines, saved_at) VALUES (?, ?, ?)',
+                                        rows)
+            self.connection.executemany('DELETE FROM carts WHERE session = ?', empty)
+
+    def saved_lines(self, session):
+        """
+        Retrieves the lines saved for a session.
+
+        :param session: The session id.
+        :type session: str
+        :return: (product, quantity) pairs, or None if nothing is saved for the session.
+        :rtype: list or None
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT lines FROM carts WHERE session = ?', (session,)).fetchone()
+        if row is None:
+            return None
+        names = self.product_names
+        return [(names[product_id], quantity) for product_id, quantity in LINE.iter_unpack(row[0])]
+
+    def iter_saved(self):
+        """
+        Reads every saved cart with one query.
+
+        :return: An iterator of (session, lines) pairs, where lines are (product, quantity) pairs.
+        :rtype: iterator
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT session, lines FROM carts').fetchall()
+        names = self.product_names
+        for session, blob in rows:
+            yield session, [(names[product_id], quantity) for product_id, quantity in LINE.iter_unpack(blob)]
+
+    def load(self, session, cart):
+        """
+        Restores a session's saved lines into a cart in one pass.
+
+        :param session: The session id.
+        :type session: str
+        :param cart: The cart to fill.
+        :type cart: ShoppingCart
+        :return: True if anything was saved for the session, False otherwise.
+        :rtype: bool
+        """
+        lines = self.saved_lines(session)
+        if lines is None:
+            return False
+        cart.load_lines(lines)
+        return True
+
+    @instrumented('carts.load_all')
+    def load_all(self, product_tree=None):
+        """
+        Restores every saved cart.
+
+        :param product_tree: The product tree the carts look prices up in.
+        :type product_tree: ProductTree, optional
+        :return: Carts keyed by session id.
+        :rtype: dict
+        """
+        carts = {}
+        for session, lines in self.iter_saved():
+            cart = carts[session] = ShoppingCart(product_tree)
+            cart.load_lines(lines)
+        return carts
+
+    def delete(self, session):
+        """
+        Forgets a session's saved cart.
+
+        :param session: The session id.
+        :type session: str
+        """
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM carts WHERE session = ?', (session,))
+
+    def sessions(self):
+        """
+        Lists the sessions with saved carts.
+
+        :return: The session ids.
+        :rtype: list
+        """
+        with self.lock:
+            return [session for session, in self.connection.execute('SELECT session FROM carts ORDER BY session')]
+
+    def close(self):
+        """Closes the database connection."""
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,2 @@
+from . import nodes
+from . import structures
@@ -0,0 +1,203 @@
+import atexit
+import contextlib
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+
+ENV_SWITCH = 'SHOPPING_INSTRUMENT'  # Set to 1 to record hot path timings from startup
+ENV_OUTPUT = 'SHOPPING_INSTRUMENT_OUTPUT'  # A .json or .prom file to write the timings to at exit
+BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0, 5.0)  # Seconds
+
+enabled = os.environ.get(ENV_SWITCH, '') not in ('', '0')
+
+
+class OperationStats:
+    """
+    This class represents the timings recorded for one operation.
+
+    :param count: The number of calls.
+    :type count: int
+    :param total: The total time spent in the calls, in seconds.
+    :type total: float
+    :param buckets: The number of calls that took at most each of ``BUCKETS`` seconds and more than the
+    one before, with one more slot for slower calls.
+    :type buckets: list
+    """
+
+    __slots__ = ('count', 'total', 'buckets')
+
+    def __init__(self):
+        """
+        This is where we set up an operation with no calls.
+        """
+
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+
+class Registry:
+    """
+    This class represents the timings of every instrumented operation.
+
+    :param operations: The timings keyed by operation name.
+    :type operations: dict
+    """
+
+    def __init__(self):
+        """
+        Initializes a registry with no timings.
+        """
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        """
+        Records one call of an operation.
+
+        :param name: The operation's name.
+        :type name: str
+        :param seconds: How long the call took.
+        :type seconds: float
+        """
+        with self.lock:
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = OperationStats()
+            stats.count += 1
+            stats.total += seconds
+            stats.buckets[bisect_left(BUCKETS, seconds)] += 1
+
+    def reset(self):
+        """Forgets every timing recorded so far."""
+        with self.lock:
+            self.operations = {}
+
+    def to_json(self):
+        """
+        Retrieves the timings as a JSON document.
+
+        :return: A JSON object keyed by operation name, whose values have 'count', 'total_seconds',
+        'mean_seconds' and 'buckets', a list of [upper bound, calls] pairs with 'inf' for the last bound.
+        :rtype: str
+        """
+        import json  # Only needed for dumps, so it stays off the import path of every engine user
+        with self.lock:
+            report = {}
+            for name, stats in sorted(self.operations.items()):
+                bounds = [*BUCKETS, 'inf']
+                report[name] = {"count": stats.count, "total_seconds": stats.total,
+                                "mean_seconds": stats.total / stats.count if stats.count else 0.0,
+                                "buckets": [[bound, calls] for bound, calls in zip(bounds, stats.buckets)]}
+        return json.dumps(report, indent=2)
+
+    def to_prometheus(self):
+        """
+        Retrieves the timings in the Prometheus text exposition format, as one histogram labelled by
+        operation.
+
+        :return: The exposition text.
+        :rtype: str
+        """
+        lines = ['# HELP shopping_operation_seconds Time spent in instrumented shopping operations.',
+                 '# TYPE shopping_operation_seconds histogram']
+        with self.lock:
+            for name, stats in sorted(self.operations.items()):
+                label = name.replace('\\', '\\\\').replace('"', '\\"')
+                cumulative = 0
+                for bound, calls in zip(BUCKETS, stats.buckets):
+                    cumulative += calls
+                    lines.append(f'shopping_operation_seconds_bucket{{operation="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'shopping_operation_seconds_bucket{{operation="{label}",le="+Inf"}} {stats.count}')
+                lines.append(f'shopping_operation_seconds_sum{{operation="{label}"}} {stats.total}')
+                lines.append(f'shopping_operation_seconds_count{{operation="{label}"}} {stats.count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """
+        Writes the timings to a file, in Prometheus format if its name ends in '.prom' and as JSON
+        otherwise.
+
+        :param path: The file to write.
+        :type path: str
+        """
+        text = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+
+
+registry = Registry()
+
+
+def enable():
+    """
+    Turns instrumentation on. Functions decorated with ``instrumented`` only record timings if it was
+    on when they were decorated, which for the shopping modules means when they were imported; use the
+    ``SHOPPING_INSTRUMENT`` environment variable to instrument those from startup.
+    """
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Turns instrumentation off for ``timed`` blocks and functions decorated from now on."""
+    global enabled
+    enabled = False
+
+
+def instrumented(name):
+    """
+    Decorates a function to record the count and latency of its calls under an operation name.
+
+    When instrumentation is off the function is returned unchanged, so it costs nothing at all.
+
+    :param name: The operation's name.
+    :type name: str
+    :return: The decorator.
+    :rtype: callable
+    """
+    def decorate(function):
+        if not enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                registry.record(name, time.perf_counter() - start)
+
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def timer(name):
+    """Times the body of a ``with`` block, which ``timed`` only creates while instrumentation is on."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.record(name, time.perf_counter() - start)
+
+
+NOT_TIMED = contextlib.nullcontext()
+
+
+def timed(name):
+    """
+    Returns a context manager that records how long its block takes under an operation name. When
+    instrumentation is off it is a shared do-nothing context manager.
+
+    :param name: The operation's name.
+    :type name: str
+    :return: The context manager.
+    """
+    return timer(name) if enabled else NOT_TIMED
+
+
+if enabled and os.environ.get(ENV_OUTPUT):
+    atexit.register(registry.dump, os.environ[ENV_OUTPUT])
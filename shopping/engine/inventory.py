@@ -0,0 +1,366 @@
+import heapq
+import itertools
+import threading
+import time
+
+from .instrumentation import instrumented
+from .structures import check_quantity
+
+HOLD_SECONDS = 15 * 60  # How long stock stays held for a cart before it goes back on sale
+
+
+class Hold:
+    """
+    This class represents stock of one product held for one cart.
+
+    :param quantity: The number of units held.
+    :type quantity: int
+    :param expires_at: When the hold runs out, on the engine's clock.
+    :type expires_at: float
+    """
+
+    __slots__ = ('quantity', 'expires_at')
+
+    def __init__(self):
+        """
+        This is where we set up an empty hold.
+        """
+
+        self.quantity = 0
+        self.expires_at = 0.0
+
+
+class InventoryEngine:
+    """
+    This class represents the stock reservations of many shopping carts sharing one product tree.
+
+    Adding an item to a cart through the engine takes the stock out of the tree straight away and
+    holds it for that cart for a limited time. Holds that run out are put back on sale by ``expire``.
+    ``checkout`` then commits a whole cart at once: every line is covered by its hold or by fresh
+    stock, or nothing changes.
+
+    Stock is guarded by the tree's striped locks, so carts buying different products do not wait on
+    each other. The engine's own bookkeeping of holds is guarded by ``holds_lock``. A single cart should
+    only be used by one thread at a time.
+
+    :param product_tree: The product tree whose stock is reserved.
+    :type product_tree: ProductTree
+    :param hold_seconds: How long a hold lasts after the cart last added the product.
+    :type hold_seconds: float
+    :param clock: The function that returns the current time, in seconds.
+    :type clock: callable
+    """
+
+    def __init__(self, product_tree, hold_seconds=HOLD_SECONDS, clock=time.monotonic):
+        """
+        Initializes an engine with no holds.
+
+        :param product_tree: The product tree whose stock is reserved.
+        :type product_tree: ProductTree
+        :param hold_seconds: How long a hold lasts after the cart last added the product.
+        :type hold_seconds: float
+        :param clock: The function that returns the current time, in seconds.
+        :type clock: callable
+        """
+        self.product_tree = product_tree
+        self.hold_seconds = hold_seconds
+        self.clock = clock
+        self.holds = {}  # Cart -> {product: Hold}
+        self.expiry_queue = []  # Heap of (expires_at, sequence, cart, product); stale entries are skipped
+        self.sequence = itertools.count()
+        self.holds_lock = threading.Lock()
+
+    @instrumented('inventory.add_to_cart')
+    def add_to_cart(self, cart, product, quantity=1):
+        """
+        Reserves stock of a product and adds it to a cart.
+
+        :param cart: The cart to add to.
+        :type cart: ShoppingCart
+        :param product: The name of the product.
+        :type product: str
+        :param quantity: The number of units to add.
+        :type quantity: int
+        :return: True if the units were reserved and added, False if there was not enough stock.
+        :rtype: bool
+        :raises ValueError: If the quantity is less than one.
+        """
+        check_quantity(quantity)
+        if not self.take_stock(product, quantity):
+            return False
+        self.add_holds(cart, [(product, quantity)])
+        cart.add_many([(product, quantity)])
+        return True
+
+    @instrumented('inventory.restore')
+    def restore(self, cart, lines):
+        """
+        Fills a cart with saved lines, for example a session restored from a ``CartStore``. Stock is held
+        for every line that is still available, and those lines are loaded into the cart in one pass.
+
+        :param cart: The cart to fill.
+        :type cart: ShoppingCart
+        :param lines: (product, quantity) pairs.
+        :type lines: iterable
+        :return: The (product, quantity) pairs that could not be restored.
+        :rtype: list
+        """
+        held = []
+        missing = []
+        for product, quantity in lines:
+            if quantity > 0:
+                (held if self.take_stock(product, quantity) else missing).append((product, quantity))
+        self.add_holds(cart, held)
+        cart.load_lines(held)
+        return missing
+
+    def take_stock(self, product, quantity):
+        """
+        Takes units of a product out of stock, sweeping expired holds back first if there are too few.
+
+        :return: True if the units were taken, False if there was not enough stock.
+        :rtype: bool
+        """
+        if self.product_tree.reserve(product, quantity):
+            return True
+        # Stock held by expired carts may not have been swept back yet
+        return bool(self.expire()) and self.product_tree.reserve(product, quantity)
+
+    def add_holds(self, cart, lines):
+        """
+        Holds units already taken out of stock for a cart, restarting each product's hold.
+
+        :param cart: The cart the units are held for.
+        :type cart: ShoppingCart
+        :param lines: (product, quantity) pairs.
+        :type lines: list
+        """
+        if not lines:
+            return
+        expires_at = self.clock() + self.hold_seconds
+        with self.holds_lock:
+            cart_holds = self.holds.setdefault(cart, {})
+            for product, quantity in lines:
+                hold = cart_holds.get(product)
+                if hold is None:
+                    hold = cart_holds[product] = Hold()
+                hold.quantity += quantity
+                hold.expires_at = expires_at
+                heapq.heappush(self.expiry_queue, (expires_at, next(self.sequence), cart, product))
+
+    def add_many(self, cart, lines):
+        """
+        Reserves stock for several products and adds them to a cart as one change, so the cart's
+        listeners are told once. Lines without enough stock are skipped.
+
+        :param cart: The cart to add to.
+        :type cart: ShoppingCart
+        :param lines: (product, quantity) pairs.
+        :type lines: iterable
+        :return: The (product, quantity) pairs that could not be added.
+        :rtype: list
+        :raises ValueError: If any quantity is less than one, before anything is added.
+        """
+        lines = list(lines)
+        for _, quantity in lines:
+            check_quantity(quantity)
+        missing = []
+        with cart.batch():
+            for product, quantity in lines:
+                if not self.add_to_cart(cart, product, quantity):
+                    missing.append((product, quantity))
+        return missing
+
+    def remove_many(self, cart, lines):
+        """
+        Removes several products from a cart as one change and puts their held stock back on sale.
+
+        :param cart: The cart to remove from.
+        :type cart: ShoppingCart
+        :param lines: (product, quantity) pairs. Each product loses at most the units it has.
+        :type lines: iterable
+        :return: The number of units removed.
+        :rtype: int
+        """
+        removed = 0
+        with cart.batch():
+            for product, quantity in lines:
+                count = cart.remove_many([(product, quantity)])
+                with self.holds_lock:
+                    released = self.take_hold(cart, product, count)
+                if released:
+                    self.product_tree.release(product, released)
+                removed += count
+        return removed
+
+    def set_quantity(self, cart, product, quantity):
+        """
+        Reserves or releases stock so that a cart holds exactly ``quantity`` units of a product.
+
+        :param cart: The cart to change.
+        :type cart: ShoppingCart
+        :param product: The name of the product.
+        :type product: str
+        :param quantity: The number of units wanted.
+        :type quantity: int
+        :return: True if the cart now holds that many units, False if there was not enough stock.
+        :rtype: bool
+        :raises ValueError: If the quantity is negative.
+        """
+        if quantity != 0:
+            check_quantity(quantity)
+        change = quantity - cart.get_quantity(product)
+        if change > 0:
+            return self.add_to_cart(cart, product, change)
+        if change < 0:
+            self.remove_many(cart, [(product, -change)])
+        return True
+
+    def remove_from_cart(self, cart, product):
+        """
+        Removes one unit of a product from a cart and puts its held stock back on sale.
+
+        :param cart: The cart to remove from.
+        :type cart: ShoppingCart
+        :param product: The name of the product.
+        :type product: str
+        :return: True if the unit was in the cart, False otherwise.
+        :rtype: bool
+        """
+        if not cart.remove_from_cart(product):
+            return False
+        with self.holds_lock:
+            released = self.take_hold(cart, product, 1)
+        if released:
+            self.product_tree.release(product, released)
+        return True
+
+    def release_cart(self, cart):
+        """
+        Empties a cart and puts all of its held stock back on sale, for example when a session ends.
+
+        :param cart: The cart to abandon.
+        :type cart: ShoppingCart
+        """
+        with self.holds_lock:
+            holds = self.holds.pop(cart, {})
+        for product, hold in holds.items():
+            self.product_tree.release(product, hold.quantity)
+        cart.clear_cart()
+
+    def held_quantity(self, cart, product):
+        """
+        Retrieves how many units of a product are currently held for a cart.
+
+        :param cart: The cart to look at.
+        :type cart: ShoppingCart
+        :param product: The name of the product.
+        :type product: str
+        :return: The number of units held.
+        :rtype: int
+        """
+        with self.holds_lock:
+            hold = self.holds.get(cart, {}).get(product)
+            return hold.quantity if hold is not None else 0
+
+    def take_hold(self, cart, product, quantity):
+        """
+        Drops up to ``quantity`` units from a cart's hold on a product. The caller must hold ``holds_lock``.
+
+        :return: The number of units dropped, which the caller must put back into stock.
+        :rtype: int
+        """
+        cart_holds = self.holds.get(cart)
+        hold = cart_holds.get(product) if cart_holds else None
+        if hold is None:
+            return 0
+        taken = min(quantity, hold.quantity)
+        hold.quantity -= taken
+        if not hold.quantity:
+            del cart_holds[product]
+            if not cart_holds:
+                del self.holds[cart]
+        return taken
+
+    @instrumented('inventory.expire')
+    def expire(self, now=None):
+        """
+        Puts the stock of every hold that has run out back on sale.
+
+        :param now: The current time on the engine's clock. Defaults to the clock's reading.
+        :type now: float, optional
+        :return: The number of units put back.
+        :rtype: int
+        """
+        if now is None:
+            now = self.clock()
+        expired = []
+        with self.holds_lock:
+            while self.expiry_queue and self.expiry_queue[0][0] <= now:
+                expires_at, _, cart, product = heapq.heappop(self.expiry_queue)
+                hold = self.holds.get(cart, {}).get(product)
+                if hold is not None and hold.expires_at == expires_at:
+                    expired.append((product, self.take_hold(cart, product, hold.quantity)))
+        for product, quantity in expired:
+            self.product_tree.release(product, quantity)
+        return sum(quantity for _, quantity in expired)
+
+    @instrumented('inventory.checkout')
+    def checkout(self, cart, clear=True):
+        """
+        Commits every line of a cart against the stock, all or nothing.
+
+        Units still held for the cart are used first. Any others are taken from stock now, for example
+        when a hold has expired. If any line cannot be covered nothing changes, the cart keeps its holds
+        and False is returned. On success the holds become sales and the cart is emptied.
+
+        :param cart: The cart to check out.
+        :type cart: ShoppingCart
+        :param clear: Whether to empty the cart on success. The caller empties it otherwise.
+        :type clear: bool, optional
+        :return: True if the cart was committed, False if there was not enough stock.
+        :rtype: bool
+        """
+        self.expire()
+        wanted = {product: line.quantity for product, line in cart.lines.items()}
+        with self.holds_lock:
+            holds = self.holds.pop(cart, {})
+        # Positive: units still to take from stock. Negative: held units the cart no longer contains.
+        needed = {product: quantity - (holds[product].quantity if product in holds else 0)
+                  for product, quantity in wanted.items()}
+        for product, hold in holds.items():
+            if product not in wanted:
+                needed[product] = -hold.quantity
+
+        product_index = self.product_tree.product_index
+        changed = []
+        locks = self.product_tree.locks_for(product for product, need in needed.items() if need)
+        for lock in locks:
+            lock.acquire()
+        try:
+            committed = all(product in product_index and (product_index[product].quantity or 0) >= need
+                            for product, need in needed.items() if need > 0)
+            if committed:
+                for product, need in needed.items():
+                    if need and product in product_index:
+                        p_node = product_index[product]
+                        p_node.quantity = (p_node.quantity or 0) - need
+                        p_node.parent.version += 1
+                        changed.append((product, p_node.quantity))
+                if changed:
+                    self.product_tree.version += 1
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+        if not committed:
+            with self.holds_lock:
+                for product, hold in holds.items():
+                    self.holds.setdefault(cart, {})[product] = hold
+                    heapq.heappush(self.expiry_queue, (hold.expires_at, next(self.sequence), cart, product))
+            return False
+        for product, quantity in changed:
+            self.product_tree.notify(product, quantity)
+        if clear:
+            cart.clear_cart()
+        return True
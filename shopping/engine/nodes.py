@@ -1,35 +1,97 @@
+from collections import deque
+from decimal import Decimal
+
+
 class CartItem:
     """
-    This class represents an item in the shopping cart.
+    This class represents an item in the shopping cart: one or more units of a product added one after
+    another at the same price.
 
     :param product: The product in the cart item.
     :type product: str, optional
+    :param price: The unit price the product was added at.
+    :type price: decimal.Decimal, optional
+    :param quantity: The number of units in the cart item.
+    :type quantity: int, optional
     """
 
-    def __init__(self, product=None):
+    __slots__ = ('product', 'price', 'quantity', 'prev', 'next')
+
+    def __init__(self, product=None, price=None, quantity=1):
         """
         This is where we set up the cart item.
 
         :param product: The product in the cart item.
         :type product: str, optional
+        :param price: The unit price the product was added at.
+        :type price: decimal.Decimal, optional
+        :param quantity: The number of units in the cart item.
+        :type quantity: int, optional
         """
 
         self.product = product
+        self.price = price
+        self.quantity = quantity
+        self.prev = None
         self.next = None
 
 
+class CartLine:
+    """
+    This class represents a line in the shopping cart: every unit of one product.
+
+    :param product: The product on the line.
+    :type product: str
+    :param quantity: The number of units of the product in the cart.
+    :type quantity: int
+    :param items: The product's cart items, oldest first.
+    :type items: collections.deque
+    :param subtotal: The sum of the line's item prices.
+    :type subtotal: decimal.Decimal
+    """
+
+    __slots__ = ('product', 'quantity', 'items', 'subtotal')
+
+    def __init__(self, product):
+        """
+        This is where we set up an empty cart line.
+
+        :param product: The product on the line.
+        :type product: str
+        """
+
+        self.product = product
+        self.quantity = 0
+        self.items = deque()
+        self.subtotal = Decimal('0')
+
+
 class ProductNode:
     """
     This class represents a product.
 
+    Nodes use ``__slots__`` and only allocate their child list and index once a child is added, so
+    the many leaf products in a catalog carry no per-node containers.
+
     :param name: The product's name.
     :type name: str
     :param price: The product's price.
     :type price: float, optional
     :param quantity: The product's quantity.
     :type quantity: int, optional
+    :param subcategories: The child nodes, in insertion order.
+    :type subcategories: list
+    :param children: The child nodes keyed by name, kept in step with ``subcategories``.
+    :type children: dict
+    :param parent: The node this one was added under.
+    :type parent: ProductNode, optional
+    :param version: Bumped whenever a child is added or removed, and on a category whenever one of its
+    products changes, so cached views of the node can tell when they are out of date.
+    :type version: int
     """
 
+    __slots__ = ('name', 'price', 'quantity', 'parent', 'version', '_subcategories', '_children')
+
     def __init__(self, name, price=None, quantity=None):
         """
         This is where we set up the product.
@@ -45,4 +107,64 @@ class ProductNode:
         self.name = name
         self.price = price
         self.quantity = quantity
-        self.subcategories = []
\ No newline at end of file
+        self.parent = None
+        self.version = 0
+        self._subcategories = None
+        self._children = None
+
+    @property
+    def subcategories(self):
+        """
+        The child nodes, in insertion order. Reading this on a leaf allocates its (empty) list.
+
+        :rtype: list
+        """
+        if self._subcategories is None:
+            self._subcategories = []
+        return self._subcategories
+
+    @property
+    def children(self):
+        """
+        The child nodes keyed by name. Reading this on a leaf allocates its (empty) index.
+
+        :rtype: dict
+        """
+        if self._children is None:
+            self._children = {}
+        return self._children
+
+    def iter_children(self):
+        """
+        Iterates over the child nodes without allocating anything for a leaf.
+
+        :return: An iterator over the child nodes, in insertion order.
+        :rtype: iterator
+        """
+        return iter(self._subcategories or ())
+
+    def get_child(self, name):
+        """
+        Looks up a child node by name without allocating anything for a leaf.
+
+        :param name: The name of the child.
+        :type name: str
+        :return: The child node, or None if there is no such child.
+        :rtype: ProductNode or None
+        """
+        return self._children.get(name) if self._children is not None else None
+
+    def add_child(self, node):
+        """
+        Appends a child node and indexes it by name.
+
+        :param node: The node to add under this one.
+        :type node: ProductNode
+        :return: The node that was added.
+        :rtype: ProductNode
+        """
+        self.subcategories.append(node)
+        self.children[node.name] = node
+        node.parent = self
+        self.version += 1
+        return node
@@ -0,0 +1,406 @@
+from bisect import bisect_right
+from decimal import ROUND_HALF_UP, Decimal
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal('100')
+ZERO = Decimal('0')
+ONE = Decimal('1')
+
+
+def to_decimal(number):
+    """Converts a price, percent or rate to an exact decimal, going through str so floats keep their printed value."""
+    return number if isinstance(number, Decimal) else Decimal(str(number))
+
+
+class PricingRule:
+    """
+    This class represents a promotion. It applies to one product, to a category, to a whole department
+    or, with none of them given, to the whole store.
+
+    :param scope: Where the rule applies: ('product', name), ('category', department, category),
+    ('department', name) or ('store',).
+    :type scope: tuple
+    """
+
+    kind = None
+
+    def __init__(self, department=None, category=None, product=None):
+        """
+        Sets where the rule applies. The narrowest scope given wins.
+
+        :param department: The department the rule applies to.
+        :type department: str, optional
+        :param category: The category the rule applies to, within ``department``.
+        :type category: str, optional
+        :param product: The product the rule applies to.
+        :type product: str, optional
+        :raises ValueError: If a category is given without its department.
+        """
+        if product is not None:
+            self.scope = ('product', product)
+        elif category is not None:
+            if department is None:
+                raise ValueError(f"Category {category!r} needs its department.")
+            self.scope = ('category', department, category)
+        elif department is not None:
+            self.scope = ('department', department)
+        else:
+            self.scope = ('store',)
+
+
+class PercentOff(PricingRule):
+    """
+    This class represents a percentage taken off the price.
+
+    :param percent: The percentage off, for example 15 for 15% off.
+    :type percent: decimal.Decimal
+    """
+
+    kind = 'percent_off'
+
+    def __init__(self, percent, department=None, category=None, product=None):
+        """
+        Sets up a percent-off rule.
+
+        :param percent: The percentage off, between 0 and 100.
+        :type percent: float or decimal.Decimal
+        :raises ValueError: If the percentage is out of range.
+        """
+        super().__init__(department, category, product)
+        self.percent = to_decimal(percent)
+        if not ZERO <= self.percent <= HUNDRED:
+            raise ValueError(f"Percent off must be between 0 and 100, not {percent}.")
+
+
+class BuyGetFree(PricingRule):
+    """
+    This class represents a multi-buy: for every ``buy`` units of a product, ``free`` more are free.
+
+    :param buy: The units paid for in each group.
+    :type buy: int
+    :param free: The units given free in each group.
+    :type free: int
+    """
+
+    kind = 'buy_get_free'
+
+    def __init__(self, buy, free, department=None, category=None, product=None):
+        """
+        Sets up a buy-N-get-M-free rule.
+
+        :param buy: The units paid for in each group.
+        :type buy: int
+        :param free: The units given free in each group.
+        :type free: int
+        :raises ValueError: If ``buy`` or ``free`` is not positive.
+        """
+        super().__init__(department, category, product)
+        if buy < 1 or free < 1:
+            raise ValueError(f"Buy {buy} get {free} free needs both counts to be at least 1.")
+        self.buy = buy
+        self.free = free
+
+
+class TieredDiscount(PricingRule):
+    """
+    This class represents bulk pricing: the more units of a product on a line, the larger the
+    percentage off.
+
+    :param tiers: (minimum quantity, percent off) pairs.
+    :type tiers: list
+    """
+
+    kind = 'tiered'
+
+    def __init__(self, tiers, department=None, category=None, product=None):
+        """
+        Sets up a tiered rule.
+
+        :param tiers: (minimum quantity, percent off) pairs, in any order.
+        :type tiers: iterable
+        :raises ValueError: If a percentage is out of range.
+        """
+        super().__init__(department, category, product)
+        self.tiers = sorted((minimum, to_decimal(percent)) for minimum, percent in tiers)
+        for _, percent in self.tiers:
+            if not ZERO <= percent <= HUNDRED:
+                raise ValueError(f"Percent off must be between 0 and 100, not {percent}.")
+
+
+RULE_TYPES = {rule_type.kind: rule_type for rule_type in (PercentOff, BuyGetFree, TieredDiscount)}
+
+
+def rule_from_dict(record):
+    """
+    Builds a rule from its dictionary form, as stored in a promotions file, for example
+    ``{"type": "percent_off", "percent": 10, "department": "Clothing"}``.
+
+    :param record: The rule's 'type' and the keyword arguments of its class.
+    :type record: dict
+    :return: The rule.
+    :rtype: PricingRule
+    :raises ValueError: If the type is unknown or the arguments do not fit it.
+    """
+    arguments = dict(record)
+    rule_type = RULE_TYPES.get(arguments.pop('type', None))
+    if rule_type is None:
+        raise ValueError(f"Unknown promotion type {record.get('type')!r}.")
+    try:
+        return rule_type(**arguments)
+    except TypeError as error:
+        raise ValueError(f"Bad promotion {record!r}: {error}") from None
+
+
+class LinePricing:
+    """
+    This class represents every rule that applies to one product, compiled into the form a cart line is
+    priced from.
+
+    :param place: The (department, category) the product was in when this was compiled, or None.
+    :type place: tuple or None
+    :param percent: The best percent-off.
+    :type percent: decimal.Decimal
+    :param deals: The (buy, free) multi-buys.
+    :type deals: tuple
+    :param tier_quantities: The tier thresholds, ascending.
+    :type tier_quantities: list
+    :param tier_percents: The best percentage off reached at each threshold.
+    :type tier_percents: list
+    """
+
+    __slots__ = ('place', 'percent', 'deals', 'tier_quantities', 'tier_percents')
+
+    def __init__(self, place, percent, deals, tiers):
+        """
+        This is where we set up a product's compiled pricing.
+
+        :param place: The (department, category) of the product, or None if it is not in the catalog.
+        :type place: tuple or None
+        :param percent: The best percent-off.
+        :type percent: decimal.Decimal
+        :param deals: The (buy, free) multi-buys.
+        :type deals: tuple
+        :param tiers: Every applicable (minimum quantity, percent off) tier, sorted.
+        :type tiers: list
+        """
+
+        self.place = place
+        self.percent = percent
+        self.deals = deals
+        self.tier_quantities = []
+        self.tier_percents = []
+        best = ZERO
+        for minimum, tier_percent in tiers:
+            best = max(best, tier_percent)
+            self.tier_quantities.append(minimum)
+            self.tier_percents.append(best)
+
+    def discount(self, quantity, subtotal):
+        """
+        Prices a cart line. Multi-buy units come off first, then the percent-off and the bulk tier are
+        applied one after the other. Of several rules of one kind, only the best applies.
+
+        :param quantity: The number of units on the line.
+        :type quantity: int
+        :param subtotal: The line's price before promotions.
+        :type subtotal: decimal.Decimal
+        :return: The amount taken off the line, rounded to the cent.
+        :rtype: decimal.Decimal
+        """
+        if not quantity:
+            return ZERO
+        free = max((quantity // (buy + gift) * gift for buy, gift in self.deals), default=0)
+        tier = bisect_right(self.tier_quantities, quantity)
+        tier_percent = self.tier_percents[tier - 1] if tier else ZERO
+        if not free and not self.percent and not tier_percent:
+            return ZERO
+        paid = subtotal * (quantity - free) / quantity if free else subtotal
+        net = paid * (ONE - self.percent / HUNDRED) * (ONE - tier_percent / HUNDRED)
+        return subtotal - net.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class PricingEngine:
+    """
+    This class represents the store's promotions and tax, compiled into lookup tables.
+
+    Rules are indexed by their scope when they are added, so finding the rules for a product is a few
+    dictionary lookups however many rules there are. Each product's rules are then compiled once into
+    a ``LinePricing`` and kept until the rules change or the product moves to another category.
+
+    :param product_tree: The catalog that says which department and category a product is in.
+    :type product_tree: ProductTree
+    :param tax_rate: The sales tax charged on the discounted total, for example 0.08. Zero for none.
+    :type tax_rate: decimal.Decimal
+    :param version: Bumped whenever rules are added or removed, so cart pricings know to start over.
+    :type version: int
+    """
+
+    def __init__(self, product_tree, rules=(), tax_rate=0):
+        """
+        Compiles a set of rules.
+
+        :param product_tree: The catalog products are looked up in.
+        :type product_tree: ProductTree
+        :param rules: The promotions.
+        :type rules: iterable
+        :param tax_rate: The sales tax rate. Zero for none.
+        :type tax_rate: float or decimal.Decimal
+        """
+        self.product_tree = product_tree
+        self.tax_rate = to_decimal(tax_rate)
+        self.version = 0
+        self.clear_rules()
+        self.add_rules(rules)
+
+    def clear_rules(self):
+        """Removes every rule."""
+        self.percents = {}  # Scope -> best percent off
+        self.deals = {}  # Scope -> [(buy, free)]
+        self.tiers = {}  # Scope -> [(minimum quantity, percent off)]
+        self.product_pricing = {}  # Product -> LinePricing
+        self.rule_count = 0
+        self.version += 1
+
+    def add_rules(self, rules):
+        """
+        Compiles more rules into the lookup tables.
+
+        :param rules: The promotions to add.
+        :type rules: iterable
+        :return: The number of rules added.
+        :rtype: int
+        """
+        count = 0
+        for rule in rules:
+            if isinstance(rule, PercentOff):
+                self.percents[rule.scope] = max(self.percents.get(rule.scope, ZERO), rule.percent)
+            elif isinstance(rule, BuyGetFree):
+                self.deals.setdefault(rule.scope, []).append((rule.buy, rule.free))
+            elif isinstance(rule, TieredDiscount):
+                self.tiers.setdefault(rule.scope, []).extend(rule.tiers)
+            else:
+                raise TypeError(f"Not a pricing rule: {rule!r}")
+            count += 1
+        if count:
+            self.rule_count += count
+            self.product_pricing = {}
+            self.version += 1
+        return count
+
+    def pricing_for(self, product):
+        """
+        Retrieves a product's compiled pricing, compiling it on first use.
+
+        :param product: The name of the product.
+        :type product: str
+        :return: The product's pricing.
+        :rtype: LinePricing
+        """
+        location = self.product_tree.locate(product)
+        place = location[:2] if location is not None else None
+        pricing = self.product_pricing.get(product)
+        if pricing is None or pricing.place != place:
+            scopes = [('product', product), ('store',)]
+            if place is not None:
+                scopes[1:1] = [('category',) + place, ('department', place[0])]
+            percent = max((self.percents[scope] for scope in scopes if scope in self.percents), default=ZERO)
+            deals = tuple(deal for scope in scopes for deal in self.deals.get(scope, ()))
+            tiers = sorted(tier for scope in scopes for tier in self.tiers.get(scope, ()))
+            pricing = self.product_pricing[product] = LinePricing(place, percent, deals, tiers)
+        return pricing
+
+    def line_discount(self, product, quantity, subtotal):
+        """
+        Prices one cart line.
+
+        :param product: The name of the product.
+        :type product: str
+        :param quantity: The number of units on the line.
+        :type quantity: int
+        :param subtotal: The line's price before promotions.
+        :type subtotal: decimal.Decimal
+        :return: The amount taken off the line.
+        :rtype: decimal.Decimal
+        """
+        return self.pricing_for(product).discount(quantity, subtotal)
+
+    def tax(self, amount):
+        """
+        Works out the tax on an amount.
+
+        :param amount: The discounted total.
+        :type amount: decimal.Decimal
+        :return: The tax, rounded to the cent.
+        :rtype: decimal.Decimal
+        """
+        if not self.tax_rate:
+            return ZERO
+        return (amount * self.tax_rate).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class CartPricing:
+    """
+    This class represents the priced totals of one shopping cart, kept up to date incrementally.
+
+    ``refresh`` compares every line's quantity and subtotal with what it last priced and only prices the
+    lines that changed, so a click that changes one line prices one line whatever the size of the cart
+    or the number of rules.
+
+    :param engine: The promotions and tax to apply.
+    :type engine: PricingEngine
+    :param cart: The cart being priced.
+    :type cart: ShoppingCart
+    :param subtotal: The cart's total before promotions.
+    :type subtotal: decimal.Decimal
+    :param discount: The total taken off by promotions.
+    :type discount: decimal.Decimal
+    :param tax: The tax on the discounted total.
+    :type tax: decimal.Decimal
+    :param total: What the cart costs.
+    :type total: decimal.Decimal
+    """
+
+    def __init__(self, engine, cart):
+        """
+        Prices a cart.
+
+        :param engine: The promotions and tax to apply.
+        :type engine: PricingEngine
+        :param cart: The cart to price.
+        :type cart: ShoppingCart
+        """
+        self.engine = engine
+        self.cart = cart
+        self.lines = {}  # Product -> (quantity, subtotal, discount) as last priced
+        self.engine_version = None
+        self.subtotal = self.discount = self.tax = self.total = ZERO
+        self.refresh()
+
+    def refresh(self):
+        """
+        Prices the lines that changed since the last refresh and updates the totals.
+
+        :return: What the cart costs.
+        :rtype: decimal.Decimal
+        """
+        if self.engine_version != self.engine.version:
+            self.lines = {}
+            self.discount = ZERO
+            self.engine_version = self.engine.version
+        priced = self.lines
+        cart_lines = self.cart.lines
+        discount = self.discount
+        for product, line in cart_lines.items():
+            last = priced.get(product)
+            if last is None or last[0] != line.quantity or last[1] != line.subtotal:
+                line_discount = self.engine.line_discount(product, line.quantity, line.subtotal)
+                discount += line_discount - (last[2] if last is not None else ZERO)
+                priced[product] = (line.quantity, line.subtotal, line_discount)
+        if len(priced) > len(cart_lines):
+            for product in [product for product in priced if product not in cart_lines]:
+                discount -= priced.pop(product)[2]
+        self.discount = discount
+        self.subtotal = self.cart.total_price
+        self.tax = self.engine.tax(self.subtotal - discount)
+        self.total = self.subtotal - discount + self.tax
+        return self.total
@@ -0,0 +1,142 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import nlargest
+from operator import mul
+
+
+class CatalogColumns:
+    """
+    This class represents a column-oriented copy of every product in a product tree, built for
+    inventory queries.
+
+    Products are stored in tree order, so each department and each category covers one contiguous
+    range of rows and can be aggregated with a single slice. Prices and quantities are also sorted, on
+    first use, so that range filters are a binary search.
+
+    :param names: The product names, one per row.
+    :type names: list
+    :param prices: The product prices.
+    :type prices: array.array
+    :param quantities: The product quantities.
+    :type quantities: array.array
+    :param values: Each product's price multiplied by its quantity.
+    :type values: array.array
+    :param department_ranges: (department, start row, end row) for every department.
+    :type department_ranges: list
+    :param category_ranges: ((department, category), start row, end row) for every category.
+    :type category_ranges: list
+    """
+
+    def __init__(self, store):
+        """
+        Builds the columns from the root node of a product tree.
+
+        :param store: The root node of the product tree.
+        :type store: ProductNode
+        """
+        self.names = []
+        self.prices = array('d')
+        self.quantities = array('q')
+        self.department_ranges = []
+        self.category_ranges = []
+
+        for department_node in store.iter_children():
+            department_start = len(self.names)
+            for category_node in department_node.iter_children():
+                category_start = len(self.names)
+                for product_node in category_node.iter_children():
+                    self.names.append(product_node.name)
+                    self.prices.append(product_node.price or 0.0)
+                    self.quantities.append(product_node.quantity or 0)
+                self.category_ranges.append(((department_node.name, category_node.name), category_start,
+                                             len(self.names)))
+            self.department_ranges.append((department_node.name, department_start, len(self.names)))
+
+        self.values = array('d', map(mul, self.prices, self.quantities))
+        self.price_order = self.sorted_prices = None
+        self.quantity_order = self.sorted_quantities = None
+
+    @staticmethod
+    def sort_column(column):
+        """
+        Sorts a column, keeping track of which row each sorted value came from.
+
+        :param column: The column to sort.
+        :type column: array.array
+        :return: A (row order, sorted column) tuple.
+        :rtype: tuple
+        """
+        order = sorted(range(len(column)), key=column.__getitem__)
+        return order, array(column.typecode, map(column.__getitem__, order))
+
+    def price_range(self, low, high):
+        """
+        Finds the products priced between two bounds, inclusive.
+
+        :param low: The lowest price to include.
+        :type low: float
+        :param high: The highest price to include.
+        :type high: float
+        :return: The matching product names, cheapest first.
+        :rtype: list
+        """
+        if self.price_order is None:
+            self.price_order, self.sorted_prices = self.sort_column(self.prices)
+        start = bisect_left(self.sorted_prices, low)
+        end = bisect_right(self.sorted_prices, high)
+        return list(map(self.names.__getitem__, self.price_order[start:end]))
+
+    def low_stock(self, threshold):
+        """
+        Finds the products whose quantity is below a threshold.
+
+        :param threshold: The quantity products must be below.
+        :type threshold: int
+        :return: (name, quantity) tuples, lowest stock first.
+        :rtype: list
+        """
+        if self.quantity_order is None:
+            self.quantity_order, self.sorted_quantities = self.sort_column(self.quantities)
+        end = bisect_left(self.sorted_quantities, threshold)
+        rows = self.quantity_order[:end]
+        return list(zip(map(self.names.__getitem__, rows), map(self.quantities.__getitem__, rows)))
+
+    def top_by_value(self, n):
+        """
+        Finds the products with the most stock value (price times quantity).
+
+        :param n: The number of products to return.
+        :type n: int
+        :return: (name, value) tuples, highest value first.
+        :rtype: list
+        """
+        rows = nlargest(n, range(len(self.values)), key=self.values.__getitem__)
+        return [(self.names[row], self.values[row]) for row in rows]
+
+    def value_report(self, level='department'):
+        """
+        Sums, counts and averages stock value (price times quantity) per department or category.
+
+        :param level: Either 'department' or 'category'.
+        :type level: str
+        :return: A dictionary keyed by department name, or by (department, category) tuple, whose values
+        are dictionaries with keys 'sum', 'count' and 'mean'.
+        :rtype: dict
+        """
+        if level == 'department':
+            ranges = self.department_ranges
+        elif level == 'category':
+            ranges = self.category_ranges
+        else:
+            raise ValueError(f"Unknown report level {level!r}; expected 'department' or 'category'.")
+
+        report = {}
+        for key, start, end in ranges:
+            count = end - start
+            total = sum(self.values[start:end])
+            report[key] = {
+                "sum": total,
+                "count": count,
+                "mean": total / count if count else 0.0
+            }
+        return report
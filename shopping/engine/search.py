@@ -0,0 +1,125 @@
+from bisect import bisect_left
+from collections import Counter
+from heapq import nlargest
+
+
+def trigrams(text):
+    """
+    Splits text into its overlapping three-character pieces, padded so short words still match.
+
+    :param text: The lowercased text to split.
+    :type text: str
+    :return: The set of trigrams.
+    :rtype: set
+    """
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    This class represents a search index over product names.
+
+    Every word of every name is a key in a sorted list, so a prefix of any word is found with a
+    binary search. When no prefix matches, names are ranked by how many trigrams they share with the
+    query, which tolerates typos. The trigram index is only built the first time it is needed.
+
+    :param names: The product names, by id.
+    :type names: list
+    :param keys: The sorted, lowercased name suffixes that start at a word.
+    :type keys: list
+    :param key_ids: The id of the name each key came from.
+    :type key_ids: list
+    """
+
+    def __init__(self, names):
+        """
+        Builds the prefix index for a collection of product names.
+
+        :param names: The product names to index.
+        :type names: iterable
+        """
+        self.names = list(names)
+        entries = []
+        for name_id, name in enumerate(self.names):
+            lowered = name.lower()
+            start = 0
+            for word in lowered.split():
+                start = lowered.index(word, start)
+                entries.append((lowered[start:], name_id))
+                start += len(word)
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.key_ids = [name_id for _, name_id in entries]
+        self.grams = None
+
+    def prefix_search(self, query, limit=10):
+        """
+        Finds the names with a word that starts with the query, in alphabetical order of that word.
+
+        :param query: The text to look for.
+        :type query: str
+        :param limit: The most names to return.
+        :type limit: int
+        :return: The matching product names.
+        :rtype: list
+        """
+        query = ' '.join(query.lower().split())
+        if not query:
+            return []
+        found = {}
+        position = bisect_left(self.keys, query)
+        while position < len(self.keys) and len(found) < limit and self.keys[position].startswith(query):
+            found.setdefault(self.key_ids[position], None)
+            position += 1
+        return [self.names[name_id] for name_id in found]
+
+    def fuzzy_search(self, query, limit=10):
+        """
+        Finds the names that share the most trigrams with the query.
+
+        :param query: The text to look for.
+        :type query: str
+        :param limit: The most names to return.
+        :type limit: int
+        :return: The closest product names, best match first.
+        :rtype: list
+        """
+        query = ' '.join(query.lower().split())
+        if not query:
+            return []
+        query_grams = trigrams(query)
+        if self.grams is None:
+            self.grams = {}
+            for name_id, name in enumerate(self.names):
+                for gram in trigrams(name.lower()):
+                    self.grams.setdefault(gram, []).append(name_id)
+
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self.grams.get(gram, ()))
+        # Require half of the query's trigrams so names sharing only a common trigram or two are dropped.
+        threshold = max(1, len(query_grams) // 2)
+        names = self.names
+
+        def similarity(name_id):
+            # Shared trigrams over all trigrams of both; a padded name of length n has n + 1 of them.
+            count = shared[name_id]
+            return count / (len(query_grams) + len(names[name_id]) + 1 - count)
+
+        best = nlargest(limit, (name_id for name_id, count in shared.items() if count >= threshold), key=similarity)
+        return [self.names[name_id] for name_id in best]
+
+    def search(self, query, limit=10):
+        """
+        Finds products by name prefix, falling back to fuzzy matches when no name has a word that starts
+        with the query.
+
+        :param query: The text to look for.
+        :type query: str
+        :param limit: The most names to return.
+        :type limit: int
+        :return: The matching product names.
+        :rtype: list
+        """
+        return self.prefix_search(query, limit) or self.fuzzy_search(query, limit)
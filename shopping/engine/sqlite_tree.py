@@ -0,0 +1,382 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+from .instrumentation import instrumented
+from .nodes import ProductNode
+from .structures import NO_PRODUCTS, check_quantity
+
+HOT_CACHE_SIZE = 10000  # Product nodes kept in memory before the least recently used one is dropped
+STATEMENT_CACHE_SIZE = 64
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS departments (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)',
+    'CREATE TABLE IF NOT EXISTS categories (id INTEGER PRIMARY KEY, department_id INTEGER NOT NULL,'
+    ' name TEXT NOT NULL, UNIQUE (department_id, name))',
+    'CREATE TABLE IF NOT EXISTS products (id INTEGER PRIMARY KEY, category_id INTEGER NOT NULL,'
+    ' name TEXT NOT NULL, price REAL, quantity INTEGER, UNIQUE (category_id, name))',
+    'CREATE INDEX IF NOT EXISTS products_by_name ON products (name)',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID',
+)
+
+# Every statement is one of these constants, so the connection's statement cache prepares each only once
+INSERT_DEPARTMENT = 'INSERT INTO departments (name) VALUES (?)'
+INSERT_CATEGORY = 'INSERT INTO categories (department_id, name) VALUES (?, ?)'
+UPSERT_PRODUCT = ('INSERT INTO products (category_id, name, price, quantity) VALUES (?, ?, ?, ?)'
+                  ' ON CONFLICT (category_id, name) DO UPDATE SET price = excluded.price, quantity = excluded.quantity')
+TAKE_ONE_UNIT = 'UPDATE products SET quantity = quantity - 1 WHERE category_id = ? AND name = ? AND quantity > 0'
+DELETE_PRODUCT = 'DELETE FROM products WHERE category_id = ? AND name = ?'
+SELECT_PRODUCTS = 'SELECT name, price, quantity FROM products WHERE category_id = ? ORDER BY id'
+SELECT_PRODUCT_BY_NAME = 'SELECT id, price, quantity FROM products WHERE name = ? ORDER BY id DESC LIMIT 1'
+SELECT_PRODUCT_IN_CATEGORY = 'SELECT quantity FROM products WHERE category_id = ? AND name = ?'
+RESERVE = 'UPDATE products SET quantity = quantity - :quantity WHERE id = :id AND ifnull(quantity, 0) >= :quantity'
+RELEASE = 'UPDATE products SET quantity = ifnull(quantity, 0) + :quantity WHERE id = :id'
+
+
+class SQLiteProductTree:
+    """
+    This class represents a product tree kept in an indexed SQLite database instead of in Python
+    objects, for catalogs larger than memory. It answers the same ``get_departments``,
+    ``get_categories``, ``get_products``, ``add_product`` and ``remove_product`` calls as
+    ``ProductTree``, with the same return types.
+
+    Only the department and category ids are held in memory. Products are read from the database, and
+    the most recently used ones are kept in a bounded cache of detached ``ProductNode`` copies, which
+    ``get_product_node`` answers from. Every change drops the product's cached copy.
+
+    :param path: The database file, or ':memory:'.
+    :type path: str
+    :param hot_cache_size: The most product nodes to cache. Zero disables the cache.
+    :type hot_cache_size: int
+    :param version: Bumped by every change made through the tree.
+    :type version: int
+    :param hits: The number of product lookups answered from the cache.
+    :type hits: int
+    :param misses: The number of product lookups that read the database.
+    :type misses: int
+    """
+
+    def __init__(self, path=':memory:', hot_cache_size=HOT_CACHE_SIZE):
+        """
+        Opens a product tree database, creating its tables if they do not exist yet.
+
+        :param path: The database file, or ':memory:'.
+        :type path: str
+        :param hot_cache_size: The most product nodes to cache. Zero disables the cache.
+        :type hot_cache_size: int
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+        self.load_ids()
+        self.hot_cache_size = hot_cache_size
+        self.hot_products = OrderedDict()  # Product name -> ProductNode, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+
+    def load_ids(self):
+        """Reads the department and category ids into memory, in the order they were added."""
+        self.department_ids = dict(self.connection.execute('SELECT name, id FROM departments ORDER BY id'))
+        self.category_ids = {}  # (department, category) -> id
+        self.department_categories = {department: [] for department in self.department_ids}
+        for department, category, category_id in self.connection.execute(
+                'SELECT d.name, c.name, c.id FROM categories c JOIN departments d ON d.id = c.department_id'
+                ' ORDER BY c.id'):
+            self.category_ids[department, category] = category_id
+            self.department_categories[department].append(category)
+
+    def category_id(self, department, category):
+        """
+        Retrieves the id of a category, creating the department and category if they are new. The
+        caller must hold ``lock`` and be inside a transaction.
+
+        :param department: The name of the department.
+        :type department: str
+        :param category: The name of the category.
+        :type category: str
+        :return: The category's id.
+        :rtype: int
+        """
+        category_id = self.category_ids.get((department, category))
+        if category_id is None:
+            department_id = self.department_ids.get(department)
+            if department_id is None:
+                department_id = self.connection.execute(INSERT_DEPARTMENT, (department,)).lastrowid
+                self.department_ids[department] = department_id
+                self.department_categories[department] = []
+            category_id = self.connection.execute(INSERT_CATEGORY, (department_id, category)).lastrowid
+            self.category_ids[department, category] = category_id
+            self.department_categories[department].append(category)
+        return category_id
+
+    @instrumented('sqlite_tree.add_product')
+    def add_product(self, department, category, product, price, quantity):
+        """
+        Adds a product under the specified department and category, or updates its price and quantity
+        if it is already there.
+
+        :param department: The department under which the product is to be added.
+        :type department: str
+        :param category: The category under which the product is to be added.
+        :type category: str
+        :param product: The name of the product to be added.
+        :type product: str
+        :param price: The price of the product.
+        :type price: float
+        :param quantity: The quantity of the product.
+        :type quantity: int
+        """
+        self.add_products([(department, category, product, price, quantity)])
+
+    @instrumented('sqlite_tree.add_products')
+    def add_products(self, rows):
+        """
+        Adds many products in one transaction with a single ``executemany``.
+
+        :param rows: The products to add, as (department, category, product, price, quantity) tuples.
+        :type rows: iterable
+        :return: The number of rows added.
+        :rtype: int
+        """
+        with self.lock:
+            try:
+                with self.connection:
+                    category_id = self.category_id
+                    values = [(category_id(department, category), product, price, quantity)
+                              for department, category, product, price, quantity in rows]
+                    self.connection.executemany(UPSERT_PRODUCT, values)
+            except BaseException:
+                # Departments and categories added by the rolled back transaction are gone again
+                self.load_ids()
+                raise
+            if self.hot_products:
+                for _, product, _, _ in values:
+                    self.hot_products.pop(product, None)
+            self.version += 1
+        return len(values)
+
+    @instrumented('sqlite_tree.remove_product')
+    def remove_product(self, department, category, product):
+        """
+        Removes one unit of a product under the specified department and category.
+
+        :param department: The department under which the product is to be removed.
+        :type department: str
+        :param category: The category under which the product is to be removed.
+        :type category: str
+        :param product: The name of the product to be removed.
+        :type product: str
+        :return: True if one unit was removed, False if the product is out of stock or not found.
+        :rtype: bool
+        """
+        category_id = self.category_ids.get((department, category))
+        with self.lock, self.connection:
+            if category_id is not None and self.connection.execute(TAKE_ONE_UNIT, (category_id, product)).rowcount:
+                self.hot_products.pop(product, None)
+                self.version += 1
+                return True
+            found = category_id is not None and self.connection.execute(
+                SELECT_PRODUCT_IN_CATEGORY, (category_id, product)).fetchone() is not None
+        if found:
+            print(f"No more {product} available in stock.")
+        else:
+            print(f"{product} not found in the inventory.")
+        return False
+
+    @instrumented('sqlite_tree.delete_product')
+    def delete_product(self, department, category, product):
+        """
+        Deletes a product entirely, rather than lowering its stock.
+
+        :param department: The department the product belongs to.
+        :type department: str
+        :param category: The category the product belongs to.
+        :type category: str
+        :param product: The name of the product to be deleted.
+        :type product: str
+        :return: True if the product was deleted, False if it was not found.
+        :rtype: bool
+        """
+        category_id = self.category_ids.get((department, category))
+        if category_id is None:
+            return False
+        with self.lock, self.connection:
+            if not self.connection.execute(DELETE_PRODUCT, (category_id, product)).rowcount:
+                return False
+            self.hot_products.pop(product, None)
+            self.version += 1
+        return True
+
+    def get_departments(self):
+        """
+        Retrieves the names of all departments in the store.
+
+        :return: The department names.
+        :rtype: tuple
+        """
+        return tuple(self.department_ids)
+
+    def get_categories(self, department):
+        """
+        Retrieves the names of all categories under the specified department.
+
+        :param department: The department under which to look for categories.
+        :type department: str
+        :return: The category names, or an empty tuple if there is no such department.
+        :rtype: tuple
+        """
+        return tuple(self.department_categories.get(department, ()))
+
+    @instrumented('sqlite_tree.get_products')
+    def get_products(self, department, category):
+        """
+        Retrieves all products under the specified department and category, along with their prices and quantities.
+
+        :param department: The department under which to look for products.
+        :type department: str
+        :param category: The category under which to look for products.
+        :type category: str
+        :return: A read-only mapping where the keys are product names and the values are read-only mappings
+        with keys 'price' and 'quantity'. It is empty if there is no such department or category.
+        :rtype: types.MappingProxyType
+        """
+        category_id = self.category_ids.get((department, category))
+        if category_id is None:
+            return NO_PRODUCTS
+        with self.lock:
+            rows = self.connection.execute(SELECT_PRODUCTS, (category_id,)).fetchall()
+        return MappingProxyType({name: MappingProxyType({"price": price, "quantity": quantity})
+                                 for name, price, quantity in rows})
+
+    @instrumented('sqlite_tree.get_product_node')
+    def get_product_node(self, product):
+        """
+        Retrieves a product by name, wherever it is in the catalog. If several categories have a product
+        of that name, the one added last is returned, as ``ProductTree`` does.
+
+        The node is a detached copy from the hot-product cache: changing it does not change the catalog.
+
+        :param product: The name of the product.
+        :type product: str
+        :return: The product's node, or None if the product is not in the catalog.
+        :rtype: ProductNode or None
+        """
+        with self.lock:
+            p_node = self.hot_products.get(product)
+            if p_node is not None:
+                self.hot_products.move_to_end(product)
+                self.hits += 1
+                return p_node
+            self.misses += 1
+            row = self.connection.execute(SELECT_PRODUCT_BY_NAME, (product,)).fetchone()
+            if row is None:
+                return None
+            p_node = ProductNode(product, row[1], row[2])
+            if self.hot_cache_size > 0:
+                self.hot_products[product] = p_node
+                if len(self.hot_products) > self.hot_cache_size:
+                    self.hot_products.popitem(last=False)
+        return p_node
+
+    @instrumented('sqlite_tree.reserve')
+    def reserve(self, product, quantity=1):
+        """
+        Takes units of a product out of stock. Either all of the requested units are taken or none are.
+
+        :param product: The name of the product.
+        :type product: str
+        :param quantity: The number of units to take.
+        :type quantity: int
+        :return: True if the units were taken, False if the product is unknown or there is not enough stock.
+        :rtype: bool
+        :raises ValueError: If the quantity is less than one.
+        """
+        check_quantity(quantity)
+        return self.change_stock(product, RESERVE, quantity)
+
+    @instrumented('sqlite_tree.release')
+    def release(self, product, quantity=1):
+        """
+        Puts units of a product back into stock.
+
+        :param product: The name of the product.
+        :type product: str
+        :param quantity: The number of units to put back.
+        :type quantity: int
+        :return: True if the units were put back, False if the product is unknown.
+        :rtype: bool
+        :raises ValueError: If the quantity is less than one.
+        """
+        check_quantity(quantity)
+        return self.change_stock(product, RELEASE, quantity)
+
+    def change_stock(self, product, statement, quantity):
+        """
+        Runs a stock update against the product ``get_product_node`` would return.
+
+        :param product: The name of the product.
+        :type product: str
+        :param statement: The update, taking the product's ``:id`` and the ``:quantity`` to move.
+        :type statement: str
+        :param quantity: The number of units to move.
+        :type quantity: int
+        :return: True if the product's row was updated, False otherwise.
+        :rtype: bool
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute(SELECT_PRODUCT_BY_NAME, (product,)).fetchone()
+            if row is None:
+                return False
+            if not self.connection.execute(statement, {"id": row[0], "quantity": quantity}).rowcount:
+                return False
+            self.hot_products.pop(product, None)
+            self.version += 1
+        return True
+
+    def get_meta(self, key, default=None):
+        """
+        Retrieves a value stored alongside the catalog, such as where it was loaded from.
+
+        :param key: The name of the value.
+        :type key: str
+        :param default: Returned when no value is stored under the key.
+        :return: The stored value, or ``default``.
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        """
+        Stores a value alongside the catalog.
+
+        :param key: The name of the value.
+        :type key: str
+        :param value: The value, which must be a type SQLite can store.
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def cache_stats(self):
+        """
+        Retrieves the hot-product cache's statistics.
+
+        :return: A dictionary with keys 'hits', 'misses', 'size', 'maxsize' and 'hit_rate'.
+        :rtype: dict
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.hot_products),
+                    "maxsize": self.hot_cache_size, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        """Closes the database connection."""
+        with self.lock:
+            self.connection.close()
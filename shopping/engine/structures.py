@@ -1,19 +1,72 @@
-from .nodes import CartItem, ProductNode
+import contextlib
+import threading
+from decimal import Decimal
+from types import MappingProxyType
+
+from .instrumentation import instrumented
+from .nodes import CartItem, CartLine, ProductNode
+from .query import CatalogColumns
+from .search import SearchIndex
+from .views import VIEW_CACHE_SIZE, ReadViewCache
+
+NO_PRODUCTS = MappingProxyType({})  # The products view of a category that does not exist
+LOCK_STRIPES = 64  # Stock changes lock one of these, chosen by product name, so unrelated products don't contend
+
+
+def check_quantity(quantity):
+    """
+    Checks that a number of units to move in or out of stock is a whole number of at least one, so a
+    negative quantity can never be used to create stock.
+
+    :param quantity: The number of units.
+    :type quantity: int
+    :raises ValueError: If the quantity is not a positive integer.
+    """
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        raise ValueError(f"Quantity must be a whole number of at least 1, not {quantity!r}.")
 
 
 class ShoppingCart:
     """
-    This class represents a Shopping Cart.
+    This class represents a Shopping Cart. Items are kept in a doubly linked list in the order they
+    were added, and every product also has a line holding its items so it can be found without a
+    search. Units of a product added together, or one after another at the same price, share a single
+    item, so changing a quantity costs the same however many units move.
 
     :param first_item: The first item in the shopping cart.
     :type first_item: CartItem, optional
+    :param last_item: The last item in the shopping cart.
+    :type last_item: CartItem, optional
+    :param lines: The cart lines keyed by product.
+    :type lines: dict
+    :param total_price: The running total price of every item in the cart.
+    :type total_price: decimal.Decimal
+    :param total_quantity: The running number of items in the cart.
+    :type total_quantity: int
+    :param listeners: Functions called as ``listener(cart)`` after the cart changes.
+    :type listeners: list
     """
 
-    def __init__(self):
+    def __init__(self, product_tree=None, check_totals=False):
         """
         Initializes an empty shopping cart.
+
+        :param product_tree: The product tree used to look up prices. Without one every item is free.
+        :type product_tree: ProductTree, optional
+        :param check_totals: If True, the running totals are checked against a full recompute after
+        every change, or at the end of a batch.
+        :type check_totals: bool
         """
         self.first_item = None
+        self.last_item = None
+        self.lines = {}
+        self.product_tree = product_tree
+        self.check_totals = check_totals
+        self.total_price = Decimal('0')
+        self.total_quantity = 0
+        self.listeners = []
+        self.batch_depth = 0
+        self.batch_changed = False
 
     def is_empty(self):
         """
@@ -24,6 +77,30 @@ class ShoppingCart:
         """
         return self.first_item is None
 
+    def __contains__(self, item):
+        """
+        Checks if a product is in the shopping cart.
+
+        :param item: The product to look for.
+        :type item: str
+        :return: True if at least one unit of the product is in the cart, False otherwise.
+        :rtype: bool
+        """
+        return item in self.lines
+
+    def get_quantity(self, item):
+        """
+        Retrieves how many units of a product are in the shopping cart.
+
+        :param item: The product to look for.
+        :type item: str
+        :return: The number of units in the cart.
+        :rtype: int
+        """
+        line = self.lines.get(item)
+        return line.quantity if line is not None else 0
+
+    @instrumented('cart.add_to_cart')
     def add_to_cart(self, item):
         """
         Adds an item to the shopping cart.
@@ -31,16 +108,10 @@ class ShoppingCart:
         :param item: The item to be added to the shopping cart.
         :type item: str
         """
-        new_item = CartItem(item)
-        if self.is_empty():
-            self.first_item = new_item
-        else:
-            current_item = self.first_item
-            while current_item.next:
-                current_item = current_item.next
-            current_item.next = new_item
-
+        self.append_units(item, 1, self.get_price(item))
+        self.changed()
 
+    @instrumented('cart.remove_from_cart')
     def remove_from_cart(self, item):
         """ Removes an item from the shopping cart.
 
@@ -49,17 +120,209 @@ class ShoppingCart:
         :return: True if the item was successfully removed, False otherwise.
         :rtype: bool
         """
-        current_item = self.first_item
-        previous_item = None
-        while current_item:
-            if current_item.product == item:
-                if previous_item:
-                    previous_item.next = current_item.next
-                else:
-                    self.first_item = current_item.next
-                return True
-            previous_item, current_item = current_item, current_item.next
-        return False
+        if not self.take_units(item, 1):
+            return False
+        self.changed()
+        return True
+
+    @instrumented('cart.add_many')
+    def add_many(self, lines):
+        """
+        Adds several products to the shopping cart as one change, for example a pasted order.
+
+        :param lines: (product, quantity) pairs.
+        :type lines: iterable
+        :return: The number of items added.
+        :rtype: int
+        :raises ValueError: If any quantity is less than one, in which case nothing is added.
+        """
+        lines = list(lines)
+        for _, quantity in lines:
+            check_quantity(quantity)
+        added = 0
+        for product, quantity in lines:
+            self.append_units(product, quantity, self.get_price(product))
+            added += quantity
+        if added:
+            self.changed()
+        return added
+
+    @instrumented('cart.remove_many')
+    def remove_many(self, lines):
+        """
+        Removes several products from the shopping cart as one change. Each product loses at most the
+        units it has.
+
+        :param lines: (product, quantity) pairs.
+        :type lines: iterable
+        :return: The number of items removed.
+        :rtype: int
+        :raises ValueError: If any quantity is less than one, in which case nothing is removed.
+        """
+        lines = list(lines)
+        for _, quantity in lines:
+            check_quantity(quantity)
+        removed = 0
+        for product, quantity in lines:
+            removed += self.take_units(product, quantity)
+        if removed:
+            self.changed()
+        return removed
+
+    def set_quantity(self, item, quantity):
+        """
+        Adds or removes units of a product until the cart holds exactly ``quantity`` of them.
+
+        :param item: The product.
+        :type item: str
+        :param quantity: The number of units wanted.
+        :type quantity: int
+        :return: The change in the product's quantity, positive if units were added.
+        :rtype: int
+        :raises ValueError: If the quantity is negative.
+        """
+        if quantity != 0:
+            check_quantity(quantity)
+        change = quantity - self.get_quantity(item)
+        if change > 0:
+            self.add_many([(item, change)])
+        elif change < 0:
+            self.remove_many([(item, -change)])
+        return change
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Groups changes so that listeners are told once, and the totals are checked once, when the
+        outermost batch ends.
+
+        :return: A context manager yielding the cart.
+        """
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if not self.batch_depth and self.batch_changed:
+                self.batch_changed = False
+                self.changed()
+
+    def changed(self):
+        """
+        Checks the totals if asked to and tells the listeners that the cart changed, or leaves both to
+        the end of the current batch.
+        """
+        if self.batch_depth:
+            self.batch_changed = True
+            return
+        if self.check_totals:
+            self.verify_totals()
+        for listener in list(self.listeners):
+            listener(self)
+
+    def subscribe(self, listener):
+        """
+        Registers a function to be called as ``listener(cart)`` after every change to the cart, or once
+        after a batch of changes.
+
+        :param listener: The function to call.
+        :type listener: callable
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """
+        Stops calling a function registered with ``subscribe``.
+
+        :param listener: The function to stop calling.
+        :type listener: callable
+        """
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def append_units(self, item, quantity, price):
+        """
+        Adds units of a product to the end of the shopping cart, growing the last item when it holds
+        the same product at the same price, without telling the listeners.
+
+        :param item: The product.
+        :type item: str
+        :param quantity: The number of units to add.
+        :type quantity: int
+        :param price: The unit price they are added at.
+        :type price: decimal.Decimal
+        """
+        line = self.lines.get(item)
+        if line is None:
+            line = self.lines[item] = CartLine(item)
+        last_item = self.last_item
+        if last_item is not None and last_item.product == item and last_item.price == price:
+            last_item.quantity += quantity
+        else:
+            new_item = CartItem(item, price, quantity)
+            if last_item is None:
+                self.first_item = new_item
+            else:
+                new_item.prev = last_item
+                last_item.next = new_item
+            self.last_item = new_item
+            line.items.append(new_item)
+
+        amount = price * quantity
+        line.quantity += quantity
+        line.subtotal += amount
+        self.total_price += amount
+        self.total_quantity += quantity
+
+    def take_units(self, item, quantity):
+        """
+        Removes up to ``quantity`` units of a product from the shopping cart, oldest first, without
+        telling the listeners.
+
+        :param item: The product.
+        :type item: str
+        :param quantity: The number of units to remove.
+        :type quantity: int
+        :return: The number of units removed.
+        :rtype: int
+        """
+        line = self.lines.get(item)
+        if line is None:
+            return 0
+        removed = 0
+        while removed < quantity and line.items:
+            current_item = line.items[0]
+            taken = min(quantity - removed, current_item.quantity)
+            current_item.quantity -= taken
+            if not current_item.quantity:
+                line.items.popleft()
+                self.unlink(current_item)
+            amount = current_item.price * taken
+            line.quantity -= taken
+            line.subtotal -= amount
+            self.total_price -= amount
+            self.total_quantity -= taken
+            removed += taken
+        if not line.quantity:
+            del self.lines[item]
+        return removed
+
+    def unlink(self, cart_item):
+        """
+        Detaches an item from the shopping cart's linked list.
+
+        :param cart_item: The item to detach.
+        :type cart_item: CartItem
+        """
+        if cart_item.prev:
+            cart_item.prev.next = cart_item.next
+        else:
+            self.first_item = cart_item.next
+        if cart_item.next:
+            cart_item.next.prev = cart_item.prev
+        else:
+            self.last_item = cart_item.prev
+        cart_item.prev = cart_item.next = None
 
     def get_cart_items(self):
         """
@@ -71,15 +334,73 @@ class ShoppingCart:
         items = []
         current = self.first_item
         while current:
-            items.append(current.product)
+            items.extend([current.product] * current.quantity)
             current = current.next
         return items
 
+    @instrumented('cart.load_lines')
+    def load_lines(self, lines):
+        """
+        Fills the shopping cart with saved lines in one pass, as one change. Each line's price is looked
+        up once and its units are added as a single item. Saved lines without units are skipped.
+
+        :param lines: (product, quantity) pairs, in the order the lines should appear.
+        :type lines: iterable
+        :return: The number of items added.
+        :rtype: int
+        """
+        return self.add_many((product, quantity) for product, quantity in lines if quantity > 0)
+
+    @instrumented('cart.clear_cart')
     def clear_cart(self):
         """
         Clears all items from the shopping cart.
         """
         self.first_item = None
+        self.last_item = None
+        self.lines = {}
+        self.total_price = Decimal('0')
+        self.total_quantity = 0
+        self.changed()
+
+    def get_price(self, item):
+        """
+        Looks up the unit price of a product as an exact decimal.
+
+        :param item: The product to price.
+        :type item: str
+        :return: The product's price, or zero if it is not in the product tree.
+        :rtype: decimal.Decimal
+        """
+        product_node = self.product_tree.get_product_node(item) if self.product_tree is not None else None
+        if product_node is None or product_node.price is None:
+            return Decimal('0')
+        return Decimal(str(product_node.price))
+
+    def recompute_totals(self):
+        """
+        Recomputes the total price and quantity by walking every item in the shopping cart.
+
+        :return: A (total price, total quantity) tuple.
+        :rtype: tuple
+        """
+        total_price, total_quantity = Decimal('0'), 0
+        current = self.first_item
+        while current:
+            total_price += current.price * current.quantity
+            total_quantity += current.quantity
+            current = current.next
+        return total_price, total_quantity
+
+    def verify_totals(self):
+        """
+        Checks the running totals against a full recompute.
+
+        :raises RuntimeError: If the running totals have drifted from the cart's contents.
+        """
+        expected = self.recompute_totals()
+        if (self.total_price, self.total_quantity) != expected:
+            raise RuntimeError(f"Cart totals {(self.total_price, self.total_quantity)} do not match {expected}.")
 
 
 class ProductTree:
@@ -88,12 +409,36 @@ class ProductTree:
     and retrieving information about the products in the store.
     """
 
-    def __init__(self):
+    def __init__(self, view_cache_size=VIEW_CACHE_SIZE):
         """
         Initializes a new product tree with a root node named 'store'.
+
+        Alongside the tree itself, ``product_index`` maps every product name to its node so that
+        products can be found without walking the departments and categories. A product's category
+        and department are its node's parent and grandparent.
+
+        ``version`` is bumped by every change made through the tree, so derived data such as the query
+        columns can tell when it is out of date. Listeners registered with ``subscribe`` are told about
+        every change to a product's stock. Stock changes hold the lock returned by ``lock_for``.
+
+        Every node also has its own ``version``. Adding or removing a child bumps the parent's, and
+        changing a product bumps its category's, so the read views returned by ``get_departments``,
+        ``get_categories`` and ``get_products`` are cached in ``view_cache`` until their node changes.
+
+        :param view_cache_size: The most read views to cache.
+        :type view_cache_size: int
         """
         self.store = ProductNode('store')
-
+        self.product_index = {}
+        self.version = 0
+        self.columns = None
+        self.columns_version = None
+        self.search_index = None
+        self.listeners = []
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.view_cache = ReadViewCache(view_cache_size)
+
+    @instrumented('tree.add_product')
     def add_product(self, department, category, product, price, quantity):
         """
         Adds a product to the product tree under the specified department and category.
@@ -112,13 +457,53 @@ class ProductTree:
         department_node = self.get_or_create_node(self.store, department)
         category_node = self.get_or_create_node(department_node, category)
 
-        for p_node in category_node.subcategories:
-            if p_node.name == product:
-                p_node.price, p_node.quantity = price, quantity
-                break
+        p_node = category_node.children.get(product)
+        if p_node is not None:
+            p_node.price, p_node.quantity = price, quantity
+            category_node.version += 1
         else:
-            category_node.subcategories.append(ProductNode(product, price, quantity))
+            p_node = category_node.add_child(ProductNode(product, price, quantity))
+            self.product_index[product] = p_node
+            self.search_index = None
+        self.version += 1
+        self.notify(product, quantity)
+
+    @instrumented('tree.add_products')
+    def add_products(self, rows):
+        """
+        Adds many products to the product tree at once. Catalog exports are grouped by department and
+        category, so the category node is only looked up again when it changes between rows.
 
+        :param rows: The products to add, as (department, category, product, price, quantity) tuples.
+        :type rows: iterable
+        :return: The number of rows added.
+        :rtype: int
+        """
+        product_index = self.product_index
+        notify = self.notify if self.listeners else None
+        current = None
+        category_node = None
+        count = 0
+        for department, category, product, price, quantity in rows:
+            if current != (department, category):
+                current = (department, category)
+                department_node = self.get_or_create_node(self.store, department)
+                category_node = self.get_or_create_node(department_node, category)
+            p_node = category_node.children.get(product)
+            if p_node is not None:
+                p_node.price, p_node.quantity = price, quantity
+                category_node.version += 1
+            else:
+                p_node = category_node.add_child(ProductNode(product, price, quantity))
+                product_index[product] = p_node
+                self.search_index = None
+            if notify is not None:
+                notify(product, quantity)
+            count += 1
+        self.version += 1
+        return count
+
+    @instrumented('tree.remove_product')
     def remove_product(self, department, category, product):
         """
         Removes a product from the product tree under the specified department and category.
@@ -129,16 +514,241 @@ class ProductTree:
         :type category: str
         :param product: The name of the product to be removed.
         :type product: str
+        :return: True if one unit was removed, False if the product is out of stock or not found.
+        :rtype: bool
         """
-        department_node = self.get_or_create_node(self.store, department)
-        category_node = self.get_or_create_node(department_node, category)
-
-        for p_node in category_node.subcategories:
-            if p_node.name == product:
-                p_node.quantity -= 1 if p_node.quantity > 0 else print(f"No more {product} available in stock.")
-                break
-        else:
+        category_node = self.find_node(department, category)
+        p_node = category_node.get_child(product) if category_node is not None else None
+        if p_node is None:
             print(f"{product} not found in the inventory.")
+            return False
+        with self.lock_for(product):
+            if not p_node.quantity or p_node.quantity <= 0:
+                print(f"No more {product} available in stock.")
+                return False
+            p_node.quantity -= 1
+            remaining = p_node.quantity
+            category_node.version += 1
+            self.version += 1
+        self.notify(product, remaining)
+        return True
+
+    @instrumented('tree.reserve')
+    def reserve(self, product, quantity=1):
+        """
+        Takes units of a product out of stock, for example when they are added to a cart. Either all of
+        the requested units are taken or none are.
+
+        :param product: The name of the product.
+        :type product: str
+        :param quantity: The number of units to take.
+        :type quantity: int
+        :return: True if the units were taken, False if the product is unknown or there is not enough stock.
+        :rtype: bool
+        :raises ValueError: If the quantity is less than one.
+        """
+        check_quantity(quantity)
+        with self.lock_for(product):
+            p_node = self.product_index.get(product)
+            if p_node is None or (p_node.quantity or 0) < quantity:
+                return False
+            p_node.quantity -= quantity
+            remaining = p_node.quantity
+            p_node.parent.version += 1
+            self.version += 1
+        self.notify(product, remaining)
+        return True
+
+    @instrumented('tree.release')
+    def release(self, product, quantity=1):
+        """
+        Puts units of a product back into stock, for example when they are removed from a cart.
+
+        :param product: The name of the product.
+        :type product: str
+        :param quantity: The number of units to put back.
+        :type quantity: int
+        :return: True if the units were put back, False if the product is unknown.
+        :rtype: bool
+        :raises ValueError: If the quantity is less than one.
+        """
+        check_quantity(quantity)
+        with self.lock_for(product):
+            p_node = self.product_index.get(product)
+            if p_node is None:
+                return False
+            p_node.quantity = (p_node.quantity or 0) + quantity
+            remaining = p_node.quantity
+            p_node.parent.version += 1
+            self.version += 1
+        self.notify(product, remaining)
+        return True
+
+    def lock_for(self, product):
+        """
+        Retrieves the lock that guards a product's stock.
+
+        :param product: The name of the product.
+        :type product: str
+        :return: The product's lock, shared with the other products in its stripe.
+        :rtype: threading.Lock
+        """
+        return self.locks[hash(product) % len(self.locks)]
+
+    def locks_for(self, products):
+        """
+        Retrieves the locks that guard several products' stock, in the one order every caller must take
+        them in so that threads locking overlapping products cannot deadlock.
+
+        :param products: The names of the products.
+        :type products: iterable
+        :return: The distinct locks, ordered by stripe.
+        :rtype: list
+        """
+        stripes = sorted({hash(product) % len(self.locks) for product in products})
+        return [self.locks[stripe] for stripe in stripes]
+
+    def subscribe(self, listener):
+        """
+        Registers a function to be called as ``listener(product, quantity)`` whenever a product's stock
+        changes.
+
+        :param listener: The function to call.
+        :type listener: callable
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """
+        Stops calling a function registered with ``subscribe``.
+
+        :param listener: The function to stop calling.
+        :type listener: callable
+        """
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify(self, product, quantity):
+        """
+        Tells every listener about a change to a product's stock.
+
+        :param product: The name of the product.
+        :type product: str
+        :param quantity: The product's new quantity.
+        :type quantity: int
+        """
+        for listener in list(self.listeners):
+            listener(product, quantity)
+
+    @instrumented('tree.delete_product')
+    def delete_product(self, department, category, product):
+        """
+        Deletes a product node from the product tree entirely, rather than lowering its stock.
+
+        :param department: The department the product belongs to.
+        :type department: str
+        :param category: The category the product belongs to.
+        :type category: str
+        :param product: The name of the product to be deleted.
+        :type product: str
+        :return: True if the product was deleted, False if it was not found.
+        :rtype: bool
+        """
+        location = self.locate(product)
+        if location is None or location[:2] != (department, category):
+            return False
+        p_node = location[2]
+        self.remove_child(p_node.parent, p_node)
+        del self.product_index[product]
+        self.search_index = None
+        self.version += 1
+        return True
+
+    def locate(self, product):
+        """
+        Finds where a product lives in the product tree.
+
+        :param product: The name of the product.
+        :type product: str
+        :return: A (department, category, node) tuple, or None if the product is not in the tree.
+        :rtype: tuple or None
+        """
+        p_node = self.product_index.get(product)
+        if p_node is None:
+            return None
+        category_node = p_node.parent
+        return category_node.parent.name, category_node.name, p_node
+
+    def get_product_node(self, product):
+        """
+        Retrieves the node of a product by name, wherever it is in the product tree.
+
+        :param product: The name of the product.
+        :type product: str
+        :return: The product's node, or None if the product is not in the tree.
+        :rtype: ProductNode or None
+        """
+        return self.product_index.get(product)
+
+    def find_node(self, department, category=None):
+        """
+        Looks up a department node, or a category node within it, without creating anything. Read paths
+        use this so that looking up a name that does not exist leaves the tree unchanged.
+
+        :param department: The name of the department.
+        :type department: str
+        :param category: The name of the category, to look up the category rather than the department.
+        :type category: str, optional
+        :return: The node, or None if there is no such department or category.
+        :rtype: ProductNode or None
+        """
+        node = self.store.get_child(department)
+        if node is not None and category is not None:
+            node = node.get_child(category)
+        return node
+
+    @instrumented('tree.compact')
+    def compact(self):
+        """
+        Prunes departments and categories that no longer have any products, for example after products
+        were deleted, and frees the child containers of product nodes, which never need them.
+
+        :return: The number of department and category nodes removed.
+        :rtype: int
+        """
+        removed = 0
+        stale_views = []
+        for department_node in list(self.store.iter_children()):
+            for category_node in list(department_node.iter_children()):
+                for p_node in category_node.iter_children():
+                    p_node._subcategories = p_node._children = None
+                if not category_node._subcategories:
+                    self.remove_child(department_node, category_node)
+                    stale_views.append(('products', department_node.name, category_node.name))
+                    removed += 1
+            if not department_node._subcategories:
+                self.remove_child(self.store, department_node)
+                stale_views.append(('categories', department_node.name))
+                removed += 1
+        if removed:
+            self.view_cache.drop(stale_views)
+            self.version += 1
+        return removed
+
+    @staticmethod
+    def remove_child(parent, node):
+        """
+        Detaches a node from its parent.
+
+        :param parent: The parent node.
+        :type parent: ProductNode
+        :param node: The child node to detach.
+        :type node: ProductNode
+        """
+        del parent.children[node.name]
+        parent.subcategories.remove(node)
+        parent.version += 1
+        node.parent = None
 
     def get_or_create_node(self, parent, name):
         """
@@ -152,12 +762,10 @@ class ProductTree:
         :return: The node with the specified name.
         :rtype: ProductNode
         """
-        for child in parent.subcategories:
-            if child.name == name:
-                return child
-        new_node = ProductNode(name)
-        parent.subcategories.append(new_node)
-        return new_node
+        child = parent.children.get(name)
+        if child is None:
+            child = parent.add_child(ProductNode(name))
+        return child
 
     def print_tree(self, node=None, indent=0):
         """
@@ -176,7 +784,7 @@ class ProductTree:
         if node.price is not None:
             tree_str += '  ' * (indent + 1) + '- Price: ${:.2f}\n'.format(node.price)
             tree_str += '  ' * (indent + 1) + '- Quantity: {}\n'.format(node.quantity)
-        for child in node.subcategories:
+        for child in node.iter_children():
             tree_str += self.print_tree(child, indent + 1)
         return tree_str
 
@@ -184,10 +792,10 @@ class ProductTree:
         """
         Retrieves the names of all departments in the store.
 
-        :return: A list of department names.
-        :rtype: list
+        :return: The department names.
+        :rtype: tuple
         """
-        return [child.name for child in self.store.subcategories]
+        return self.view_cache.get(('departments',), self.store, self.child_names)
 
     def get_categories(self, department):
         """
@@ -195,12 +803,15 @@ class ProductTree:
 
         :param department: The department under which to look for categories.
         :type department: str
-        :return: A list of category names.
-        :rtype: list
+        :return: The category names, or an empty tuple if there is no such department.
+        :rtype: tuple
         """
-        department_node = self.get_or_create_node(self.store, department)
-        return [child.name for child in department_node.subcategories]
+        department_node = self.find_node(department)
+        if department_node is None:
+            return ()
+        return self.view_cache.get(('categories', department), department_node, self.child_names)
 
+    @instrumented('tree.get_products')
     def get_products(self, department, category):
         """
         Retrieves all products under the specified department and category, along with their prices and quantities.
@@ -209,18 +820,119 @@ class ProductTree:
         :type department: str
         :param category: The category under which to look for products.
         :type category: str
-        :return: A dictionary where the keys are product names and the values are dictionaries with keys 'price' and
-        'quantity'.
-        :rtype: dict
+        :return: A read-only mapping where the keys are product names and the values are read-only mappings
+        with keys 'price' and 'quantity'. It is empty if there is no such department or category.
+        :rtype: types.MappingProxyType
         """
-        department_node = self.get_or_create_node(self.store, department)
-        category_node = self.get_or_create_node(department_node, category)
+        category_node = self.find_node(department, category)
+        if category_node is None:
+            return NO_PRODUCTS
+        return self.view_cache.get(('products', department, category), category_node, self.product_details)
+
+    @staticmethod
+    def child_names(node):
+        """
+        Builds the read view of a node's child names.
+
+        :param node: The department or store node.
+        :type node: ProductNode
+        :return: The names of the node's children, in order.
+        :rtype: tuple
+        """
+        return tuple(child.name for child in node.iter_children())
+
+    @staticmethod
+    def product_details(category_node):
+        """
+        Builds the read view of a category's products.
 
+        :param category_node: The category node.
+        :type category_node: ProductNode
+        :return: A read-only mapping of product names to read-only {'price', 'quantity'} mappings.
+        :rtype: types.MappingProxyType
+        """
         products = {}
-        for product_node in category_node.subcategories:
-            products[product_node.name] = {
+        for product_node in category_node.iter_children():
+            products[product_node.name] = MappingProxyType({
                 "price": product_node.price,
                 "quantity": product_node.quantity
-            }
+            })
+        return MappingProxyType(products)
+
+    @instrumented('tree.get_columns')
+    def get_columns(self):
+        """
+        Retrieves the column-oriented copy of the catalog used for inventory queries, rebuilding it if
+        the tree has changed since it was last built.
 
-        return products
+        :return: The catalog columns.
+        :rtype: CatalogColumns
+        """
+        if self.columns is None or self.columns_version != self.version:
+            self.columns = CatalogColumns(self.store)
+            self.columns_version = self.version
+        return self.columns
+
+    def products_in_price_range(self, low, high):
+        """
+        Retrieves the products priced between two bounds, inclusive.
+
+        :param low: The lowest price to include.
+        :type low: float
+        :param high: The highest price to include.
+        :type high: float
+        :return: The matching product names, cheapest first.
+        :rtype: list
+        """
+        return self.get_columns().price_range(low, high)
+
+    def low_stock(self, threshold):
+        """
+        Retrieves the products that need restocking.
+
+        :param threshold: The quantity products must be below.
+        :type threshold: int
+        :return: (name, quantity) tuples, lowest stock first.
+        :rtype: list
+        """
+        return self.get_columns().low_stock(threshold)
+
+    def top_by_value(self, n=10):
+        """
+        Retrieves the products with the most stock value (price times quantity).
+
+        :param n: The number of products to return.
+        :type n: int
+        :return: (name, value) tuples, highest value first.
+        :rtype: list
+        """
+        return self.get_columns().top_by_value(n)
+
+    def value_report(self, level='department'):
+        """
+        Retrieves the sum, count and mean of stock value (price times quantity) per department or category.
+
+        :param level: Either 'department' or 'category'.
+        :type level: str
+        :return: A dictionary keyed by department name, or by (department, category) tuple, whose values
+        are dictionaries with keys 'sum', 'count' and 'mean'.
+        :rtype: dict
+        """
+        return self.get_columns().value_report(level)
+
+    @instrumented('tree.search')
+    def search(self, query, limit=10):
+        """
+        Searches product names by word prefix, falling back to fuzzy matches for typos. The search index
+        is built on first use and rebuilt after products are added or deleted.
+
+        :param query: The text to look for.
+        :type query: str
+        :param limit: The most products to return.
+        :type limit: int
+        :return: The matching product names, best match first.
+        :rtype: list
+        """
+        if self.search_index is None:
+            self.search_index = SearchIndex(self.product_index)
+        return self.search_index.search(query, limit)
@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+
+VIEW_CACHE_SIZE = 4096  # Read views kept before the least recently used one is dropped
+
+
+class ReadViewCache:
+    """
+    This class represents a bounded cache of read-only views of product tree nodes.
+
+    Each view is stored with the node it was built from and that node's ``version``. A lookup is a hit
+    only while the node is still the same object at the same version, so any change to the node makes
+    its view stale without the tree having to find and drop it. When the cache is full the least
+    recently used view is evicted.
+
+    :param maxsize: The most views to keep. Zero disables caching.
+    :type maxsize: int
+    :param hits: The number of lookups answered from the cache.
+    :type hits: int
+    :param misses: The number of lookups that had to build their view.
+    :type misses: int
+    :param evictions: The number of views dropped to make room.
+    :type evictions: int
+    """
+
+    def __init__(self, maxsize=VIEW_CACHE_SIZE):
+        """
+        Initializes an empty cache.
+
+        :param maxsize: The most views to keep. Zero disables caching.
+        :type maxsize: int
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # Key -> (node, version, view), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, node, build):
+        """
+        Retrieves the view of a node, building it if there is no current one.
+
+        :param key: What the view is of, for example ``('products', department, category)``.
+        :type key: tuple
+        :param node: The node the view is built from.
+        :type node: ProductNode
+        :param build: Called with the node to build the view.
+        :type build: callable
+        :return: The view.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is node and entry[1] == node.version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        version = node.version
+        view = build(node)
+        if self.maxsize > 0:
+            with self.lock:
+                self.entries[key] = (node, version, view)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return view
+
+    def drop(self, keys):
+        """
+        Drops the views with the given keys, for nodes that have been removed from the tree.
+
+        :param keys: The keys of the views to drop.
+        :type keys: iterable
+        """
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        """Drops every view and resets the statistics."""
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Retrieves the cache's statistics.
+
+        :return: A dictionary with keys 'hits', 'misses', 'evictions', 'size', 'maxsize' and 'hit_rate'.
+        :rtype: dict
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "size": len(self.entries), "maxsize": self.maxsize,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -1,9 +1,21 @@
+import csv
+import math
 import tkinter as tk
 import tkinter.messagebox as messagebox
 from tkinter import ttk
 
+from .carts import CartStore
+from .engine.instrumentation import instrumented
+from .engine.inventory import InventoryEngine
+from .engine.pricing import CartPricing, PricingEngine
 from .engine.structures import ShoppingCart
-from .store_products import csv_to_products
+from .orders import CheckoutPipeline, OrderLog, catalog_checkpoint, replay_orders
+from .store_products import CSV_FILE_PATH, CatalogSync, csv_to_products, read_promotions
+
+SEARCH_DELAY_MS = 200  # Wait for a pause in typing before searching
+SEARCH_LIMIT = 20
+CATALOG_POLL_MS = 5000  # How often to look for a new export of the catalog CSV
+CART_SESSION = 'gui'  # The session the cart is saved under between runs
 
 
 class GUI:
@@ -23,8 +35,22 @@ class GUI:
         Args:
             root (tk.Tk): The root window of the application.
         """
-        self.product_tree = csv_to_products()
-        self.shopping_cart = ShoppingCart()
+        # Only the orders logged since this export was first loaded are taken out of its stock
+        checkpoint = catalog_checkpoint(CSV_FILE_PATH)
+        self.product_tree = csv_to_products(use_snapshot=True)
+        replay_orders(self.product_tree, source=checkpoint)
+        self.shopping_cart = ShoppingCart(self.product_tree)
+        # Stock in the cart stays held until checkout or removal; there is only one shopper
+        self.inventory = InventoryEngine(self.product_tree, hold_seconds=math.inf)
+        self.order_log = OrderLog(source=checkpoint)
+        # Promotions are compiled once; the cart's pricing then only re-prices the lines that change
+        self.pricing_engine = PricingEngine(self.product_tree, *read_promotions())
+        self.cart_pricing = CartPricing(self.pricing_engine, self.shopping_cart)
+        self.checkout_pipeline = CheckoutPipeline(self.product_tree, self.order_log, self.inventory,
+                                                  self.pricing_engine)
+        # The cart listbox is redrawn from cart change events, once per batch of changes
+        self.cart_rows = []  # The products shown in the cart listbox, row by row
+        self.shopping_cart.subscribe(self.on_cart_changed)
         self.root = root
         self.root.title("Shopping Cart")
         self.root.geometry("800x600")  # Set initial window size
@@ -40,6 +66,22 @@ class GUI:
         self.create_cart_widgets()
         self.create_store_widgets()
 
+        # Stock changes are collected here and redrawn together once Tk is idle
+        self.changed_products = set()
+        self.redraw_scheduled = False
+        self.product_tree.subscribe(self.on_stock_changed)
+
+        # The cart left at the last exit is restored, holding whatever stock is still available
+        self.cart_store = CartStore()
+        saved_lines = self.cart_store.saved_lines(CART_SESSION)
+        if saved_lines:
+            self.inventory.restore(self.shopping_cart, saved_lines)
+
+        # Later exports of the catalog are applied as deltas instead of reloading the store
+        self.catalog_sync = CatalogSync(self.product_tree)
+        self.catalog_sync.baseline()
+        self.root.after(CATALOG_POLL_MS, self.poll_catalog)
+
     def create_notebook(self):
         """Creates the notebook widget."""
         self.notebook = ttk.Notebook(self.root)
@@ -59,51 +101,192 @@ class GUI:
         frame.notebook = notebook
         return frame
 
+    @instrumented('gui.create_store_widgets')
     def create_store_widgets(self):
-        """Creates widgets for store content."""
-
-        self.product_labels = {}
-        department_tabs = ttk.Notebook(self.store_frame)
-        department_tabs.pack(expand=True, fill="both")
-
-        departments = self.product_tree.get_departments()
-        for i, department in enumerate(departments):
-            department_frame = ttk.Frame(department_tabs, style="Custom.TFrame")
-            department_frame.pack(expand=True, fill="both")
-            department_tabs.add(department_frame, text=department)
-
-            category_tabs = ttk.Notebook(department_frame)
-            category_tabs.pack(expand=True, fill="both")
-
-            categories = self.product_tree.get_categories(department)
-            for j, category in enumerate(categories):
-                category_frame = ttk.Frame(category_tabs, style="Custom.TFrame")
-                category_frame.pack(expand=True, fill="both", padx=10, pady=5)
-                category_tabs.add(category_frame, text=category)
-
-                products = self.product_tree.get_products(department, category)
-                for k, (product, details) in enumerate(products.items()):
-                    product_frame = ttk.Frame(category_frame, style="Custom.TFrame")
-                    product_frame.pack(fill="both", padx=10, pady=5)
-
-                    product_label = ttk.Label(product_frame, text=product, background=self.bg_color,
-                                              foreground=self.text_color)
-                    product_label.grid(row=0, column=0, sticky="w")
+        """
+        Creates widgets for store content.
 
-                    price_label = ttk.Label(product_frame, text=f'Price: ${details["price"]}', background=self.bg_color,
-                                            foreground=self.text_color)
-                    price_label.grid(row=0, column=1, padx=(10, 0), sticky="w")
+        Only the department and category tabs are created up front. Each category's product list is
+        built the first time its tab is shown, as a Treeview that only draws the rows in view.
+        """
+        self.product_views = {}  # Product name -> Treeview listing it, for categories built so far
+        self.category_views = {}  # (department, category) -> Treeview, for categories built so far
+        self.pending_categories = {}  # Category frame name -> (department, category) not yet built
+        self.department_frames = {}  # Department -> its tab
+        self.category_frames = {}  # (department, category) -> its tab
+        self.create_search_widgets()
 
-                    quantity_label = ttk.Label(product_frame, text=f'Quantity: {details["quantity"]}',
-                                               background=self.bg_color, foreground=self.text_color)
-                    quantity_label.grid(row=0, column=2, padx=(10, 0), sticky="w")
+        self.department_tabs = ttk.Notebook(self.store_frame)
+        self.department_tabs.pack(expand=True, fill="both")
+        self.department_tabs.bind("<<NotebookTabChanged>>", self.build_visible_category)
 
-                    add_to_cart_button = ttk.Button(product_frame, text='Add to Cart',
-                                                    command=lambda prod=product: self.add_to_cart(prod),
-                                                    style="Custom.TButton")
-                    add_to_cart_button.grid(row=0, column=3, padx=(10, 0), sticky="e")
+        for department in self.product_tree.get_departments():
+            self.add_department_tab(department)
+            for category in self.product_tree.get_categories(department):
+                self.add_category_tab(department, category)
+
+    def add_department_tab(self, department):
+        """Adds an empty tab for a department."""
+        department_frame = ttk.Frame(self.department_tabs, style="Custom.TFrame")
+        department_frame.pack(expand=True, fill="both")
+        self.department_tabs.add(department_frame, text=department)
+
+        category_tabs = ttk.Notebook(department_frame)
+        category_tabs.pack(expand=True, fill="both")
+        category_tabs.bind("<<NotebookTabChanged>>", self.build_visible_category)
+        department_frame.notebook = category_tabs
+        self.department_frames[department] = department_frame
+
+    def add_category_tab(self, department, category):
+        """Adds a tab for a category, whose product list is built when it is first shown."""
+        category_tabs = self.department_frames[department].notebook
+        category_frame = ttk.Frame(category_tabs, style="Custom.TFrame")
+        category_frame.pack(expand=True, fill="both", padx=10, pady=5)
+        category_tabs.add(category_frame, text=category)
+        self.category_frames[(department, category)] = category_frame
+        self.pending_categories[str(category_frame)] = (department, category)
+
+    def build_visible_category(self, event=None):
+        """Builds the product list of the category tab currently on screen, if it has not been built yet."""
+        selected_department = self.department_tabs.select()
+        if not selected_department:
+            return
+        category_tabs = self.department_tabs.nametowidget(selected_department).notebook
+        selected_category = category_tabs.select()
+        if selected_category in self.pending_categories:
+            department, category = self.pending_categories.pop(selected_category)
+            self.create_category_view(category_tabs.nametowidget(selected_category), department, category)
+
+    @instrumented('gui.create_category_view')
+    def create_category_view(self, category_frame, department, category):
+        """Creates the product list for one category."""
+        add_to_cart_button = ttk.Button(category_frame, text='Add to Cart', style="Custom.TButton")
+        add_to_cart_button.pack(side="bottom", anchor="e", pady=(5, 0))
+
+        product_view = ttk.Treeview(category_frame, columns=("price", "quantity"), selectmode="browse")
+        product_view.heading("#0", text="Product", anchor="w")
+        product_view.heading("price", text="Price", anchor="w")
+        product_view.heading("quantity", text="Quantity", anchor="w")
+        product_view.tag_configure("sold_out", foreground="gray")
+
+        scrollbar = ttk.Scrollbar(category_frame, orient="vertical", command=product_view.yview)
+        product_view.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        product_view.pack(side="left", expand=True, fill="both")
+
+        add_to_cart_button['command'] = lambda view=product_view: self.add_selected_to_cart(view)
+        product_view.bind("<Double-Button-1>", lambda event, view=product_view: self.add_selected_to_cart(view))
+
+        self.category_views[(department, category)] = product_view
+        for product in self.product_tree.get_products(department, category):
+            product_view.insert("", tk.END, iid=product, text=product, values=("", ""))
+            self.product_views[product] = product_view
+            self.update_product_row(product)
+
+    def update_product_row(self, product):
+        """Shows the current price and stock of a product, if its category has been built."""
+        product_view = self.product_views.get(product)
+        if product_view is not None:
+            product_node = self.product_tree.get_product_node(product)
+            available = product_node.quantity if product_node is not None else 0
+            if product_node is not None:
+                product_view.set(product, "price", f'${product_node.price}')
+            product_view.set(product, "quantity", available)
+            product_view.item(product, tags=("sold_out",) if available <= 0 else ())
+
+    def poll_catalog(self):
+        """Applies any new export of the catalog, then polls again later."""
+        delta = self.catalog_sync.poll()
+        if delta:
+            self.apply_catalog_delta(delta)
+        self.root.after(CATALOG_POLL_MS, self.poll_catalog)
+
+    @instrumented('gui.apply_catalog_delta')
+    def apply_catalog_delta(self, delta):
+        """Updates the store tabs for products the catalog sync deleted, moved or added."""
+        for product in delta.deleted:
+            product_view = self.product_views.pop(product, None)
+            if product_view is not None:
+                product_view.delete(product)
+        for product in delta.inserted:
+            location = self.product_tree.locate(product)
+            if location is None:
+                continue
+            department, category, _ = location
+            if department not in self.department_frames:
+                self.add_department_tab(department)
+            if (department, category) not in self.category_frames:
+                self.add_category_tab(department, category)
+            product_view = self.category_views.get((department, category))
+            if product_view is not None and product not in self.product_views:
+                product_view.insert("", tk.END, iid=product, text=product, values=("", ""))
+                self.product_views[product] = product_view
+                self.update_product_row(product)
+
+    def on_stock_changed(self, product, quantity):
+        """Queues a product's row to be redrawn when Tk is next idle."""
+        self.changed_products.add(product)
+        if not self.redraw_scheduled:
+            self.redraw_scheduled = True
+            self.root.after_idle(self.redraw_changed_products)
+
+    @instrumented('gui.redraw_changed_products')
+    def redraw_changed_products(self):
+        """Redraws the rows of every product whose stock changed since the last redraw."""
+        changed, self.changed_products = self.changed_products, set()
+        self.redraw_scheduled = False
+        for product in changed:
+            self.update_product_row(product)
+
+    def add_selected_to_cart(self, product_view):
+        """Adds the product selected in a category's product list to the shopping cart."""
+        selection = product_view.selection()
+        if selection:
+            self.add_to_cart(selection[0])
+
+    def create_search_widgets(self):
+        """Creates the product search box and its result list at the top of the store tab."""
+        self.search_frame = ttk.Frame(self.store_frame, style="Custom.TFrame")
+        self.search_frame.pack(fill="x", padx=10, pady=5)
+
+        search_label = ttk.Label(self.search_frame, text="Search:", background=self.bg_color,
+                                 foreground=self.text_color)
+        search_label.pack(side="left")
+
+        self.search_entry = ttk.Entry(self.search_frame)
+        self.search_entry.pack(side="left", expand=True, fill="x", padx=(5, 0))
+        self.search_entry.bind("<KeyRelease>", self.schedule_search)
+        self.search_after_id = None
+
+        # Shown under the search box only while there are results; double-click a result to add it to the cart
+        self.search_results = tk.Listbox(self.store_frame, height=6, bg=self.bg_color, fg=self.text_color)
+        self.search_results.bind("<Double-Button-1>", self.add_search_result_to_cart)
+
+    def schedule_search(self, event=None):
+        """Restarts the search timer so the search only runs once the user stops typing."""
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(SEARCH_DELAY_MS, self.run_search)
+
+    @instrumented('gui.run_search')
+    def run_search(self):
+        """Searches the product tree for the text in the search box and lists the results."""
+        self.search_after_id = None
+        results = self.product_tree.search(self.search_entry.get(), SEARCH_LIMIT)
+
+        self.search_results.delete(0, tk.END)
+        if results:
+            self.search_results.insert(tk.END, *results)
+            self.search_results.pack(fill="x", padx=10, after=self.search_frame)
+        else:
+            self.search_results.pack_forget()
 
-                    self.product_labels[product] = quantity_label
+    def add_search_result_to_cart(self, event=None):
+        """Adds the selected search result to the shopping cart."""
+        selection = self.search_results.curselection()
+        if not selection:
+            return
+        self.add_to_cart(self.search_results.get(selection[0]))
 
     def create_cart_widgets(self):
         """Creates widgets for cart content."""
@@ -125,62 +308,76 @@ class GUI:
                                                   command=self.remove_from_cart)
         self.remove_from_cart_button.pack(padx=10, pady=5, anchor="w")
 
+        self.paste_order_button = ttk.Button(self.cart_frame, text="Paste Order", command=self.paste_order)
+        self.paste_order_button.pack(padx=10, pady=5, anchor="w")
+
         self.update_total_labels()
 
-    def add_to_cart(self, product):
-        """Adds a product to the shopping cart."""
-        self.shopping_cart.add_to_cart(product)
-        self.decrement_quantity_in_gui(product)
+    def on_cart_changed(self, cart):
+        """Redraws the cart after a change, or after a whole batch of changes."""
         self.refresh_cart()
         self.update_total_labels()
 
-    def increment_quantity_in_gui(self, product):
-        """Increments the quantity of a product displayed in the GUI."""
-        if product in self.product_labels:
-            current_quantity = int(self.product_labels[product]['text'].split(": ")[1])
-            new_quantity = current_quantity + 1
-            self.product_labels[product]['text'] = f'Quantity: {new_quantity}'
-            product_frame = self.product_labels[product].master
-            for child in product_frame.winfo_children():
-                child['state'] = 'normal'
+    def add_to_cart(self, product):
+        """Adds a product to the shopping cart if any is left in stock."""
+        self.inventory.add_to_cart(self.shopping_cart, product)
 
     def remove_from_cart(self):
         """Removes the selected product from the shopping cart."""
         try:
             selected_product = self.cart_listbox.get(self.cart_listbox.curselection())
-            removed = self.shopping_cart.remove_from_cart(selected_product)
-            if removed:
-                self.increment_quantity_in_gui(selected_product)
-                self.refresh_cart()
-                self.update_total_labels()
+            self.inventory.remove_from_cart(self.shopping_cart, selected_product)
         except tk.TclError:
             pass
 
-    def decrement_quantity_in_gui(self, product):
-        """Decrements the quantity of a product displayed in the GUI."""
-        if product in self.product_labels:
-            current_quantity = int(self.product_labels[product]['text'].split(": ")[1])
-            new_quantity = current_quantity - 1
-            self.product_labels[product]['text'] = f'Quantity: {new_quantity}'
-            if new_quantity == 0:
-                product_frame = self.product_labels[product].master
-                for child in product_frame.winfo_children():
-                    child['state'] = 'disabled'
+    def paste_order(self):
+        """Adds the order list on the clipboard to the shopping cart."""
+        try:
+            text = self.root.clipboard_get()
+        except tk.TclError:
+            messagebox.showinfo("Paste Order", "The clipboard is empty.")
+            return
+        self.import_order(text)
 
+    @instrumented('gui.import_order')
+    def import_order(self, text):
+        """
+        Adds an order list to the shopping cart as one change. Each line names a product, optionally
+        followed by a comma and a quantity.
+        """
+        lines, skipped = [], []
+        for row in csv.reader(text.splitlines()):
+            if not row or not row[0].strip():
+                continue
+            product = row[0].strip()
+            try:
+                quantity = int(row[1]) if len(row) > 1 and row[1].strip() else 1
+            except ValueError:
+                skipped.append(product)
+                continue
+            if quantity < 1 or self.product_tree.get_product_node(product) is None:
+                skipped.append(product)
+            else:
+                lines.append((product, quantity))
+        skipped.extend(product for product, _ in self.inventory.add_many(self.shopping_cart, lines))
+        if skipped:
+            messagebox.showwarning("Paste Order", "These items could not be added: " + ", ".join(skipped))
+
+    @instrumented('gui.update_total_labels')
     def update_total_labels(self):
         """Updates the total price and total quantity labels."""
-        cart_items = self.shopping_cart.get_cart_items()
-        total_price = 0
-        total_quantity = len(cart_items)  # Count the total number of items in the cart
-
-        for item in cart_items:
-            department, category = self.find_department_and_category(item)
-            product_details = self.product_tree.get_products(department, category).get(item)
-            if product_details:
-                total_price += product_details.get('price', 0)
-
-        # Update total price label
-        self.total_price_label.config(text=f"Total Price: ${total_price:.2f}")
+        pricing = self.cart_pricing
+        total_price = pricing.refresh()
+        total_quantity = self.shopping_cart.total_quantity
+
+        # Update total price label, with the savings and tax when there are any
+        details = []
+        if pricing.discount:
+            details.append(f"you save ${pricing.discount:.2f}")
+        if pricing.tax:
+            details.append(f"incl. ${pricing.tax:.2f} tax")
+        suffix = f" ({', '.join(details)})" if details else ""
+        self.total_price_label.config(text=f"Total Price: ${total_price:.2f}{suffix}")
 
         # Update total quantity label
         self.total_quantity_label.config(text=f"Total Quantity: {total_quantity}")
@@ -192,17 +389,31 @@ class GUI:
 
     def find_department_and_category(self, item):
         """Finds the department and category of a given product."""
-        for department in self.product_tree.get_departments():
-            for category in self.product_tree.get_categories(department):
-                if item in self.product_tree.get_products(department, category):
-                    return department, category
-        return None, None
+        location = self.product_tree.locate(item)
+        if location is None:
+            return None, None
+        return location[0], location[1]
 
+    @instrumented('gui.refresh_cart')
     def refresh_cart(self):
-        """Refreshes the cart listbox with updated cart items."""
-        self.cart_listbox.delete(0, tk.END)
+        """
+        Brings the cart listbox in line with the cart. Only the rows between the first and last ones
+        that differ are deleted and inserted, so adding or removing items touches few rows.
+        """
         cart_items = self.shopping_cart.get_cart_items()
-        self.cart_listbox.insert(tk.END, *cart_items)
+        shown = self.cart_rows
+        start, limit = 0, min(len(shown), len(cart_items))
+        while start < limit and shown[start] == cart_items[start]:
+            start += 1
+        shown_end, items_end = len(shown), len(cart_items)
+        while shown_end > start and items_end > start and shown[shown_end - 1] == cart_items[items_end - 1]:
+            shown_end -= 1
+            items_end -= 1
+        if shown_end > start:
+            self.cart_listbox.delete(start, shown_end - 1)
+        if items_end > start:
+            self.cart_listbox.insert(start, *cart_items[start:items_end])
+        self.cart_rows = cart_items
 
         # Disable the "Remove from Cart" button if there are no items in the cart
         if not cart_items:
@@ -210,20 +421,24 @@ class GUI:
         else:
             self.remove_from_cart_button['state'] = 'normal'
 
+    @instrumented('gui.checkout')
     def checkout(self):
-        """Checkout method for the shopping cart."""
-        # Clear the cart
-        self.shopping_cart.clear_cart()
-
-        # Update the cart GUI
-        self.refresh_cart()
+        """Checks out the shopping cart, committing its stock and recording the order."""
+        if self.shopping_cart.is_empty():
+            messagebox.showinfo("Checkout", "Your cart is empty.")
+            return
 
-        # Reset total price and total quantity labels to 0
-        self.total_price_label.config(text="Total Price: $0.00")
-        self.total_quantity_label.config(text="Total Quantity: 0")
+        try:
+            order_id = self.checkout_pipeline.checkout(self.shopping_cart)
+        except (OSError, ValueError):
+            messagebox.showerror("Checkout Failed", "Your order could not be saved. Please try again.")
+            return
+        if order_id is None:
+            messagebox.showerror("Checkout Failed", "Some items in your cart are no longer in stock.")
+            return
 
-        # Display popup message
-        messagebox.showinfo("Checkout Successful", "Your items have been checked out.")
+        # The emptied cart has already redrawn itself; display popup message
+        messagebox.showinfo("Checkout Successful", f"Your items have been checked out. Order number: {order_id}")
 
 
 def start():
@@ -231,3 +446,6 @@ def start():
     root = tk.Tk()
     app = GUI(root)
     root.mainloop()
+    app.cart_store.save(CART_SESSION, app.shopping_cart)
+    app.cart_store.close()
+    app.order_log.close()
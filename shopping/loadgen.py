@@ -0,0 +1,175 @@
+"""
+A load generator for the cart service in ``shopping.service``.
+
+It opens several keep-alive connections, each acting as one shopper with its own session, and sends
+a mix of requests with up to ``--pipeline`` requests in flight per connection. It reports throughput
+and the 50th and 99th percentile latency of each kind of request.
+
+Run with ``python -m shopping.loadgen [--mix browse|cart|checkout] [--port PORT]``, or add
+``--serve`` to start a service in the same process to test against.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from .service import HOST, PORT, CartService
+from .store_products import csv_to_products
+
+MIXES = ('browse', 'cart', 'checkout')
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value below which ``fraction`` of the sorted values fall."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def make_requests(mix, session, catalog, count, rng):
+    """
+    Generates the requests one shopper sends.
+
+    :param mix: 'browse' for catalog reads, 'cart' for adding and removing, 'checkout' for filling
+    carts and checking them out.
+    :param session: The shopper's session id.
+    :param catalog: (department, category, product) tuples to choose from.
+    :param count: The number of requests to generate.
+    :param rng: The random number generator to use.
+    :return: A list of requests.
+    """
+    requests = []
+    while len(requests) < count:
+        department, category, product = rng.choice(catalog)
+        if mix == 'browse':
+            requests.append(rng.choice([
+                {"op": "categories", "department": department},
+                {"op": "products", "department": department, "category": category},
+                {"op": "search", "query": product[:3], "limit": 10},
+            ]))
+        elif mix == 'cart':
+            if rng.random() < 0.6:
+                requests.append({"op": "add", "session": session, "product": product})
+            else:
+                requests.append({"op": "remove", "session": session, "product": product})
+        else:
+            requests.append({"op": "add", "session": session, "product": product})
+            if rng.random() < 0.2:
+                requests.append({"op": "checkout", "session": session})
+    requests = requests[:count]
+    requests.append({"op": "close", "session": session})
+    return requests
+
+
+async def shopper(host, port, requests, pipeline, latencies):
+    """
+    Sends requests over one connection, keeping up to ``pipeline`` of them in flight.
+
+    :return: The number of responses received.
+    """
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+    in_flight = asyncio.Queue()
+    window = asyncio.Semaphore(pipeline)
+
+    async def send():
+        for request in requests:
+            await window.acquire()
+            in_flight.put_nowait((request['op'], time.perf_counter()))
+            writer.write(json.dumps(request).encode('utf-8') + b'\n')
+            await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    for _ in requests:
+        line = await reader.readline()
+        op, sent_at = in_flight.get_nowait()
+        latencies.setdefault(op, []).append(time.perf_counter() - sent_at)
+        window.release()
+        if not json.loads(line).get('ok'):
+            raise RuntimeError(f"Request {op!r} failed: {line!r}")
+    await sender
+    writer.close()
+    return len(requests)
+
+
+async def run_load(host=HOST, port=PORT, mix='browse', connections=16, requests_per_connection=1000,
+                   pipeline=8, seed=0):
+    """
+    Runs a load test against a running service.
+
+    :return: A report dictionary with 'requests', 'seconds', 'throughput' and per-op 'latency' in
+    seconds, given as {'p50': ..., 'p99': ...}.
+    """
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+
+    async def ask(request):
+        writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        return json.loads(await reader.readline())
+
+    catalog = []
+    for department in (await ask({"op": "departments"}))['departments']:
+        for category in (await ask({"op": "categories", "department": department}))['categories']:
+            products = (await ask({"op": "products", "department": department, "category": category}))['products']
+            catalog.extend((department, category, product) for product in products)
+    writer.close()
+
+    rng = random.Random(seed)
+    latencies = {}
+    shoppers = [shopper(host, port, make_requests(mix, f'load-{seed}-{i}', catalog, requests_per_connection, rng),
+                        pipeline, latencies)
+                for i in range(connections)]
+    start = time.perf_counter()
+    total = sum(await asyncio.gather(*shoppers))
+    elapsed = time.perf_counter() - start
+
+    report = {"requests": total, "seconds": elapsed, "throughput": total / elapsed, "latency": {}}
+    for op, values in sorted(latencies.items()):
+        values.sort()
+        report['latency'][op] = {"p50": percentile(values, 0.5), "p99": percentile(values, 0.99)}
+    return report
+
+
+def print_report(mix, report):
+    """Prints a load test report."""
+    print(f"{mix}: {report['requests']} requests in {report['seconds']:.2f} s, "
+          f"{report['throughput']:,.0f} requests per second")
+    for op, latency in report['latency'].items():
+        print(f"  {op:>11}: p50 {latency['p50'] * 1000:7.2f} ms   p99 {latency['p99'] * 1000:7.2f} ms")
+
+
+async def serve_and_load(arguments):
+    """Starts a service in this process, then runs every requested mix against it."""
+    started = asyncio.get_running_loop().create_future()
+    server = asyncio.ensure_future(CartService(csv_to_products()).serve(arguments.host, 0, started))
+    port = await started
+    try:
+        for mix in arguments.mix:
+            print_report(mix, await run_load(arguments.host, port, mix, arguments.connections, arguments.requests,
+                                             arguments.pipeline))
+    finally:
+        server.cancel()
+
+
+async def load(arguments):
+    """Runs every requested mix against an already running service."""
+    for mix in arguments.mix:
+        print_report(mix, await run_load(arguments.host, arguments.port, mix, arguments.connections,
+                                         arguments.requests, arguments.pipeline))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate load against the cart service.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--mix', choices=MIXES, action='append', help="Repeat to run several mixes; default all.")
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000, help="Requests per connection.")
+    parser.add_argument('--pipeline', type=int, default=8, help="Requests in flight per connection.")
+    parser.add_argument('--serve', action='store_true', help="Start a service in this process to test against.")
+    arguments = parser.parse_args()
+    arguments.mix = arguments.mix or list(MIXES)
+    asyncio.run(serve_and_load(arguments) if arguments.serve else load(arguments))
+
+
+if __name__ == '__main__':
+    main()
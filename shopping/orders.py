@@ -0,0 +1,307 @@
+import json
+import os
+import threading
+import time
+
+from .engine.instrumentation import instrumented
+from .engine.inventory import InventoryEngine
+from .engine.pricing import CartPricing
+from .snapshot import file_digest
+
+ORDER_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'orders.log')
+
+
+def catalog_checkpoint(csv_file_path):
+    """
+    Identifies a catalog export by its size and content, for the checkpoints written to an order log.
+
+    :param csv_file_path: The catalog CSV.
+    :return: A JSON-ready dictionary naming the export.
+    """
+    return {"size": os.path.getsize(csv_file_path), "sha1": file_digest(csv_file_path).hex()}
+
+
+def read_records(path=ORDER_LOG_PATH):
+    """
+    Reads every record in an order log: orders and checkpoints. A missing log has no records, and a
+    last line that was only partly written before a crash is skipped, since that order was never
+    confirmed.
+
+    :param path: The order log to read.
+    :return: An iterator of record dictionaries, oldest first.
+    """
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def read_orders(path=ORDER_LOG_PATH, source=None):
+    """
+    Reads the orders recorded in an order log.
+
+    With a ``source``, only the orders logged since the store was first run on that catalog export are
+    read, since an export is taken to include the sales made before it. Orders logged before the log's
+    first checkpoint belong to that checkpoint, and a log without checkpoints is read in full.
+
+    :param path: The order log to read.
+    :param source: The ``catalog_checkpoint`` of the export the stock was loaded from.
+    :return: An iterator of order dictionaries, oldest first.
+    """
+    found = source is None
+    seen = False
+    before_checkpoints = []
+    for record in read_records(path):
+        checkpoint = record.get('checkpoint')
+        if checkpoint is not None:
+            if not found and checkpoint == source:
+                found = True
+                if not seen:
+                    yield from before_checkpoints
+            seen = True
+            before_checkpoints = []
+        elif found:
+            yield record
+        elif not seen:
+            before_checkpoints.append(record)
+    if not seen:
+        yield from before_checkpoints
+
+
+def trim_torn_line(path, chunk_size=1 << 16):
+    """
+    Cuts a last line that was only partly written before a crash off the end of an order log, so
+    the next order starts on a line of its own instead of being merged into the fragment.
+
+    :param path: The order log to repair.
+    :param chunk_size: How many bytes to read at a time while looking for the last newline.
+    :return: The number of bytes cut off.
+    """
+    try:
+        file = open(path, 'r+b')
+    except FileNotFoundError:
+        return 0
+    with file:
+        size = end = file.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - chunk_size)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b'\n')
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            file.truncate(end)
+            file.flush()
+            os.fsync(file.fileno())
+        return size - end
+
+
+def replay_orders(product_tree, path=ORDER_LOG_PATH, source=None):
+    """
+    Takes the stock sold by every logged order out of a freshly loaded product tree, so the tree
+    matches the store as it was when the log was last written.
+
+    :param product_tree: The tree loaded from the catalog.
+    :param path: The order log to replay.
+    :param source: The ``catalog_checkpoint`` of the export the tree was loaded from. If given, orders
+    the export already includes are not replayed.
+    :return: The number of orders replayed.
+    """
+    count = 0
+    for order in read_orders(path, source):
+        for product, quantity in order['lines']:
+            p_node = product_tree.get_product_node(product)
+            if p_node is not None:
+                p_node.quantity = (p_node.quantity or 0) - quantity
+                p_node.parent.version += 1
+        count += 1
+    if count:
+        product_tree.version += 1
+    return count
+
+
+class OrderLog:
+    """
+    This class represents an append-only, write-ahead log of orders.
+
+    ``append`` only returns once its order is on disk. A background thread writes orders as they
+    arrive, and every order that comes in while one fsync is running is written with the next one, so
+    many concurrent checkouts share each fsync (group commit).
+
+    A failed write may leave part of a line at the end of the file, so after one the log refuses that
+    order and every later one with OSError. Reopening the log cuts the partial line off.
+
+    When the log is opened for a catalog export it has not seen last, it records a checkpoint naming
+    that export, so a restart only replays the orders the export does not include.
+
+    :param path: The log file.
+    :type path: str
+    :param next_order_id: The id the next order will get.
+    :type next_order_id: int
+    :param batches: The number of fsyncs done so far.
+    :type batches: int
+    """
+
+    def __init__(self, path=ORDER_LOG_PATH, source=None):
+        """
+        Opens a log for appending, continuing the order ids of anything already in it.
+
+        :param path: The log file.
+        :type path: str
+        :param source: The ``catalog_checkpoint`` of the export the store's stock was loaded from.
+        Defaults to not recording checkpoints.
+        :type source: dict, optional
+        """
+        self.path = path
+        trim_torn_line(path)
+        last_id, last_checkpoint = 0, None
+        for record in read_records(path):
+            if 'checkpoint' in record:
+                last_checkpoint = record['checkpoint']
+            else:
+                last_id = max(last_id, record['id'])
+        self.next_order_id = last_id + 1
+        self.file = open(path, 'ab')
+        if source is not None and source != last_checkpoint:
+            self.file.write(json.dumps({"checkpoint": source, "time": time.time()}).encode('utf-8') + b'\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.condition = threading.Condition()
+        self.pending = []
+        self.appended = 0
+        self.durable = 0
+        self.batches = 0
+        self.error = None
+        self.closed = False
+        self.flusher = threading.Thread(target=self.flush_pending, name='order-log', daemon=True)
+        self.flusher.start()
+
+    @instrumented('orders.append')
+    def append(self, lines, total_price):
+        """
+        Records an order and waits until it is safely on disk.
+
+        :param lines: The order's (product, quantity) pairs.
+        :type lines: list
+        :param total_price: The order's total price.
+        :type total_price: decimal.Decimal
+        :return: The order's id.
+        :rtype: int
+        :raises OSError: If the log could not be written.
+        """
+        with self.condition:
+            if self.closed:
+                raise ValueError("The order log is closed.")
+            order_id = self.next_order_id
+            self.next_order_id += 1
+            record = {"id": order_id, "time": time.time(), "lines": lines, "total_price": str(total_price)}
+            self.pending.append(json.dumps(record).encode('utf-8') + b'\n')
+            self.appended += 1
+            ticket = self.appended
+            self.condition.notify_all()
+            while self.durable < ticket and self.error is None:
+                self.condition.wait()
+            if self.durable < ticket:
+                raise OSError(f"Order {order_id} could not be written to {self.path}.") from self.error
+        return order_id
+
+    def flush_pending(self):
+        """Writes and fsyncs waiting orders in batches until the log is closed or a write fails."""
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                batch, self.pending = self.pending, []
+                written = self.appended
+            try:
+                self.file.write(b''.join(batch))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except OSError as error:
+                with self.condition:
+                    self.error = error
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.durable = written
+                self.batches += 1
+                self.condition.notify_all()
+
+    def close(self):
+        """Writes any waiting orders and closes the log."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.flusher.join()
+        self.file.close()
+
+
+class CheckoutPipeline:
+    """
+    This class represents checking carts out: committing their stock and recording them as orders.
+
+    :param engine: The inventory engine that holds and commits stock.
+    :type engine: InventoryEngine
+    :param order_log: The log orders are recorded in.
+    :type order_log: OrderLog
+    :param pricing_engine: The promotions and tax orders are priced with, if any.
+    :type pricing_engine: PricingEngine or None
+    """
+
+    def __init__(self, product_tree, order_log, engine=None, pricing_engine=None):
+        """
+        Sets up checkout against a product tree.
+
+        :param product_tree: The product tree whose stock is sold.
+        :type product_tree: ProductTree
+        :param order_log: The log orders are recorded in.
+        :type order_log: OrderLog
+        :param engine: The inventory engine the carts were filled through. Defaults to a new one.
+        :type engine: InventoryEngine, optional
+        :param pricing_engine: The promotions and tax orders are priced with. Defaults to charging the
+        cart's total price.
+        :type pricing_engine: PricingEngine, optional
+        """
+        self.engine = engine if engine is not None else InventoryEngine(product_tree)
+        self.order_log = order_log
+        self.pricing_engine = pricing_engine
+
+    @instrumented('orders.checkout')
+    def checkout(self, cart):
+        """
+        Checks a cart out. Its stock is committed all or nothing, then the order is written to the log,
+        and only once it is on disk is the cart emptied and the checkout reported as done. If the log
+        cannot be written the cart is left as it was, its stock held for it again, so it can be retried.
+
+        :param cart: The cart to check out.
+        :type cart: ShoppingCart
+        :return: The order id, or None if the cart is empty or there was not enough stock.
+        :rtype: int or None
+        :raises OSError: If the order could not be recorded.
+        """
+        if cart.is_empty():
+            return None
+        lines = [[product, line.quantity] for product, line in cart.lines.items()]
+        if self.pricing_engine is not None:
+            total_price = CartPricing(self.pricing_engine, cart).total
+        else:
+            total_price = cart.total_price
+        if not self.engine.checkout(cart, clear=False):
+            return None
+        try:
+            order_id = self.order_log.append(lines, total_price)
+        except (OSError, ValueError):
+            self.engine.add_holds(cart, lines)
+            raise
+        cart.clear_cart()
+        return order_id
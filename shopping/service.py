@@ -0,0 +1,322 @@
+"""
+A headless cart and checkout service that serves a product tree over a local line protocol.
+
+Every request is one JSON object on one line, and every response is one JSON object on one line, sent
+back in the same order. Connections stay open for as many requests as the client wants to send, and
+clients may send several requests before reading any responses.
+
+Requests name an ``op`` and its arguments, for example::
+
+    {"op": "add", "session": "alice", "product": "Bandana", "quantity": 2}
+
+Each session gets its own cart, created on first use. Responses carry ``"ok": true`` with the result,
+or ``"ok": false`` with an ``error`` message.
+
+Sessions' carts can be kept in a ``CartStore``: they are restored when the service starts, saved
+every few seconds while they change and saved again when it stops. Checkouts are recorded in the
+order log, which is replayed when the service starts.
+
+Run with ``python -m shopping.service [--host HOST] [--port PORT] [--carts PATH] [--orders PATH]``.
+"""
+import argparse
+import asyncio
+import json
+
+from .carts import CART_STORE_PATH, CartStore
+from .engine.inventory import HOLD_SECONDS, InventoryEngine
+from .engine.structures import ShoppingCart
+from .orders import ORDER_LOG_PATH, CheckoutPipeline, OrderLog, catalog_checkpoint, replay_orders
+from .store_products import CSV_FILE_PATH, csv_to_products
+
+HOST = '127.0.0.1'
+PORT = 8765
+EXPIRE_INTERVAL = 5  # Seconds between sweeps of expired stock holds
+SAVE_INTERVAL = 5  # Seconds between saves of changed carts
+
+
+class CartService:
+    """
+    This class represents the cart service: one shopping cart per session over a shared product tree.
+
+    :param product_tree: The catalog to serve.
+    :type product_tree: ProductTree
+    :param engine: The inventory engine that holds stock for the carts.
+    :type engine: InventoryEngine
+    :param sessions: The carts keyed by session id.
+    :type sessions: dict
+    :param cart_store: Where carts are saved between runs, if anywhere.
+    :type cart_store: CartStore or None
+    :param unsaved: The sessions whose carts changed since they were last saved.
+    :type unsaved: set
+    :param checkout_pipeline: Commits carts and records them in the order log, if there is one.
+    :type checkout_pipeline: CheckoutPipeline or None
+    """
+
+    def __init__(self, product_tree, hold_seconds=HOLD_SECONDS, cart_store=None, order_log=None):
+        """
+        Initializes a service, restoring the carts saved in ``cart_store``.
+
+        :param product_tree: The catalog to serve.
+        :type product_tree: ProductTree
+        :param hold_seconds: How long stock stays held for a cart.
+        :type hold_seconds: float
+        :param cart_store: Where carts are saved between runs. Defaults to not saving them.
+        :type cart_store: CartStore, optional
+        :param order_log: Where checkouts are recorded. Defaults to not recording them.
+        :type order_log: OrderLog, optional
+        """
+        self.product_tree = product_tree
+        self.engine = InventoryEngine(product_tree, hold_seconds)
+        self.checkout_pipeline = (CheckoutPipeline(product_tree, order_log, self.engine)
+                                  if order_log is not None else None)
+        self.sessions = {}
+        self.cart_store = cart_store
+        self.unsaved = set()
+        if cart_store is not None:
+            self.restore_sessions()
+        self.operations = {
+            'departments': self.departments,
+            'categories': self.categories,
+            'products': self.products,
+            'search': self.search,
+            'add': self.add,
+            'remove': self.remove,
+            'cart': self.cart,
+            'checkout': self.checkout,
+            'close': self.close,
+        }
+
+    def get_cart(self, session):
+        """
+        Retrieves the cart of a session, creating it on first use.
+
+        :param session: The session id.
+        :type session: str
+        :return: The session's cart.
+        :rtype: ShoppingCart
+        """
+        cart = self.sessions.get(session)
+        if cart is None:
+            cart = self.sessions[session] = ShoppingCart(self.product_tree)
+            if self.cart_store is not None:
+                cart.subscribe(lambda changed_cart: self.unsaved.add(session))
+        return cart
+
+    def restore_sessions(self):
+        """
+        Restores every cart saved in the cart store, holding stock for the lines that are still
+        available.
+
+        :return: The number of sessions restored.
+        :rtype: int
+        """
+        count = 0
+        for session, lines in self.cart_store.iter_saved():
+            self.engine.restore(self.get_cart(session), lines)
+            count += 1
+        self.unsaved.clear()
+        return count
+
+    def save_sessions(self):
+        """
+        Saves the carts that changed since they were last saved, in one transaction. Ended sessions are
+        removed from the store.
+
+        :return: The number of sessions saved or removed.
+        :rtype: int
+        """
+        if self.cart_store is None or not self.unsaved:
+            return 0
+        unsaved, self.unsaved = self.unsaved, set()
+        self.cart_store.save_many({session: self.sessions.get(session) or ShoppingCart() for session in unsaved})
+        return len(unsaved)
+
+    def handle(self, request):
+        """
+        Runs one request.
+
+        :param request: The decoded request.
+        :type request: dict
+        :return: The response to send back.
+        :rtype: dict
+        """
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "Requests must be JSON objects."}
+        operation = self.operations.get(request.get('op'))
+        if operation is None:
+            return {"ok": False, "error": f"Unknown op {request.get('op')!r}."}
+        try:
+            result = operation(request)
+        except KeyError as error:
+            return {"ok": False, "error": f"Missing argument {error.args[0]!r}."}
+        except (TypeError, ValueError, OSError) as error:
+            return {"ok": False, "error": str(error)}
+        except Exception as error:
+            # A bad request must not drop the connection and the requests pipelined behind it
+            return {"ok": False, "error": f"{request['op']!r} failed: {type(error).__name__}: {error}"}
+        return dict(result, ok=True)
+
+    def departments(self, request):
+        """Lists the departments."""
+        return {"departments": list(self.product_tree.get_departments())}
+
+    def categories(self, request):
+        """Lists the categories of a ``department``."""
+        return {"categories": list(self.product_tree.get_categories(request['department']))}
+
+    def products(self, request):
+        """Lists the products of a ``department`` and ``category`` with their prices and quantities."""
+        products = self.product_tree.get_products(request['department'], request['category'])
+        return {"products": {product: dict(details) for product, details in products.items()}}
+
+    def search(self, request):
+        """Searches product names for a ``query``, returning up to ``limit`` names."""
+        query = request['query']
+        if not isinstance(query, str):
+            raise TypeError("The query must be a string.")
+        return {"products": self.product_tree.search(query, int(request.get('limit', 10)))}
+
+    def add(self, request):
+        """Adds ``quantity`` units of a ``product`` to a ``session``'s cart, if there is enough stock."""
+        quantity = int(request.get('quantity', 1))
+        if quantity < 1:
+            raise ValueError(f"Quantity must be at least 1, not {quantity}.")
+        cart = self.get_cart(request['session'])
+        added = self.engine.add_to_cart(cart, request['product'], quantity)
+        return dict(self.cart_totals(cart), added=added)
+
+    def remove(self, request):
+        """Removes one unit of a ``product`` from a ``session``'s cart."""
+        cart = self.get_cart(request['session'])
+        removed = self.engine.remove_from_cart(cart, request['product'])
+        return dict(self.cart_totals(cart), removed=removed)
+
+    def cart(self, request):
+        """Lists the items and totals of a ``session``'s cart."""
+        cart = self.get_cart(request['session'])
+        return dict(self.cart_totals(cart), items=cart.get_cart_items())
+
+    def checkout(self, request):
+        """
+        Checks out a ``session``'s cart, all or nothing, and records the order. If the order cannot be
+        recorded the cart is kept and the request fails.
+        """
+        cart = self.get_cart(request['session'])
+        total_price, total_quantity = cart.total_price, cart.total_quantity
+        if self.checkout_pipeline is None:
+            return {"checked_out": self.engine.checkout(cart), "total_price": str(total_price),
+                    "total_quantity": total_quantity}
+        order_id = self.checkout_pipeline.checkout(cart)
+        return {"checked_out": order_id is not None, "order_id": order_id, "total_price": str(total_price),
+                "total_quantity": total_quantity}
+
+    def close(self, request):
+        """Ends a ``session``, putting anything left in its cart back on sale."""
+        cart = self.sessions.pop(request['session'], None)
+        if cart is not None:
+            self.engine.release_cart(cart)
+            if self.cart_store is not None:
+                self.unsaved.add(request['session'])
+        return {}
+
+    @staticmethod
+    def cart_totals(cart):
+        """Returns a cart's totals, with the price as an exact decimal string."""
+        return {"total_price": str(cart.total_price), "total_quantity": cart.total_quantity}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers requests on one connection, in order, until the client disconnects.
+
+        :param reader: The connection's input stream.
+        :type reader: asyncio.StreamReader
+        :param writer: The connection's output stream.
+        :type writer: asyncio.StreamWriter
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    response = self.handle(json.loads(line))
+                except ValueError:
+                    response = {"ok": False, "error": "Requests must be valid JSON."}
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                # Only waits if the client has stopped reading and the send buffer is full
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # ValueError: the client sent a line longer than the stream limit
+            pass
+        finally:
+            writer.close()
+
+    async def expire_holds(self, interval=EXPIRE_INTERVAL):
+        """Puts stock from expired holds back on sale every ``interval`` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            self.engine.expire()
+
+    async def save_carts(self, interval=SAVE_INTERVAL):
+        """Saves the carts that changed every ``interval`` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            self.save_sessions()
+
+    async def serve(self, host=HOST, port=PORT, started=None):
+        """
+        Serves the protocol until cancelled.
+
+        :param host: The address to listen on.
+        :type host: str
+        :param port: The port to listen on; 0 picks a free one.
+        :type port: int
+        :param started: If given, set to the listening server's bound port once it is accepting connections.
+        :type started: asyncio.Future, optional
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=1 << 20)
+        expiry = asyncio.ensure_future(self.expire_holds())
+        saving = asyncio.ensure_future(self.save_carts()) if self.cart_store is not None else None
+        if started is not None:
+            started.set_result(server.sockets[0].getsockname()[1])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            expiry.cancel()
+            if saving is not None:
+                saving.cancel()
+                self.save_sessions()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the store's carts over a JSON line protocol.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--carts', nargs='?', const=CART_STORE_PATH, metavar='PATH',
+                        help=f"Save carts between runs, by default in {CART_STORE_PATH}.")
+    parser.add_argument('--orders', default=ORDER_LOG_PATH, metavar='PATH',
+                        help=f"The order log checkouts are recorded in, by default {ORDER_LOG_PATH}.")
+    arguments = parser.parse_args()
+    checkpoint = catalog_checkpoint(CSV_FILE_PATH)
+    product_tree = csv_to_products(use_snapshot=True)
+    # Stock sold since the export was loaded comes back off before any cart is restored
+    replay_orders(product_tree, arguments.orders, checkpoint)
+    order_log = OrderLog(arguments.orders, checkpoint)
+    cart_store = CartStore(arguments.carts) if arguments.carts else None
+    service = CartService(product_tree, cart_store=cart_store, order_log=order_log)
+    try:
+        asyncio.run(service.serve(arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cart_store is not None:
+            service.save_sessions()
+            cart_store.close()
+        order_log.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import gc
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from .engine.structures import ProductTree
+
+MAGIC = b'SHOPSNAP'
+VERSION = 1
+# magic, version, source mtime (ns), source size, source sha1, string count, product count, string blob size
+HEADER = struct.Struct('<8sIqq20sIIQ')
+SEPARATOR = '\0'
+
+
+def snapshot_path(csv_file_path):
+    """Returns where the snapshot of a catalog CSV is kept."""
+    return os.path.splitext(csv_file_path)[0] + '.snapshot'
+
+
+def file_digest(path):
+    """Returns the SHA-1 digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def source_identity(csv_file_path):
+    """
+    Returns what a snapshot records about its source CSV: its modification time (ns), size and SHA-1
+    digest. Take it before parsing the CSV, so a change made during the load makes the snapshot stale.
+    """
+    stat = os.stat(csv_file_path)
+    return stat.st_mtime_ns, stat.st_size, file_digest(csv_file_path)
+
+
+def padding(offset):
+    """Returns the number of bytes needed to bring an offset up to 8-byte alignment."""
+    return -offset % 8
+
+
+def write_snapshot(product_tree, path, csv_file_path, source=None):
+    """
+    Writes a product tree to a snapshot file tied to the CSV it was loaded from.
+
+    The file holds a header, a string table of every department, category and product name, and then
+    the products as columns: department, category and name ids (uint32), prices (float64) and
+    quantities (int64). Columns are stored in little-endian order and 8-byte aligned so they can be
+    read straight out of a memory map.
+
+    :param product_tree: The tree to save.
+    :param path: Where to write the snapshot.
+    :param csv_file_path: The CSV the tree was loaded from.
+    :param source: The CSV's ``source_identity`` from before it was parsed. Defaults to reading it now.
+    :return: True if the snapshot was written, False if it could not be.
+    """
+    if sys.byteorder != 'little':
+        return False
+
+    string_ids = {}
+    strings = []
+
+    def intern(name):
+        string_id = string_ids.get(name)
+        if string_id is None:
+            string_id = string_ids[name] = len(strings)
+            strings.append(name)
+        return string_id
+
+    departments, categories, names = array('I'), array('I'), array('I')
+    prices, quantities = array('d'), array('q')
+    for department_node in product_tree.store.subcategories:
+        department_id = intern(department_node.name)
+        for category_node in department_node.subcategories:
+            category_id = intern(category_node.name)
+            for product_node in category_node.subcategories:
+                departments.append(department_id)
+                categories.append(category_id)
+                names.append(intern(product_node.name))
+                prices.append(product_node.price or 0.0)
+                quantities.append(product_node.quantity or 0)
+
+    if any(SEPARATOR in name for name in strings):
+        return False
+    blob = SEPARATOR.join(strings).encode('utf-8')
+
+    if source is None:
+        source = source_identity(csv_file_path)
+    header = HEADER.pack(MAGIC, VERSION, *source, len(strings), len(names), len(blob))
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary_path, 'wb') as file:
+            file.write(header)
+            file.write(blob)
+            file.write(b'\0' * padding(HEADER.size + len(blob)))
+            for column in (departments, categories, names):
+                file.write(column.tobytes())
+            file.write(b'\0' * padding(len(names) * 3 * departments.itemsize))
+            prices.tofile(file)
+            quantities.tofile(file)
+        os.replace(temporary_path, path)
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return False
+    return True
+
+
+def is_current(header, csv_file_path):
+    """
+    Checks whether a snapshot header still matches its source CSV. A matching modification time and
+    size is trusted; otherwise a file of the same size is compared by content hash, so a CSV that was
+    touched but not changed keeps its snapshot.
+    """
+    magic, version, mtime_ns, size, digest = header[:5]
+    if magic != MAGIC or version != VERSION:
+        return False
+    try:
+        stat = os.stat(csv_file_path)
+    except OSError:
+        return False
+    if stat.st_size != size:
+        return False
+    return stat.st_mtime_ns == mtime_ns or file_digest(csv_file_path) == digest
+
+
+def load_snapshot(path, csv_file_path, departments=None):
+    """
+    Loads a product tree from a snapshot. The file is memory-mapped to read its columns, but every
+    product is then added to a new ProductTree, so this skips parsing the CSV rather than building the
+    tree.
+
+    :param path: The snapshot to read.
+    :param csv_file_path: The CSV the snapshot must still match.
+    :param departments: If given, only these departments are loaded.
+    :return: The loaded product tree, or None if the snapshot is missing, stale or unreadable.
+    """
+    if sys.byteorder != 'little':
+        return None
+    try:
+        file = open(path, 'rb')
+    except OSError:
+        return None
+    with file:
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        with mapped, memoryview(mapped) as view:
+            if len(view) < HEADER.size:
+                return None
+            header = HEADER.unpack_from(view)
+            if not is_current(header, csv_file_path):
+                return None
+            string_count, product_count, blob_size = header[5:]
+
+            offset = HEADER.size
+            strings = str(view[offset:offset + blob_size], 'utf-8').split(SEPARATOR) if string_count else []
+            offset += blob_size + padding(HEADER.size + blob_size)
+            columns = []
+            for code, itemsize in (('I', 4), ('I', 4), ('I', 4), ('d', 8), ('q', 8)):
+                if code == 'd':
+                    offset += padding(offset)
+                end = offset + product_count * itemsize
+                if end > len(view):
+                    return None
+                with view[offset:end] as raw, raw.cast(code) as column:
+                    columns.append(column.tolist())
+                offset = end
+
+    if len(strings) != string_count:
+        return None
+    if departments is not None:
+        departments = set(departments)
+
+    product_tree = ProductTree()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        rows = ((strings[d], strings[c], strings[n], price, quantity)
+                for d, c, n, price, quantity in zip(*columns))
+        if departments is not None:
+            rows = (row for row in rows if row[0] in departments)
+        product_tree.add_products(rows)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return product_tree
@@ -1,18 +1,583 @@
 import csv
+import gc
 import os
+from array import array
+from itertools import compress, repeat
 
+from . import snapshot
+from .engine.instrumentation import instrumented, timed
 from .engine.structures import ProductTree
 
+CSV_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'StoreDatabase.csv')
+PROMOTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'promotions.json')
+CHUNK_SIZE = 10000
+RANGES_PER_WORKER = 4  # Byte ranges handed out per worker process, so a slow range does not hold up the rest
 
-def csv_to_products():
-    product_tree = ProductTree()
-    csv_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'StoreDatabase.csv')
+
+def parse_price(text):
+    """Parses a price such as '1,200.00', returning 0.0 for a blank field."""
+    if not text:
+        return 0.0
+    return float(text.replace(',', '') if ',' in text else text)
+
+
+def iter_catalog_batches(csv_file_path=CSV_FILE_PATH, chunk_size=CHUNK_SIZE, departments=None):
+    """
+    Streams the catalog CSV as batches of parsed rows.
+
+    :param csv_file_path: The catalog to read.
+    :param chunk_size: The number of rows in each batch.
+    :param departments: If given, only rows from these departments are kept.
+    :return: An iterator of lists of (department, category, product, price, quantity) tuples.
+    """
+    if departments is not None:
+        departments = set(departments)
     with open(csv_file_path, 'r', encoding='utf-8-sig', newline='') as file:
-        reader = csv.DictReader(file)
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [header.index(name) for name in ('Department', 'Category', 'Product', 'Price', 'Quantity')]
+        d_col, c_col, p_col, price_col, q_col = columns
+        width = max(columns)
+
+        batch = []
         for row in reader:
-            department, category, product = row.get('Department'), row.get('Category'), row.get('Product')
-            price = float(row.get('Price', '0').replace(',', ''))
-            quantity = int(row.get('Quantity', '0'))
+            if len(row) <= width:
+                continue
+            department = row[d_col]
+            if departments is not None and department not in departments:
+                continue
+            quantity = row[q_col]
+            batch.append((department, row[c_col], row[p_col], parse_price(row[price_col]),
+                          int(quantity) if quantity else 0))
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def read_catalog_header(csv_file_path):
+    """
+    Reads the header of the catalog CSV.
+
+    :param csv_file_path: The catalog to read.
+    :return: The column numbers of the department, category, product, price and quantity, and the byte
+    offset where the rows start; or None if the file is empty.
+    """
+    with open(csv_file_path, 'rb') as file:
+        line = file.readline()
+        if not line:
+            return None
+        header = next(csv.reader([line.decode('utf-8-sig')]))
+        columns = [header.index(name) for name in ('Department', 'Category', 'Product', 'Price', 'Quantity')]
+        return columns, file.tell()
+
+
+def split_catalog(csv_file_path, start, parts):
+    """
+    Splits the rows of the catalog CSV into byte ranges that begin and end on line boundaries. Fields
+    must not contain line breaks, which catalog exports never do.
+
+    :param csv_file_path: The catalog to split.
+    :param start: The byte offset where the rows start.
+    :param parts: The number of ranges wanted.
+    :return: A list of (start, end) byte offsets, in file order.
+    """
+    size = os.path.getsize(csv_file_path)
+    ranges = []
+    with open(csv_file_path, 'rb') as file:
+        for part in range(1, parts + 1):
+            end = start + (size - start) * part // parts
+            if end < size:
+                file.seek(end)
+                file.readline()
+                end = file.tell()
+            if end > start:
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+
+def parse_catalog_range(csv_file_path, start, end, columns, departments=None):
+    """
+    Parses one byte range of the catalog CSV, in a worker process.
+
+    The rows come back in a compact form that pickles quickly: each run of rows from the same department
+    and category is one entry, and the prices and quantities are packed arrays.
+
+    :param csv_file_path: The catalog to read.
+    :param start: The byte offset of the first row.
+    :param end: The byte offset just past the last row.
+    :param columns: The column numbers from ``read_catalog_header``.
+    :param departments: If given, only rows from these departments are kept.
+    :return: A (groups, products, prices, quantities) tuple, where groups lists (department, category,
+    count) runs.
+    """
+    with open(csv_file_path, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode('utf-8')
+    d_col, c_col, p_col, price_col, q_col = columns
+    width = max(columns)
+    groups = []
+    products = []
+    prices = array('d')
+    quantities = array('q')
+    current = None
+    count = 0
+    for row in csv.reader(text.splitlines()):
+        if len(row) <= width:
+            continue
+        department = row[d_col]
+        if departments is not None and department not in departments:
+            continue
+        if current != (department, row[c_col]):
+            if count:
+                groups.append((*current, count))
+            current = (department, row[c_col])
+            count = 0
+        quantity = row[q_col]
+        products.append(row[p_col])
+        prices.append(parse_price(row[price_col]))
+        quantities.append(int(quantity) if quantity else 0)
+        count += 1
+    if count:
+        groups.append((*current, count))
+    return groups, products, prices, quantities
+
+
+def iter_parallel_batches(csv_file_path=CSV_FILE_PATH, workers=None, departments=None):
+    """
+    Parses the catalog CSV in worker processes and streams the rows back in file order, so the tree is
+    built exactly as a single-process load would build it.
+
+    :param csv_file_path: The catalog to read.
+    :param workers: The number of worker processes. Defaults to the number of CPUs.
+    :param departments: If given, only rows from these departments are kept.
+    :return: An iterator of lists of (department, category, product, price, quantity) tuples, one per
+    byte range.
+    """
+    header = read_catalog_header(csv_file_path)
+    if header is None:
+        return
+    columns, start = header
+    workers = workers or os.cpu_count() or 1
+    if departments is not None:
+        departments = set(departments)
+    ranges = split_catalog(csv_file_path, start, workers * RANGES_PER_WORKER)
+    # Imported here because it pulls in multiprocessing, which single-process users should not pay for
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(workers) as executor:
+        chunks = executor.map(parse_catalog_range, repeat(csv_file_path), [start for start, _ in ranges],
+                              [end for _, end in ranges], repeat(columns), repeat(departments))
+        for groups, products, prices, quantities in chunks:
+            batch = []
+            position = 0
+            for department, category, count in groups:
+                batch.extend(zip(repeat(department, count), repeat(category, count),
+                                 products[position:position + count], prices[position:position + count],
+                                 quantities[position:position + count]))
+                position += count
+            yield batch
 
-            product_tree.add_product(department, category, product, price, quantity)
+
+@instrumented('catalog.csv_to_products')
+def csv_to_products(csv_file_path=CSV_FILE_PATH, chunk_size=CHUNK_SIZE, progress=None, departments=None,
+                    use_snapshot=False, workers=1):
+    """
+    Loads the catalog CSV into a ProductTree one batch at a time.
+
+    When ``use_snapshot`` is set, a binary snapshot kept next to the CSV is loaded instead if it is still
+    current, and a full load of the CSV writes or refreshes it. The snapshot only saves parsing the CSV;
+    the whole tree is still built.
+
+    :param csv_file_path: The catalog to read.
+    :param chunk_size: The number of rows handed to the tree at once.
+    :param progress: Called with the running number of rows loaded after every batch.
+    :param departments: If given, only these departments are loaded.
+    :param use_snapshot: Whether to read and write the catalog snapshot. Off by default, so loading a
+    catalog does not write next to it unless asked to.
+    :param workers: The number of processes that parse the CSV. With more than one, the file is split
+    into byte ranges parsed in parallel and ``chunk_size`` is not used; None uses every CPU.
+    :return: The loaded product tree.
+    """
+    if use_snapshot:
+        with timed('catalog.load_snapshot'):
+            product_tree = snapshot.load_snapshot(snapshot.snapshot_path(csv_file_path), csv_file_path, departments)
+        if product_tree is not None:
+            if progress is not None:
+                progress(len(product_tree.product_index))
+            return product_tree
+
+    # The snapshot is tied to the CSV as it was before parsing, so a change made during the load is seen.
+    source = snapshot.source_identity(csv_file_path) if use_snapshot and departments is None else None
+    product_tree = ProductTree()
+    loaded = 0
+    # The load only allocates, so pausing the cyclic garbage collector saves repeated full scans of the tree.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if workers == 1:
+            batches = iter_catalog_batches(csv_file_path, chunk_size, departments)
+        else:
+            batches = iter_parallel_batches(csv_file_path, workers, departments)
+        for batch in batches:
+            loaded += product_tree.add_products(batch)
+            if progress is not None:
+                progress(loaded)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    if source is not None:
+        with timed('catalog.write_snapshot'):
+            snapshot.write_snapshot(product_tree, snapshot.snapshot_path(csv_file_path), csv_file_path, source)
+    return product_tree
+
+
+def sqlite_path(csv_file_path):
+    """Returns where the SQLite copy of a catalog CSV is kept: next to it, with a .sqlite3 extension."""
+    return os.path.splitext(csv_file_path)[0] + '.sqlite3'
+
+
+def csv_to_sqlite(csv_file_path=CSV_FILE_PATH, database_path=None, chunk_size=CHUNK_SIZE, progress=None,
+                  departments=None, hot_cache_size=None):
+    """
+    Loads the catalog CSV into a SQLiteProductTree, for catalogs too large to hold in a ProductTree.
+
+    Each batch of rows is written with one ``executemany`` in its own transaction, so memory use stays
+    at one batch however large the catalog is. The database remembers which export it was loaded from,
+    and is opened as it is while the CSV has not changed since.
+
+    :param csv_file_path: The catalog to read.
+    :param database_path: The database to load into. Defaults to one next to the CSV.
+    :param chunk_size: The number of rows written at once.
+    :param progress: Called with the running number of rows loaded after every batch.
+    :param departments: If given, only these departments are loaded.
+    :param hot_cache_size: The most products the tree keeps in memory. Defaults to the tree's default.
+    :return: The loaded product tree.
+    """
+    from .engine.sqlite_tree import HOT_CACHE_SIZE, SQLiteProductTree
+
+    if database_path is None:
+        database_path = sqlite_path(csv_file_path)
+    if hot_cache_size is None:
+        hot_cache_size = HOT_CACHE_SIZE
+    stat = os.stat(csv_file_path)
+    source = f'{stat.st_mtime_ns}:{stat.st_size}:{",".join(sorted(departments)) if departments is not None else ""}'
+
+    product_tree = SQLiteProductTree(database_path, hot_cache_size)
+    if product_tree.get_meta('source') == source:
+        return product_tree
+    if product_tree.get_departments() or product_tree.get_meta('source') is not None:
+        # Loaded from another export: start again from an empty database
+        product_tree.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database_path + suffix):
+                os.remove(database_path + suffix)
+        product_tree = SQLiteProductTree(database_path, hot_cache_size)
+
+    loaded = 0
+    with timed('catalog.load_sqlite'):
+        for batch in iter_catalog_batches(csv_file_path, chunk_size, departments):
+            loaded += product_tree.add_products(batch)
+            if progress is not None:
+                progress(loaded)
+    product_tree.set_meta('source', source)
     return product_tree
+
+
+def read_promotions(path=PROMOTIONS_PATH):
+    """
+    Reads the store's promotions and tax rate from a JSON file such as::
+
+        {"tax_rate": "0.08",
+         "rules": [{"type": "percent_off", "percent": 10, "department": "Clothing"},
+                   {"type": "buy_get_free", "buy": 2, "free": 1, "product": "Bandana"},
+                   {"type": "tiered", "tiers": [[10, 5], [50, 12]], "category": "Snacks", "department": "Grocery"}]}
+
+    A missing file means no promotions and no tax.
+
+    :param path: The promotions file.
+    :return: A (rules, tax rate) tuple.
+    :raises ValueError: If the file is not valid JSON or a rule is malformed.
+    """
+    import json
+
+    from .engine.pricing import rule_from_dict, to_decimal
+
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            promotions = json.load(file)
+    except FileNotFoundError:
+        return [], to_decimal(0)
+    return ([rule_from_dict(record) for record in promotions.get('rules', ())],
+            to_decimal(promotions.get('tax_rate', 0)))
+
+
+class CatalogDelta:
+    """
+    The products changed by one catalog sync.
+
+    :param inserted: Products added to the tree, including ones moved to another category.
+    :param price_updated: Products whose price changed.
+    :param quantity_updated: Products whose quantity changed.
+    :param deleted: Products removed from the tree, including ones moved to another category.
+    """
+
+    def __init__(self):
+        self.inserted = []
+        self.price_updated = []
+        self.quantity_updated = []
+        self.deleted = []
+
+    def __bool__(self):
+        return bool(self.inserted or self.price_updated or self.quantity_updated or self.deleted)
+
+    def __repr__(self):
+        return (f'CatalogDelta(inserted={self.inserted!r}, price_updated={self.price_updated!r}, '
+                f'quantity_updated={self.quantity_updated!r}, deleted={self.deleted!r})')
+
+
+class CatalogSync:
+    """
+    Keeps a loaded ProductTree in step with later exports of its catalog CSV.
+
+    Every line of the last export is remembered by its hash, so ``sync`` only parses and applies the
+    lines that are new or changed, and deletes products whose lines are gone. ``poll`` is cheap enough to
+    call on a timer: it does nothing if the file is untouched, only reads the new lines if rows were
+    appended, and falls back to ``sync`` if the file was rewritten.
+
+    Each product's row in the last export is remembered too, and only the fields that differ from it
+    are applied. A change in quantity is applied as the difference between the two exports, so stock
+    sold, held in carts or replayed from the order log since the tree was loaded is kept.
+
+    :param product_tree: The tree to keep up to date.
+    :param csv_file_path: The catalog export.
+    """
+
+    TAIL_SIZE = 64  # Bytes before the read position compared to tell an append from a rewrite
+
+    def __init__(self, product_tree, csv_file_path=CSV_FILE_PATH):
+        self.product_tree = product_tree
+        self.csv_file_path = csv_file_path
+        self.row_hashes = {}  # Hash of a raw CSV line -> its product
+        self.product_hashes = {}  # Product -> hash of its current line
+        self.product_rows = {}  # Product -> its parsed row in the last export applied
+        self.repeated = False  # Whether a product is on more than one line
+        self.columns = None
+        self.offset = 0
+        self.tail = b''
+        self.stat = None
+
+    def read(self):
+        """Reads the whole export, remembering its size, end and header."""
+        with open(self.csv_file_path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            data = file.read()
+        self.stat = (stat.st_mtime_ns, stat.st_size)
+        self.offset = len(data)
+        self.tail = data[-self.TAIL_SIZE:]
+        lines = data.splitlines()
+        if not lines:
+            self.columns = None
+            return []
+        header = next(csv.reader([lines[0].decode('utf-8-sig')]))
+        self.columns = [header.index(name) for name in ('Department', 'Category', 'Product', 'Price', 'Quantity')]
+        return lines[1:]
+
+    def parse(self, lines):
+        """Parses raw CSV lines into (department, category, product, price, quantity) tuples, or None if too short."""
+        d_col, c_col, p_col, price_col, q_col = self.columns
+        width = max(self.columns)
+        for row in csv.reader(line.decode('utf-8') for line in lines):
+            if len(row) <= width:
+                yield None
+            else:
+                quantity = row[q_col]
+                yield (row[d_col], row[c_col], row[p_col], parse_price(row[price_col]),
+                       int(quantity) if quantity else 0)
+
+    def baseline(self):
+        """
+        Records the current export as the state of the tree without changing the tree, for a tree that
+        was just loaded from this file.
+        """
+        lines = list(filter(None, self.read()))
+        self.row_hashes = {}
+        self.product_rows = {}
+        for line, row in zip(lines, self.parse(lines)):
+            self.row_hashes[hash(line)] = row[2] if row is not None else None
+            if row is not None:
+                self.product_rows[row[2]] = row
+        self.product_hashes = {}
+        for line in lines:
+            line_hash = hash(line)
+            product = self.row_hashes[line_hash]
+            if product is not None:
+                self.product_hashes.pop(product, None)
+                self.product_hashes[product] = line_hash
+        self.repeated = self.has_repeated_products()
+
+    def has_repeated_products(self):
+        """Tells whether any product is on more than one distinct line of the export."""
+        return len(self.product_hashes) < len(self.row_hashes) - sum(1 for product in self.row_hashes.values()
+                                                                      if product is None)
+
+    @instrumented('catalog.sync')
+    def sync(self):
+        """
+        Applies every difference between the export and the last one seen to the tree.
+
+        :return: The products that changed.
+        """
+        lines = list(filter(None, self.read()))
+        hashes = list(map(hash, lines))
+        new_hashes = set(hashes)
+        removed = self.row_hashes.keys() - new_hashes
+        changed = new_hashes - self.row_hashes.keys()
+        changed_lines = list(dict.fromkeys(compress(lines, map(changed.__contains__, hashes))))
+        parsed = list(self.parse(changed_lines))
+        rows = [row for row in parsed if row is not None]
+
+        # When every product is on one line, a changed line replaces the product's old line, if any
+        products = [row[2] for row in rows]
+        if self.repeated or len(set(products)) < len(products) or any(
+                product in self.product_hashes and self.product_hashes[product] not in removed
+                for product in products):
+            return self.sync_all(lines, hashes)
+
+        delta = CatalogDelta()
+        for row in rows:
+            self.apply_row(row, delta)
+        kept = set(products)
+        for line_hash in removed:
+            product = self.row_hashes.pop(line_hash)
+            if product is not None and product not in kept and self.product_hashes.get(product) == line_hash:
+                del self.product_hashes[product]
+                self.product_rows.pop(product, None)
+                location = self.product_tree.locate(product)
+                if location is not None:
+                    self.product_tree.delete_product(location[0], location[1], product)
+                    delta.deleted.append(product)
+        for line, row in zip(changed_lines, parsed):
+            line_hash = hash(line)
+            self.row_hashes[line_hash] = row[2] if row is not None else None
+            if row is not None:
+                self.product_hashes[row[2]] = line_hash
+        return delta
+
+    def sync_all(self, lines, hashes):
+        """
+        Applies an export to the tree by accounting for every line, for exports that list a product on
+        more than one line. Like a full load, a product's last line wins.
+
+        :param lines: The export's non-empty data lines.
+        :param hashes: The hash of each line.
+        :return: The products that changed.
+        """
+        delta = CatalogDelta()
+        line_of = dict(zip(hashes, lines))
+        row_hashes = dict(zip(hashes, map(self.row_hashes.get, hashes)))
+        changed = list(row_hashes.keys() - self.row_hashes.keys())
+        for line_hash, row in zip(changed, self.parse([line_of[line_hash] for line_hash in changed])):
+            row_hashes[line_hash] = row[2] if row is not None else None
+
+        product_hashes = dict(zip(map(row_hashes.__getitem__, hashes), hashes))
+        product_hashes.pop(None, None)
+        to_apply = product_hashes.items() - self.product_hashes.items()
+        for row in self.parse([line_of[line_hash] for _, line_hash in to_apply]):
+            self.apply_row(row, delta)
+
+        for product in set(self.product_tree.product_index).difference(product_hashes):
+            self.product_rows.pop(product, None)
+            department, category, _ = self.product_tree.locate(product)
+            self.product_tree.delete_product(department, category, product)
+            delta.deleted.append(product)
+
+        self.row_hashes, self.product_hashes = row_hashes, product_hashes
+        self.repeated = self.has_repeated_products()
+        return delta
+
+    @instrumented('catalog.poll')
+    def poll(self):
+        """
+        Checks the export for changes and applies them.
+
+        :return: The products that changed, or None if the file has not changed.
+        """
+        try:
+            stat = os.stat(self.csv_file_path)
+        except OSError:
+            return None
+        if self.stat == (stat.st_mtime_ns, stat.st_size):
+            return None
+        if self.columns is None or stat.st_size <= self.offset:
+            return self.sync()
+
+        with open(self.csv_file_path, 'rb') as file:
+            file.seek(self.offset - len(self.tail))
+            if file.read(len(self.tail)) != self.tail:
+                return self.sync()
+            appended = file.read()
+        # Leave a last line without its newline for the next poll; the writer may still be writing it
+        complete = appended[:appended.rfind(b'\n') + 1]
+        self.offset += len(complete)
+        self.tail = (self.tail + complete)[-self.TAIL_SIZE:]
+        self.stat = (stat.st_mtime_ns, self.offset) if len(complete) == len(appended) else None
+
+        delta = CatalogDelta()
+        lines = [line for line in complete.splitlines() if line]
+        for line, row in zip(lines, self.parse(lines)):
+            if row is not None:
+                line_hash = hash(line)
+                if row[2] in self.product_hashes:
+                    # The product's earlier line is still in the file
+                    self.repeated = True
+                self.row_hashes[line_hash] = row[2]
+                self.product_hashes[row[2]] = line_hash
+                self.apply_row(row, delta)
+        return delta
+
+    def apply_row(self, row, delta):
+        """
+        Inserts, moves or updates the product on one parsed row, recording what changed. The row is
+        compared with the product's row in the previous export, or with the tree for a product that had
+        none, and its quantity is changed by the difference rather than replaced.
+        """
+        department, category, product, price, quantity = row
+        previous = self.product_rows.get(product)
+        self.product_rows[product] = row
+        location = self.product_tree.locate(product)
+        if location is None:
+            self.product_tree.add_product(department, category, product, price, quantity)
+            delta.inserted.append(product)
+            return
+        p_node = location[2]
+        if previous is not None:
+            change = quantity - previous[4]
+            old_price = previous[3]
+        else:
+            change = quantity - (p_node.quantity or 0)
+            old_price = p_node.price
+        if location[:2] != (department, category):
+            self.product_tree.delete_product(location[0], location[1], product)
+            self.product_tree.add_product(department, category, product, price, (p_node.quantity or 0) + change)
+            delta.deleted.append(product)
+            delta.inserted.append(product)
+            return
+        if price == old_price and not change:
+            return
+        tree = self.product_tree
+        with tree.lock_for(product):
+            p_node.price = price
+            p_node.quantity = (p_node.quantity or 0) + change
+            remaining = p_node.quantity
+            p_node.parent.version += 1
+            tree.version += 1
+        if price != old_price:
+            delta.price_updated.append(product)
+        if change:
+            delta.quantity_updated.append(product)
+            tree.notify(product, remaining)
@@ -1,8 +1,22 @@
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
-from unittest.mock import patch
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
 
 import shopping
+import shopping.engine.pricing
+import shopping.engine.sqlite_tree
+from shopping.engine.inventory import InventoryEngine
 from shopping.gui import GUI
+from shopping.orders import CheckoutPipeline, OrderLog
+from shopping.service import CartService
 
 
 class TestNode(unittest.TestCase):
@@ -38,6 +52,26 @@ class TestProductNode(unittest.TestCase):
         product_node = shopping.engine.nodes.ProductNode("Test")
         self.assertEqual(product_node.subcategories, [])
 
+    def test_product_node_has_no_instance_dict(self):
+        product_node = shopping.engine.nodes.ProductNode("Test")
+        self.assertFalse(hasattr(product_node, '__dict__'))
+        self.assertFalse(hasattr(shopping.engine.nodes.CartItem(), '__dict__'))
+
+    def test_product_node_add_child_sets_parent(self):
+        parent = shopping.engine.nodes.ProductNode("Laptops")
+        child = parent.add_child(shopping.engine.nodes.ProductNode("MacBook", 2000, 10))
+        self.assertIs(child.parent, parent)
+        self.assertIs(parent.children["MacBook"], child)
+        self.assertEqual(list(parent.iter_children()), [child])
+
+    def test_leaf_node_allocates_no_children(self):
+        tree = shopping.engine.structures.ProductTree()
+        tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
+        tree.print_tree()
+        leaf = tree.get_product_node('MacBook')
+        self.assertIsNone(leaf._subcategories)
+        self.assertIsNone(leaf._children)
+
 
 class TestProductTree(unittest.TestCase):
     def setUp(self):
@@ -55,6 +89,803 @@ class TestProductTree(unittest.TestCase):
         self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
         self.assertEqual(self.tree.store.subcategories[0].subcategories[0].name, 'Laptops')
 
+    def test_add_product_indexes_nodes(self):
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
+        department_node = self.tree.store.children['Electronics']
+        category_node = department_node.children['Laptops']
+        self.assertIs(category_node.children['MacBook'], self.tree.get_product_node('MacBook'))
+
+    def test_locate_product(self):
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
+        department, category, node = self.tree.locate('MacBook')
+        self.assertEqual((department, category, node.price), ('Electronics', 'Laptops', 2000))
+
+    def test_locate_missing_product(self):
+        self.assertIsNone(self.tree.locate('MacBook'))
+        self.assertIsNone(self.tree.get_product_node('MacBook'))
+
+    def test_delete_product_updates_index(self):
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
+        self.assertTrue(self.tree.delete_product('Electronics', 'Laptops', 'MacBook'))
+        self.assertIsNone(self.tree.locate('MacBook'))
+        self.assertEqual(self.tree.get_products('Electronics', 'Laptops'), {})
+
+    def test_delete_product_wrong_category(self):
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
+        self.assertFalse(self.tree.delete_product('Electronics', 'Tablets', 'MacBook'))
+        self.assertIsNotNone(self.tree.locate('MacBook'))
+
+    def test_add_product_updates_existing_product(self):
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 1800, 4)
+        self.assertEqual(self.tree.get_products('Electronics', 'Laptops'), {'MacBook': {'price': 1800, 'quantity': 4}})
+
+    def test_subcategories_keep_insertion_order(self):
+        for name in ['Zenbook', 'MacBook', 'ThinkPad']:
+            self.tree.add_product('Electronics', 'Laptops', name, 1000, 1)
+        self.assertEqual(list(self.tree.get_products('Electronics', 'Laptops')), ['Zenbook', 'MacBook', 'ThinkPad'])
+
+    def test_lookups_do_not_create_nodes(self):
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
+        self.assertEqual(self.tree.get_categories('Elektronics'), ())
+        self.assertEqual(self.tree.get_products('Electronics', 'Phones'), {})
+        self.assertEqual(self.tree.get_products(None, None), {})
+        self.assertFalse(self.tree.remove_product('Toys', 'Blocks', 'MacBook'))
+        self.assertIsNone(self.tree.find_node('Electronics', 'Phones'))
+        self.assertEqual(self.tree.get_departments(), ('Electronics',))
+        self.assertEqual(self.tree.get_categories('Electronics'), ('Laptops',))
+
+    def test_compact_prunes_empty_nodes(self):
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
+        self.tree.add_product('Electronics', 'Tablets', 'iPad', 800, 5)
+        self.tree.add_product('Home', 'Kitchen', 'Kettle', 25, 7)
+        self.tree.get_products('Home', 'Kitchen')
+        self.tree.delete_product('Electronics', 'Tablets', 'iPad')
+        self.tree.delete_product('Home', 'Kitchen', 'Kettle')
+        self.assertEqual(self.tree.compact(), 3)
+        self.assertEqual(self.tree.get_departments(), ('Electronics',))
+        self.assertEqual(self.tree.get_categories('Electronics'), ('Laptops',))
+        self.assertEqual(self.tree.get_products('Home', 'Kitchen'), {})
+        self.assertEqual(self.tree.compact(), 0)
+
+
+class TestReadPathFuzz(unittest.TestCase):
+    def count_nodes(self, node):
+        return 1 + sum(self.count_nodes(child) for child in node.iter_children())
+
+    def test_reads_never_change_tree_size(self):
+        tree = shopping.store_products.csv_to_products()
+        rng = random.Random(1234)
+        departments = list(tree.get_departments())
+        categories = [(department, category) for department in departments
+                      for category in tree.get_categories(department)]
+        products = list(tree.product_index)
+        names = departments + [category for _, category in categories] + products + [None, '', 'Nothing']
+
+        def misspell(name):
+            if not name or rng.random() < 0.5:
+                return name
+            position = rng.randrange(len(name))
+            return name[:position] + rng.choice('xyz ') + name[position + 1:]
+
+        reads = [
+            lambda: tree.get_departments(),
+            lambda: tree.get_categories(misspell(rng.choice(names))),
+            lambda: tree.get_products(misspell(rng.choice(names)), misspell(rng.choice(names))),
+            lambda: tree.get_products(*rng.choice(categories)),
+            lambda: tree.find_node(misspell(rng.choice(names)), misspell(rng.choice(names))),
+            lambda: tree.locate(misspell(rng.choice(products))),
+            lambda: tree.get_product_node(misspell(rng.choice(products))),
+            lambda: tree.search(misspell(rng.choice(products)) or 'a', 5),
+            lambda: tree.products_in_price_range(rng.uniform(0, 50), rng.uniform(50, 500)),
+            lambda: tree.low_stock(rng.randrange(20)),
+        ]
+        with patch('builtins.print'):
+            reads.append(lambda: tree.remove_product(misspell(rng.choice(names)), misspell(rng.choice(names)),
+                                                     'No Such Product'))
+            size, product_count = self.count_nodes(tree.store), len(tree.product_index)
+            for _ in range(5000):
+                rng.choice(reads)()
+        self.assertEqual(self.count_nodes(tree.store), size)
+        self.assertEqual(len(tree.product_index), product_count)
+
+
+class TestReadViews(unittest.TestCase):
+    def setUp(self):
+        self.tree = shopping.engine.structures.ProductTree()
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
+        self.tree.add_product('Electronics', 'Tablets', 'iPad', 800, 5)
+
+    def test_views_are_cached(self):
+        products = self.tree.get_products('Electronics', 'Laptops')
+        self.assertIs(self.tree.get_products('Electronics', 'Laptops'), products)
+        self.assertIs(self.tree.get_departments(), self.tree.get_departments())
+        self.assertEqual(self.tree.view_cache.hits, 2)
+
+    def test_views_are_read_only(self):
+        products = self.tree.get_products('Electronics', 'Laptops')
+        with self.assertRaises(TypeError):
+            products['MacBook']['quantity'] = 0
+        with self.assertRaises(TypeError):
+            products['Surface'] = {}
+
+    def test_stock_change_invalidates_category_only(self):
+        laptops = self.tree.get_products('Electronics', 'Laptops')
+        tablets = self.tree.get_products('Electronics', 'Tablets')
+        self.assertTrue(self.tree.reserve('MacBook', 3))
+        self.assertEqual(self.tree.get_products('Electronics', 'Laptops')['MacBook']['quantity'], 7)
+        self.assertIs(self.tree.get_products('Electronics', 'Tablets'), tablets)
+        self.assertEqual(laptops['MacBook']['quantity'], 10)
+
+    def test_changes_invalidate_views(self):
+        self.tree.get_categories('Electronics')
+        self.tree.add_product('Electronics', 'Phones', 'Pixel', 600, 2)
+        self.assertEqual(self.tree.get_categories('Electronics'), ('Laptops', 'Tablets', 'Phones'))
+        self.tree.get_products('Electronics', 'Laptops')
+        self.tree.remove_product('Electronics', 'Laptops', 'MacBook')
+        self.assertEqual(self.tree.get_products('Electronics', 'Laptops')['MacBook']['quantity'], 9)
+        self.tree.delete_product('Electronics', 'Laptops', 'MacBook')
+        self.assertEqual(self.tree.get_products('Electronics', 'Laptops'), {})
+
+    def test_checkout_invalidates_views(self):
+        engine = InventoryEngine(self.tree)
+        cart = shopping.engine.structures.ShoppingCart(self.tree)
+        engine.add_to_cart(cart, 'iPad', 2)
+        self.tree.get_products('Electronics', 'Tablets')
+        self.assertTrue(engine.checkout(cart))
+        self.assertEqual(self.tree.get_products('Electronics', 'Tablets')['iPad']['quantity'], 3)
+
+    def test_least_recently_used_view_is_evicted(self):
+        tree = shopping.engine.structures.ProductTree(view_cache_size=2)
+        tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 10)
+        tree.add_product('Electronics', 'Tablets', 'iPad', 800, 5)
+        laptops = tree.get_products('Electronics', 'Laptops')
+        tree.get_products('Electronics', 'Tablets')
+        tree.get_products('Electronics', 'Laptops')
+        tree.get_departments()
+        self.assertIs(tree.get_products('Electronics', 'Laptops'), laptops)
+        stats = tree.view_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']), (2, 3, 1, 2))
+
+
+class TestInventoryEvents(unittest.TestCase):
+    def setUp(self):
+        self.tree = shopping.engine.structures.ProductTree()
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 2)
+        self.events = []
+        self.tree.subscribe(lambda product, quantity: self.events.append((product, quantity)))
+
+    def test_reserve_takes_stock(self):
+        self.assertTrue(self.tree.reserve('MacBook'))
+        self.assertEqual(self.tree.get_product_node('MacBook').quantity, 1)
+        self.assertEqual(self.events, [('MacBook', 1)])
+
+    def test_reserve_is_all_or_nothing(self):
+        self.assertFalse(self.tree.reserve('MacBook', 3))
+        self.assertEqual(self.tree.get_product_node('MacBook').quantity, 2)
+        self.assertEqual(self.events, [])
+
+    def test_reserve_unknown_product(self):
+        self.assertFalse(self.tree.reserve('Zenbook'))
+
+    def test_release_returns_stock(self):
+        self.tree.reserve('MacBook', 2)
+        self.assertTrue(self.tree.release('MacBook'))
+        self.assertEqual(self.events, [('MacBook', 0), ('MacBook', 1)])
+        self.assertFalse(self.tree.release('Zenbook'))
+
+    def test_add_product_notifies(self):
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 9)
+        self.tree.add_products([('Electronics', 'Laptops', 'Zenbook', 999, 4)])
+        self.assertEqual(self.events, [('MacBook', 9), ('Zenbook', 4)])
+
+    def test_unsubscribe(self):
+        self.tree.listeners.clear()
+        listener = self.events.append
+        self.tree.subscribe(listener)
+        self.tree.unsubscribe(listener)
+        self.tree.reserve('MacBook')
+        self.assertEqual(self.events, [])
+
+
+class TestInventoryEngine(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.tree = shopping.engine.structures.ProductTree()
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 2)
+        self.tree.add_product('Electronics', 'Laptops', 'Zenbook', 999, 5)
+        self.engine = InventoryEngine(self.tree, hold_seconds=60, clock=lambda: self.now)
+        self.cart = shopping.engine.structures.ShoppingCart(self.tree)
+
+    def stock(self, product):
+        return self.tree.get_product_node(product).quantity
+
+    def test_remove_product_out_of_stock_refuses(self):
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 0)
+        self.assertFalse(self.tree.remove_product('Electronics', 'Laptops', 'MacBook'))
+        self.assertEqual(self.stock('MacBook'), 0)
+
+    def test_add_to_cart_holds_stock(self):
+        self.assertTrue(self.engine.add_to_cart(self.cart, 'MacBook', 2))
+        self.assertEqual(self.stock('MacBook'), 0)
+        self.assertEqual(self.engine.held_quantity(self.cart, 'MacBook'), 2)
+        self.assertFalse(self.engine.add_to_cart(self.cart, 'MacBook'))
+        self.assertEqual(self.cart.get_quantity('MacBook'), 2)
+
+    def test_non_positive_quantities_are_rejected(self):
+        for quantity in (0, -1000):
+            with self.assertRaises(ValueError):
+                self.engine.add_to_cart(self.cart, 'MacBook', quantity)
+            with self.assertRaises(ValueError):
+                self.tree.reserve('MacBook', quantity)
+            with self.assertRaises(ValueError):
+                self.tree.release('MacBook', quantity)
+        with self.assertRaises(ValueError):
+            self.engine.add_many(self.cart, [('Zenbook', 1), ('MacBook', -1)])
+        with self.assertRaises(ValueError):
+            self.engine.set_quantity(self.cart, 'MacBook', -1)
+        self.assertEqual((self.stock('MacBook'), self.stock('Zenbook')), (2, 5))
+        self.assertTrue(self.cart.is_empty())
+        self.assertEqual(self.engine.holds, {})
+
+    def test_remove_from_cart_releases_hold(self):
+        self.engine.add_to_cart(self.cart, 'MacBook')
+        self.assertTrue(self.engine.remove_from_cart(self.cart, 'MacBook'))
+        self.assertEqual(self.stock('MacBook'), 2)
+        self.assertFalse(self.engine.remove_from_cart(self.cart, 'MacBook'))
+
+    def test_expired_holds_return_to_stock(self):
+        self.engine.add_to_cart(self.cart, 'MacBook')
+        self.now = 30
+        self.engine.add_to_cart(self.cart, 'Zenbook')
+        self.now = 60
+        self.assertEqual(self.engine.expire(), 1)
+        self.assertEqual((self.stock('MacBook'), self.stock('Zenbook')), (2, 4))
+        self.assertEqual(self.cart.get_cart_items(), ['MacBook', 'Zenbook'])
+
+    def test_adding_again_extends_hold(self):
+        self.engine.add_to_cart(self.cart, 'MacBook')
+        self.now = 50
+        self.engine.add_to_cart(self.cart, 'MacBook')
+        self.now = 70
+        self.assertEqual(self.engine.expire(), 0)
+        self.assertEqual(self.engine.held_quantity(self.cart, 'MacBook'), 2)
+
+    def test_checkout_commits_holds(self):
+        self.engine.add_to_cart(self.cart, 'MacBook')
+        self.engine.add_to_cart(self.cart, 'Zenbook', 3)
+        self.assertTrue(self.engine.checkout(self.cart))
+        self.assertTrue(self.cart.is_empty())
+        self.assertEqual((self.stock('MacBook'), self.stock('Zenbook')), (1, 2))
+        self.now = 120
+        self.assertEqual(self.engine.expire(), 0)
+        self.assertEqual((self.stock('MacBook'), self.stock('Zenbook')), (1, 2))
+
+    def test_checkout_retakes_expired_stock(self):
+        self.engine.add_to_cart(self.cart, 'MacBook')
+        self.now = 120
+        self.assertTrue(self.engine.checkout(self.cart))
+        self.assertEqual(self.stock('MacBook'), 1)
+
+    def test_checkout_is_all_or_nothing(self):
+        other_cart = shopping.engine.structures.ShoppingCart(self.tree)
+        self.engine.add_to_cart(self.cart, 'MacBook', 2)
+        self.engine.add_to_cart(self.cart, 'Zenbook')
+        self.now = 120
+        self.engine.add_to_cart(other_cart, 'MacBook')
+        self.assertFalse(self.engine.checkout(self.cart))
+        self.assertEqual((self.stock('MacBook'), self.stock('Zenbook')), (1, 5))
+        self.assertEqual(self.cart.get_quantity('MacBook'), 2)
+
+    def test_release_cart(self):
+        self.engine.add_to_cart(self.cart, 'Zenbook', 4)
+        self.engine.release_cart(self.cart)
+        self.assertTrue(self.cart.is_empty())
+        self.assertEqual(self.stock('Zenbook'), 5)
+
+    def test_concurrent_carts_never_oversell(self):
+        self.tree.add_product('Electronics', 'Laptops', 'MacBook', 2000, 100)
+        sold = []
+
+        def shop():
+            cart = shopping.engine.structures.ShoppingCart(self.tree)
+            for _ in range(60):
+                self.engine.add_to_cart(cart, 'MacBook')
+            quantity = cart.total_quantity
+            if self.engine.checkout(cart):
+                sold.append(quantity)
+
+        threads = [threading.Thread(target=shop) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(sold) + self.stock('MacBook'), 100)
+        self.assertGreaterEqual(self.stock('MacBook'), 0)
+
+
+    def test_add_many_skips_lines_without_stock(self):
+        notifications = []
+        self.cart.subscribe(notifications.append)
+        missing = self.engine.add_many(self.cart, [('MacBook', 3), ('Zenbook', 2), ('Pixel', 1)])
+        self.assertEqual(missing, [('MacBook', 3), ('Pixel', 1)])
+        self.assertEqual(self.cart.get_cart_items(), ['Zenbook', 'Zenbook'])
+        self.assertEqual(self.stock('Zenbook'), 3)
+        self.assertEqual(len(notifications), 1)
+
+    def test_remove_many_releases_holds(self):
+        self.engine.add_many(self.cart, [('MacBook', 2), ('Zenbook', 2)])
+        self.assertEqual(self.engine.remove_many(self.cart, [('MacBook', 1), ('Zenbook', 5)]), 3)
+        self.assertEqual((self.stock('MacBook'), self.stock('Zenbook')), (1, 5))
+        self.assertEqual(self.engine.held_quantity(self.cart, 'MacBook'), 1)
+        self.assertEqual(self.engine.held_quantity(self.cart, 'Zenbook'), 0)
+
+    def test_set_quantity(self):
+        self.assertTrue(self.engine.set_quantity(self.cart, 'Zenbook', 4))
+        self.assertTrue(self.engine.set_quantity(self.cart, 'Zenbook', 1))
+        self.assertFalse(self.engine.set_quantity(self.cart, 'Zenbook', 7))
+        self.assertEqual(self.cart.get_quantity('Zenbook'), 1)
+        self.assertEqual(self.stock('Zenbook'), 4)
+
+class TestCartService(unittest.TestCase):
+    def setUp(self):
+        tree = shopping.engine.structures.ProductTree()
+        tree.add_product('Clothing', 'Accessories', 'Bandana', 10.00, 3)
+        tree.add_product('Clothing', 'Accessories', 'Belt', 15.00, 1)
+        self.service = CartService(tree)
+
+    def test_browse(self):
+        self.assertEqual(self.service.handle({'op': 'departments'}), {'departments': ['Clothing'], 'ok': True})
+        response = self.service.handle({'op': 'products', 'department': 'Clothing', 'category': 'Accessories'})
+        self.assertEqual(response['products']['Belt'], {'price': 15.0, 'quantity': 1})
+
+    def test_sessions_have_their_own_carts(self):
+        self.service.handle({'op': 'add', 'session': 'a', 'product': 'Bandana', 'quantity': 2})
+        response = self.service.handle({'op': 'add', 'session': 'b', 'product': 'Belt'})
+        self.assertEqual((response['total_price'], response['total_quantity']), ('15.0', 1))
+        self.assertEqual(self.service.handle({'op': 'cart', 'session': 'a'})['items'], ['Bandana', 'Bandana'])
+
+    def test_add_without_stock(self):
+        self.service.handle({'op': 'add', 'session': 'a', 'product': 'Belt'})
+        self.assertFalse(self.service.handle({'op': 'add', 'session': 'b', 'product': 'Belt'})['added'])
+
+    def test_checkout_and_close(self):
+        self.service.handle({'op': 'add', 'session': 'a', 'product': 'Bandana'})
+        self.service.handle({'op': 'add', 'session': 'b', 'product': 'Bandana', 'quantity': 2})
+        response = self.service.handle({'op': 'checkout', 'session': 'a'})
+        self.assertEqual((response['checked_out'], response['total_price']), (True, '10.0'))
+        self.service.handle({'op': 'close', 'session': 'b'})
+        self.assertEqual(self.service.product_tree.get_product_node('Bandana').quantity, 2)
+
+    def test_checkout_is_logged(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        log_path = os.path.join(directory.name, 'orders.log')
+        order_log = OrderLog(log_path)
+        self.addCleanup(order_log.close)
+        service = CartService(self.service.product_tree, order_log=order_log)
+        service.handle({'op': 'add', 'session': 'a', 'product': 'Belt'})
+        response = service.handle({'op': 'checkout', 'session': 'a'})
+        self.assertEqual((response['checked_out'], response['order_id']), (True, 1))
+        self.assertEqual([order['lines'] for order in shopping.orders.read_orders(log_path)], [[['Belt', 1]]])
+        order_log.close()
+        service.handle({'op': 'add', 'session': 'a', 'product': 'Bandana'})
+        self.assertFalse(service.handle({'op': 'checkout', 'session': 'a'})['ok'])
+        self.assertEqual(service.handle({'op': 'cart', 'session': 'a'})['items'], ['Bandana'])
+
+    def test_errors(self):
+        self.assertFalse(self.service.handle({'op': 'explode'})['ok'])
+        self.assertEqual(self.service.handle({'op': 'add', 'session': 'a'}),
+                         {'ok': False, 'error': "Missing argument 'product'."})
+        self.assertFalse(self.service.handle(['add'])['ok'])
+
+    def test_bad_arguments_are_errors(self):
+        response = self.service.handle({'op': 'add', 'session': 'a', 'product': 'Bandana', 'quantity': -1000})
+        self.assertEqual(response, {'ok': False, 'error': 'Quantity must be at least 1, not -1000.'})
+        self.assertEqual(self.service.product_tree.get_product_node('Bandana').quantity, 3)
+        self.assertFalse(self.service.handle({'op': 'search', 'query': 5})['ok'])
+        with patch.object(self.service.product_tree, 'get_departments', side_effect=AttributeError('boom')):
+            self.assertFalse(self.service.handle({'op': 'departments'})['ok'])
+
+    def test_pipelined_requests_over_one_connection(self):
+        async def exchange():
+            started = asyncio.get_running_loop().create_future()
+            server = asyncio.ensure_future(self.service.serve('127.0.0.1', 0, started))
+            port = await started
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'{"op": "add", "session": "a", "product": "Bandana"}\n'
+                         b'not json\n'
+                         b'{"op": "cart", "session": "a"}\n')
+            responses = [json.loads(await reader.readline()) for _ in range(3)]
+            writer.close()
+            server.cancel()
+            return responses
+
+        added, invalid, cart = asyncio.run(exchange())
+        self.assertTrue(added['added'])
+        self.assertFalse(invalid['ok'])
+        self.assertEqual(cart['items'], ['Bandana'])
+
+
+class TestCheckoutPipeline(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_path = os.path.join(directory.name, 'orders.log')
+        self.tree = self.load_tree()
+        self.order_log = OrderLog(self.log_path)
+        self.addCleanup(self.order_log.close)
+        self.pipeline = CheckoutPipeline(self.tree, self.order_log)
+        self.cart = shopping.engine.structures.ShoppingCart(self.tree)
+
+    @staticmethod
+    def load_tree():
+        tree = shopping.engine.structures.ProductTree()
+        tree.add_product('Clothing', 'Accessories', 'Bandana', 10.00, 5)
+        tree.add_product('Clothing', 'Accessories', 'Belt', 15.00, 1)
+        return tree
+
+    def test_checkout_records_order(self):
+        self.pipeline.engine.add_to_cart(self.cart, 'Bandana', 2)
+        self.pipeline.engine.add_to_cart(self.cart, 'Belt')
+        self.assertEqual(self.pipeline.checkout(self.cart), 1)
+        orders = list(shopping.orders.read_orders(self.log_path))
+        self.assertEqual(orders[0]['lines'], [['Bandana', 2], ['Belt', 1]])
+        self.assertEqual(orders[0]['total_price'], '35.0')
+        self.assertTrue(self.cart.is_empty())
+
+    def test_empty_cart_is_not_an_order(self):
+        self.assertIsNone(self.pipeline.checkout(self.cart))
+        self.assertEqual(list(shopping.orders.read_orders(self.log_path)), [])
+
+    def test_replay_restores_stock(self):
+        self.pipeline.engine.add_to_cart(self.cart, 'Bandana', 2)
+        self.pipeline.checkout(self.cart)
+        self.pipeline.engine.add_to_cart(self.cart, 'Bandana')
+        self.pipeline.checkout(self.cart)
+        self.order_log.close()
+
+        tree = self.load_tree()
+        self.assertEqual(shopping.orders.replay_orders(tree, self.log_path), 2)
+        self.assertEqual(tree.get_product_node('Bandana').quantity, 2)
+        self.assertEqual(OrderLog(self.log_path).next_order_id, 3)
+
+    def test_replay_skips_torn_last_line(self):
+        self.pipeline.engine.add_to_cart(self.cart, 'Belt')
+        self.pipeline.checkout(self.cart)
+        self.order_log.close()
+        with open(self.log_path, 'ab') as file:
+            file.write(b'{"id": 2, "lines": [["Band')
+        tree = self.load_tree()
+        self.assertEqual(shopping.orders.replay_orders(tree, self.log_path), 1)
+        self.assertEqual(tree.get_product_node('Belt').quantity, 0)
+
+    def test_order_after_torn_line_survives(self):
+        self.pipeline.engine.add_to_cart(self.cart, 'Belt')
+        self.pipeline.checkout(self.cart)
+        self.order_log.close()
+        with open(self.log_path, 'ab') as file:
+            file.write(b'{"id": 2, "lines": [["Band')
+        order_log = OrderLog(self.log_path)
+        self.assertEqual(order_log.append([['Bandana', 1]], Decimal('10')), 2)
+        order_log.close()
+        orders = list(shopping.orders.read_orders(self.log_path))
+        self.assertEqual([order['lines'] for order in orders], [[['Belt', 1]], [['Bandana', 1]]])
+
+    def test_replay_skips_orders_the_export_includes(self):
+        old_export, new_export = {"size": 1, "sha1": "aa"}, {"size": 2, "sha1": "bb"}
+        self.pipeline.engine.add_to_cart(self.cart, 'Bandana')
+        self.pipeline.checkout(self.cart)
+        self.order_log.close()
+        for source, quantity in ((old_export, 1), (new_export, 2)):
+            order_log = OrderLog(self.log_path, source)
+            order_log.append([['Bandana', quantity]], Decimal('10') * quantity)
+            order_log.close()
+
+        tree = self.load_tree()
+        self.assertEqual(shopping.orders.replay_orders(tree, self.log_path, new_export), 1)
+        self.assertEqual(tree.get_product_node('Bandana').quantity, 3)
+        # Orders logged before the first checkpoint were made against that export
+        self.assertEqual(shopping.orders.replay_orders(self.load_tree(), self.log_path, old_export), 3)
+        self.assertEqual(shopping.orders.replay_orders(self.load_tree(), self.log_path, {"size": 3}), 0)
+        order_log = OrderLog(self.log_path, new_export)
+        order_log.close()
+        self.assertEqual(order_log.next_order_id, 4)
+        self.assertEqual(sum(1 for _ in shopping.orders.read_records(self.log_path)), 5)
+
+    def test_failed_write_keeps_cart(self):
+        self.pipeline.engine.add_to_cart(self.cart, 'Bandana', 2)
+        self.order_log.close()
+        with self.assertRaises(ValueError):
+            self.pipeline.checkout(self.cart)
+        self.assertEqual(self.cart.get_cart_items(), ['Bandana', 'Bandana'])
+        self.assertEqual(self.tree.get_product_node('Bandana').quantity, 3)
+        self.pipeline.engine.set_quantity(self.cart, 'Bandana', 0)
+        self.assertEqual(self.tree.get_product_node('Bandana').quantity, 5)
+
+    def test_log_refuses_orders_after_a_write_error(self):
+        self.order_log.file.close()
+        self.order_log.file = MagicMock()
+        self.order_log.file.write.side_effect = OSError("disk full")
+        self.pipeline.engine.add_to_cart(self.cart, 'Belt')
+        with self.assertRaises(OSError):
+            self.pipeline.checkout(self.cart)
+        with self.assertRaises(OSError):
+            self.order_log.append([['Bandana', 1]], Decimal('10'))
+        self.assertEqual(self.cart.get_cart_items(), ['Belt'])
+
+    def test_concurrent_orders_share_fsyncs(self):
+        def shop():
+            cart = shopping.engine.structures.ShoppingCart(self.tree)
+            self.pipeline.engine.add_to_cart(cart, 'Bandana')
+            self.pipeline.checkout(cart)
+
+        threads = [threading.Thread(target=shop) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        orders = list(shopping.orders.read_orders(self.log_path))
+        self.assertEqual(sorted(order['id'] for order in orders), [1, 2, 3, 4, 5])
+        self.assertLessEqual(self.order_log.batches, 5)
+
+
+class TestCartStore(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'carts.db')
+        self.store = shopping.carts.CartStore(self.path)
+        self.addCleanup(self.store.close)
+        self.tree = shopping.engine.structures.ProductTree()
+        self.tree.add_product('Clothing', 'Accessories', 'Bandana', 10.00, 5)
+        self.tree.add_product('Clothing', 'Accessories', 'Belt', 15.00, 1)
+        self.cart = shopping.engine.structures.ShoppingCart(self.tree)
+
+    def test_encoding_round_trip(self):
+        lines = [(1, 2), (70000, 1), (2 ** 32 - 1, 3)]
+        self.assertEqual(shopping.carts.decode_lines(shopping.carts.encode_lines(lines)), lines)
+        self.assertEqual(len(shopping.carts.encode_lines(lines)), 24)
+
+    def test_save_and_load(self):
+        self.cart.add_many([('Belt', 1), ('Bandana', 2)])
+        self.store.save('alice', self.cart)
+        self.store.close()
+        self.store = shopping.carts.CartStore(self.path)
+        restored = shopping.engine.structures.ShoppingCart(self.tree)
+        self.assertTrue(self.store.load('alice', restored))
+        self.assertEqual(restored.get_cart_items(), ['Belt', 'Bandana', 'Bandana'])
+        self.assertEqual((restored.total_price, restored.total_quantity), (Decimal('35.0'), 3))
+        self.assertFalse(self.store.load('bob', restored))
+
+    def test_load_lines_notifies_once(self):
+        changes = []
+        self.cart.subscribe(changes.append)
+        self.assertEqual(self.cart.load_lines([('Bandana', 2), ('Belt', 0), ('Belt', 1)]), 3)
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(self.cart.get_cart_items(), ['Bandana', 'Bandana', 'Belt'])
+        self.cart.remove_from_cart('Bandana')
+        self.assertEqual(self.cart.get_cart_items(), ['Bandana', 'Belt'])
+
+    def test_save_many_and_load_all(self):
+        other = shopping.engine.structures.ShoppingCart(self.tree)
+        other.add_to_cart('Belt')
+        self.cart.add_to_cart('Bandana')
+        self.store.save_many({'a': self.cart, 'b': other})
+        self.assertEqual(self.store.sessions(), ['a', 'b'])
+        carts = self.store.load_all(self.tree)
+        self.assertEqual(carts['b'].get_cart_items(), ['Belt'])
+        self.store.save('a', shopping.engine.structures.ShoppingCart(self.tree))
+        self.store.delete('b')
+        self.assertEqual(self.store.sessions(), [])
+
+    def test_restore_holds_available_stock(self):
+        engine = InventoryEngine(self.tree)
+        missing = engine.restore(self.cart, [('Bandana', 2), ('Belt', 2), ('Hat', 1)])
+        self.assertEqual(missing, [('Belt', 2), ('Hat', 1)])
+        self.assertEqual(self.cart.get_cart_items(), ['Bandana', 'Bandana'])
+        self.assertEqual(engine.held_quantity(self.cart, 'Bandana'), 2)
+        self.assertEqual(self.tree.get_product_node('Bandana').quantity, 3)
+
+    def test_service_restores_sessions(self):
+        service = CartService(self.tree, cart_store=self.store)
+        service.handle({'op': 'add', 'session': 'a', 'product': 'Bandana', 'quantity': 2})
+        service.handle({'op': 'add', 'session': 'b', 'product': 'Belt'})
+        self.assertEqual(service.save_sessions(), 2)
+        service.handle({'op': 'close', 'session': 'b'})
+        self.assertEqual(service.save_sessions(), 1)
+        self.assertEqual(service.save_sessions(), 0)
+
+        tree = shopping.engine.structures.ProductTree()
+        tree.add_product('Clothing', 'Accessories', 'Bandana', 10.00, 5)
+        restored = CartService(tree, cart_store=self.store)
+        self.assertEqual(restored.handle({'op': 'cart', 'session': 'a'})['items'], ['Bandana', 'Bandana'])
+        self.assertEqual(tree.get_product_node('Bandana').quantity, 3)
+        self.assertNotIn('b', restored.sessions)
+
+
+class TestPricing(unittest.TestCase):
+    def setUp(self):
+        self.tree = shopping.engine.structures.ProductTree()
+        self.tree.add_product('Clothing', 'Accessories', 'Bandana', 10.00, 100)
+        self.tree.add_product('Clothing', 'Accessories', 'Belt', 15.00, 100)
+        self.tree.add_product('Clothing', 'Tops', 'T-Shirt', 8.00, 100)
+        self.tree.add_product('Home', 'Kitchen', 'Kettle', 25.50, 100)
+        self.cart = shopping.engine.structures.ShoppingCart(self.tree)
+        self.engine = shopping.engine.pricing.PricingEngine(self.tree)
+        self.pricing = shopping.engine.pricing.CartPricing(self.engine, self.cart)
+
+    def test_no_rules_charges_cart_total(self):
+        self.cart.add_many([('Bandana', 2), ('Kettle', 1)])
+        self.assertEqual(self.pricing.refresh(), Decimal('45.5'))
+        self.assertEqual(self.pricing.discount, 0)
+
+    def test_best_percent_off_applies(self):
+        pricing = shopping.engine.pricing
+        self.engine.add_rules([pricing.PercentOff(10, department='Clothing'),
+                               pricing.PercentOff(25, department='Clothing', category='Accessories')])
+        self.cart.add_many([('Bandana', 1), ('T-Shirt', 1), ('Kettle', 1)])
+        self.assertEqual(self.pricing.refresh(), Decimal('7.50') + Decimal('7.20') + Decimal('25.5'))
+
+    def test_buy_get_free(self):
+        self.engine.add_rules([shopping.engine.pricing.BuyGetFree(2, 1, product='Belt')])
+        self.cart.add_many([('Belt', 5)])
+        self.assertEqual(self.pricing.refresh(), Decimal('60.00'))
+        self.cart.add_to_cart('Belt')
+        self.assertEqual(self.pricing.refresh(), Decimal('60.00'))
+
+    def test_tiers_and_tax(self):
+        self.engine.add_rules([shopping.engine.pricing.TieredDiscount([(10, 5), (3, 2)], department='Home')])
+        self.engine.tax_rate = Decimal('0.08')
+        self.cart.add_many([('Kettle', 2)])
+        self.assertEqual(self.pricing.refresh(), Decimal('55.08'))
+        self.cart.add_many([('Kettle', 1)])
+        self.pricing.refresh()
+        self.assertEqual((self.pricing.discount, self.pricing.tax), (Decimal('1.53'), Decimal('6.00')))
+        self.cart.add_many([('Kettle', 7)])
+        self.pricing.refresh()
+        self.assertEqual(self.pricing.discount, Decimal('12.75'))
+
+    def test_only_changed_lines_are_priced(self):
+        self.engine.add_rules([shopping.engine.pricing.PercentOff(10)])
+        self.cart.add_many([('Bandana', 1), ('Belt', 1), ('Kettle', 1)])
+        self.pricing.refresh()
+        with patch.object(self.engine, 'line_discount', wraps=self.engine.line_discount) as line_discount:
+            self.cart.add_to_cart('Belt')
+            self.pricing.refresh()
+            line_discount.assert_called_once_with('Belt', 2, Decimal('30.0'))
+            self.cart.clear_cart()
+            self.assertEqual(self.pricing.refresh(), 0)
+        self.assertEqual(self.pricing.lines, {})
+
+    def test_new_rules_reprice_everything(self):
+        self.cart.add_many([('Bandana', 3)])
+        self.pricing.refresh()
+        self.engine.add_rules([shopping.engine.pricing.BuyGetFree(2, 1, category='Accessories',
+                                                                  department='Clothing')])
+        self.assertEqual(self.pricing.refresh(), Decimal('20.00'))
+        self.engine.clear_rules()
+        self.assertEqual(self.pricing.refresh(), Decimal('30.0'))
+
+    def test_rules_follow_product_moves(self):
+        self.engine.add_rules([shopping.engine.pricing.PercentOff(50, department='Home')])
+        self.cart.add_to_cart('Bandana')
+        self.assertEqual(self.pricing.refresh(), Decimal('10.0'))
+        self.tree.delete_product('Clothing', 'Accessories', 'Bandana')
+        self.tree.add_product('Home', 'Laundry', 'Bandana', 10.00, 100)
+        self.cart.add_to_cart('Bandana')
+        self.assertEqual(self.pricing.refresh(), Decimal('10.00'))
+
+    def test_read_promotions(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'promotions.json')
+        self.assertEqual(shopping.store_products.read_promotions(path), ([], 0))
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({"tax_rate": "0.05", "rules": [{"type": "buy_get_free", "buy": 1, "free": 1, "product": "Belt"},
+                                                     {"type": "tiered", "tiers": [[2, 10]], "department": "Home"}]},
+                      file)
+        rules, tax_rate = shopping.store_products.read_promotions(path)
+        self.assertEqual([rule.scope for rule in rules], [('product', 'Belt'), ('department', 'Home')])
+        self.assertEqual(tax_rate, Decimal('0.05'))
+        with self.assertRaises(ValueError):
+            shopping.engine.pricing.rule_from_dict({"type": "percent_off", "percent": 120})
+        with self.assertRaises(ValueError):
+            shopping.engine.pricing.rule_from_dict({"type": "coupon"})
+        with self.assertRaises(ValueError):
+            shopping.engine.pricing.rule_from_dict({"type": "buy_get_free", "buy": 2})
+
+    def test_checkout_records_priced_total(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        order_log = OrderLog(os.path.join(directory.name, 'orders.log'))
+        self.addCleanup(order_log.close)
+        self.engine.add_rules([shopping.engine.pricing.PercentOff(20, product='Kettle')])
+        pipeline = CheckoutPipeline(self.tree, order_log, pricing_engine=self.engine)
+        pipeline.engine.add_to_cart(self.cart, 'Kettle', 2)
+        pipeline.checkout(self.cart)
+        order_log.close()
+        orders = list(shopping.orders.read_orders(order_log.path))
+        self.assertEqual(orders[0]['total_price'], '40.80')
+
+
+class TestCatalogQueries(unittest.TestCase):
+    def setUp(self):
+        self.tree = shopping.engine.structures.ProductTree()
+        self.tree.add_products([
+            ('Clothing', 'Accessories', 'Ankle Socks', 3.99, 95),
+            ('Clothing', 'Accessories', 'Bandana', 10.00, 10),
+            ('Clothing', 'Shoes', 'Boots', 60.00, 2),
+            ('Electronics', 'Laptops', 'MacBook', 1200.00, 3),
+            ('Electronics', 'Laptops', 'Zenbook', 999.99, 0),
+        ])
+
+    def test_products_in_price_range(self):
+        self.assertEqual(self.tree.products_in_price_range(10, 999.99), ['Bandana', 'Boots', 'Zenbook'])
+
+    def test_products_in_empty_price_range(self):
+        self.assertEqual(self.tree.products_in_price_range(20, 50), [])
+
+    def test_low_stock(self):
+        self.assertEqual(self.tree.low_stock(5), [('Zenbook', 0), ('Boots', 2), ('MacBook', 3)])
+
+    def test_top_by_value(self):
+        self.assertEqual(self.tree.top_by_value(2), [('MacBook', 3600.0), ('Ankle Socks', 379.05)])
+
+    def test_department_report(self):
+        report = self.tree.value_report()
+        self.assertEqual(report['Electronics'], {'sum': 3600.0, 'count': 2, 'mean': 1800.0})
+        self.assertAlmostEqual(report['Clothing']['sum'], 599.05)
+
+    def test_category_report(self):
+        report = self.tree.value_report('category')
+        self.assertEqual(report[('Clothing', 'Shoes')], {'sum': 120.0, 'count': 1, 'mean': 120.0})
+        self.assertEqual(len(report), 3)
+
+    def test_unknown_report_level(self):
+        with self.assertRaises(ValueError):
+            self.tree.value_report('aisle')
+
+    def test_queries_see_changes(self):
+        self.assertEqual(self.tree.low_stock(1), [('Zenbook', 0)])
+        self.tree.add_product('Electronics', 'Laptops', 'Zenbook', 999.99, 8)
+        self.assertEqual(self.tree.low_stock(1), [])
+
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        self.tree = shopping.engine.structures.ProductTree()
+        self.tree.add_products([
+            ('Clothing', 'Accessories', 'Ankle Socks', 3.99, 95),
+            ('Clothing', 'Accessories', 'Socks', 5.00, 40),
+            ('Clothing', 'Accessories', 'Bandana', 10.00, 10),
+            ('Grocery', 'Drinks', 'Soda', 1.50, 200),
+            ('Electronics', 'Phones', 'Smartphone', 699.00, 5),
+        ])
+
+    def test_prefix_matches_any_word(self):
+        self.assertEqual(self.tree.search('sock'), ['Ankle Socks', 'Socks'])
+
+    def test_prefix_is_case_insensitive(self):
+        self.assertEqual(self.tree.search('  ANKLE  s'), ['Ankle Socks'])
+
+    def test_search_limit(self):
+        self.assertEqual(len(self.tree.search('s', limit=2)), 2)
+
+    def test_fuzzy_match_for_typos(self):
+        self.assertEqual(self.tree.search('bandanna'), ['Bandana'])
+        self.assertEqual(self.tree.search('smart phon')[0], 'Smartphone')
+
+    def test_no_match(self):
+        self.assertEqual(self.tree.search('xylophone'), [])
+        self.assertEqual(self.tree.search('   '), [])
+
+    def test_search_sees_new_and_deleted_products(self):
+        self.assertEqual(self.tree.search('sod'), ['Soda'])
+        self.tree.add_product('Grocery', 'Drinks', 'Soda Water', 1.00, 50)
+        self.tree.delete_product('Grocery', 'Drinks', 'Soda')
+        self.assertEqual(self.tree.search('sod'), ['Soda Water'])
+
 
 class TestShoppingCart(unittest.TestCase):
     def setUp(self):
@@ -80,30 +911,634 @@ class TestShoppingCart(unittest.TestCase):
         self.cart.add_to_cart("Item 3")
         self.assertEqual(self.cart.get_cart_items(), ["Item 1", "Item 2", "Item 3"])
 
+    def test_remove_from_cart_removes_first_occurrence(self):
+        for item in ["Item 1", "Item 2", "Item 1", "Item 3"]:
+            self.cart.add_to_cart(item)
+        self.cart.remove_from_cart("Item 1")
+        self.assertEqual(self.cart.get_cart_items(), ["Item 2", "Item 1", "Item 3"])
+
+    def test_remove_last_item_moves_tail(self):
+        self.cart.add_to_cart("Item 1")
+        self.cart.add_to_cart("Item 2")
+        self.cart.remove_from_cart("Item 2")
+        self.cart.add_to_cart("Item 3")
+        self.assertEqual(self.cart.get_cart_items(), ["Item 1", "Item 3"])
+        self.assertEqual(self.cart.last_item.prev.product, "Item 1")
+
+    def test_remove_only_item_empties_cart(self):
+        self.cart.add_to_cart("Item 1")
+        self.assertTrue(self.cart.remove_from_cart("Item 1"))
+        self.assertTrue(self.cart.is_empty())
+        self.assertIsNone(self.cart.last_item)
+
+    def test_membership_and_quantity(self):
+        self.cart.add_to_cart("Item 1")
+        self.cart.add_to_cart("Item 1")
+        self.assertIn("Item 1", self.cart)
+        self.assertNotIn("Item 2", self.cart)
+        self.assertEqual(self.cart.get_quantity("Item 1"), 2)
+        self.cart.remove_from_cart("Item 1")
+        self.cart.remove_from_cart("Item 1")
+        self.assertNotIn("Item 1", self.cart)
+        self.assertEqual(self.cart.get_quantity("Item 1"), 0)
+
+
+    def test_units_share_items(self):
+        self.cart.set_quantity("Item 1", 10 ** 6)
+        self.cart.add_to_cart("Item 2")
+        self.cart.add_to_cart("Item 1")
+        self.assertEqual(len(self.cart.lines["Item 1"].items), 2)
+        self.cart.set_quantity("Item 1", 3)
+        self.assertEqual(self.cart.get_cart_items(), ["Item 1", "Item 1", "Item 2", "Item 1"])
+        self.assertEqual(self.cart.recompute_totals(), (self.cart.total_price, 4))
+
+class TestCartBatches(unittest.TestCase):
+    def setUp(self):
+        self.cart = shopping.engine.structures.ShoppingCart()
+        self.notifications = []
+        self.cart.subscribe(self.notifications.append)
+
+    def test_each_change_notifies(self):
+        self.cart.add_to_cart('Kettle')
+        self.cart.remove_from_cart('Kettle')
+        self.assertEqual(len(self.notifications), 2)
+
+    def test_add_many_notifies_once(self):
+        self.assertEqual(self.cart.add_many([('Kettle', 2), ('Towel', 3)]), 5)
+        self.assertEqual(self.cart.get_cart_items(), ['Kettle', 'Kettle', 'Towel', 'Towel', 'Towel'])
+        self.assertEqual(self.notifications, [self.cart])
+
+    def test_remove_many(self):
+        self.cart.add_many([('Kettle', 2), ('Towel', 3)])
+        self.assertEqual(self.cart.remove_many([('Towel', 2), ('Kettle', 5), ('Mug', 1)]), 4)
+        self.assertEqual(self.cart.get_cart_items(), ['Towel'])
+        self.assertEqual(len(self.notifications), 2)
+
+    def test_set_quantity(self):
+        self.assertEqual(self.cart.set_quantity('Kettle', 3), 3)
+        self.assertEqual(self.cart.set_quantity('Kettle', 1), -2)
+        self.assertEqual(self.cart.set_quantity('Kettle', 1), 0)
+        self.assertEqual(self.cart.get_quantity('Kettle'), 1)
+        self.assertEqual(len(self.notifications), 2)
+
+    def test_bad_quantities_are_rejected(self):
+        self.cart.add_many([('Kettle', 2)])
+        with self.assertRaises(ValueError):
+            self.cart.add_many([('Towel', 1), ('Mug', 1.5)])
+        with self.assertRaises(ValueError):
+            self.cart.remove_many([('Kettle', 1), ('Kettle', -1)])
+        with self.assertRaises(ValueError):
+            self.cart.set_quantity('Kettle', -3)
+        self.assertEqual(self.cart.get_cart_items(), ['Kettle', 'Kettle'])
+        self.assertEqual(self.cart.set_quantity('Kettle', 0), -2)
+
+    def test_nested_batches_notify_once(self):
+        with self.cart.batch():
+            self.cart.add_to_cart('Kettle')
+            with self.cart.batch():
+                self.cart.add_many([('Towel', 2)])
+            self.assertEqual(self.notifications, [])
+            self.cart.clear_cart()
+        self.assertEqual(len(self.notifications), 1)
+
+    def test_empty_batch_does_not_notify(self):
+        with self.cart.batch():
+            pass
+        self.assertEqual(self.notifications, [])
+
+    def test_totals_checked_at_end_of_batch(self):
+        cart = shopping.engine.structures.ShoppingCart(check_totals=True)
+        with patch.object(cart, 'verify_totals') as verify_totals:
+            cart.add_many([('Kettle', 50)])
+        verify_totals.assert_called_once()
+
+
+class TestShoppingCartTotals(unittest.TestCase):
+    def setUp(self):
+        tree = shopping.engine.structures.ProductTree()
+        tree.add_product('Clothing', 'Accessories', 'Ankle Socks', 3.99, 95)
+        tree.add_product('Clothing', 'Accessories', 'Bandana', 10.00, 10)
+        tree.add_product('Electronics', 'Laptops', 'MacBook', 1200.10, 3)
+        self.cart = shopping.engine.structures.ShoppingCart(tree, check_totals=True)
+
+    def test_empty_cart_totals(self):
+        self.assertEqual((self.cart.total_price, self.cart.total_quantity), (Decimal('0'), 0))
+
+    def test_add_to_cart_updates_totals(self):
+        for item in ['Ankle Socks', 'Ankle Socks', 'Ankle Socks', 'MacBook']:
+            self.cart.add_to_cart(item)
+        self.assertEqual(self.cart.total_price, Decimal('1212.07'))
+        self.assertEqual(self.cart.total_quantity, 4)
+
+    def test_remove_from_cart_updates_totals(self):
+        self.cart.add_to_cart('Bandana')
+        self.cart.add_to_cart('MacBook')
+        self.cart.remove_from_cart('Bandana')
+        self.assertEqual((self.cart.total_price, self.cart.total_quantity), (Decimal('1200.1'), 1))
+
+    def test_remove_missing_item_keeps_totals(self):
+        self.cart.add_to_cart('Bandana')
+        self.assertFalse(self.cart.remove_from_cart('MacBook'))
+        self.assertEqual((self.cart.total_price, self.cart.total_quantity), (Decimal('10.0'), 1))
+
+    def test_clear_cart_resets_totals(self):
+        self.cart.add_to_cart('Bandana')
+        self.cart.clear_cart()
+        self.assertEqual((self.cart.total_price, self.cart.total_quantity), (Decimal('0'), 0))
+
+    def test_unknown_product_is_free(self):
+        self.cart.add_to_cart('Mystery Box')
+        self.assertEqual((self.cart.total_price, self.cart.total_quantity), (Decimal('0'), 1))
+
+    def test_verify_totals_detects_drift(self):
+        self.cart.add_to_cart('Bandana')
+        self.cart.total_price += 1
+        with self.assertRaises(RuntimeError):
+            self.cart.verify_totals()
+
+
+class TestStoreProducts(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_file_path = os.path.join(directory.name, 'catalog.csv')
+        with open(self.csv_file_path, 'w', encoding='utf-8-sig', newline='') as file:
+            file.write('Department,Category,Product,Price,Quantity\n'
+                       'Clothing,Accessories,Ankle Socks,3.99,95\n'
+                       'Clothing,Accessories,Bandana,10.00,10\n'
+                       'Electronics,Laptops,MacBook,"1,200.00",3\n'
+                       'Home,Kitchen,Kettle,25.50,7\n')
+
+    def test_csv_to_products_loads_store_database(self):
+        tree = shopping.store_products.csv_to_products()
+        self.assertEqual(tree.get_departments(), ('Clothing', 'Electronics', 'Grocery', 'Home'))
+        self.assertEqual(len(tree.product_index), 271)
+
+    def test_csv_to_products_parses_rows(self):
+        tree = shopping.store_products.csv_to_products(self.csv_file_path)
+        self.assertEqual(tree.get_products('Electronics', 'Laptops'), {'MacBook': {'price': 1200.0, 'quantity': 3}})
+
+    def test_iter_catalog_batches_chunks_rows(self):
+        batches = list(shopping.store_products.iter_catalog_batches(self.csv_file_path, chunk_size=3))
+        self.assertEqual([len(batch) for batch in batches], [3, 1])
+        self.assertEqual(batches[0][0], ('Clothing', 'Accessories', 'Ankle Socks', 3.99, 95))
+
+    def test_csv_to_products_reports_progress(self):
+        progress = []
+        shopping.store_products.csv_to_products(self.csv_file_path, chunk_size=2, progress=progress.append)
+        self.assertEqual(progress, [2, 4])
+
+    def test_csv_to_products_selected_departments(self):
+        tree = shopping.store_products.csv_to_products(self.csv_file_path, departments=['Clothing', 'Home'])
+        self.assertEqual(tree.get_departments(), ('Clothing', 'Home'))
+        self.assertIsNone(tree.locate('MacBook'))
+
+    def test_split_catalog_on_line_boundaries(self):
+        columns, start = shopping.store_products.read_catalog_header(self.csv_file_path)
+        ranges = shopping.store_products.split_catalog(self.csv_file_path, start, 3)
+        with open(self.csv_file_path, 'rb') as file:
+            data = file.read()
+        self.assertEqual(ranges[0][0], start)
+        self.assertEqual(ranges[-1][1], len(data))
+        for (_, end), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+            self.assertEqual(data[end - 1:end], b'\n')
+
+    def test_parallel_load_matches_single_process(self):
+        single = shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=False)
+        parallel = shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=False, workers=2)
+        self.assertEqual(parallel.print_tree(), single.print_tree())
+
+    def test_parallel_load_selected_departments(self):
+        tree = shopping.store_products.csv_to_products(self.csv_file_path, departments=['Home'], workers=2)
+        self.assertEqual(list(tree.product_index), ['Kettle'])
+
+    def test_add_products_matches_add_product(self):
+        rows = [('Home', 'Kitchen', 'Kettle', 25.5, 7), ('Home', 'Bath', 'Towel', 8.0, 30),
+                ('Home', 'Kitchen', 'Toaster', 30.0, 2), ('Home', 'Kitchen', 'Kettle', 20.0, 5)]
+        bulk = shopping.engine.structures.ProductTree()
+        self.assertEqual(bulk.add_products(rows), 4)
+        single = shopping.engine.structures.ProductTree()
+        for row in rows:
+            single.add_product(*row)
+        self.assertEqual(bulk.print_tree(), single.print_tree())
+        self.assertEqual(bulk.locate('Toaster')[:2], ('Home', 'Kitchen'))
+
+
+class TestSQLiteProductTree(unittest.TestCase):
+    ROWS = [('Clothing', 'Accessories', 'Bandana', 10.0, 3), ('Home', 'Kitchen', 'Kettle', 25.5, 1),
+            ('Clothing', 'Tops', 'T-Shirt', 8.0, 0), ('Clothing', 'Accessories', 'Belt', 15.0, 2),
+            ('Clothing', 'Accessories', 'Bandana', 9.0, 4)]
+
+    def setUp(self):
+        self.sqlite_tree = shopping.engine.sqlite_tree.SQLiteProductTree(hot_cache_size=2)
+        self.addCleanup(self.sqlite_tree.close)
+        self.tree = shopping.engine.structures.ProductTree()
+        for tree in (self.sqlite_tree, self.tree):
+            tree.add_products(self.ROWS)
+
+    def assert_same_catalog(self):
+        self.assertEqual(self.sqlite_tree.get_departments(), self.tree.get_departments())
+        for department in self.tree.get_departments():
+            self.assertEqual(self.sqlite_tree.get_categories(department), self.tree.get_categories(department))
+            for category in self.tree.get_categories(department):
+                self.assertEqual(self.sqlite_tree.get_products(department, category),
+                                 self.tree.get_products(department, category))
+
+    def test_matches_product_tree(self):
+        self.assert_same_catalog()
+        self.assertEqual(self.sqlite_tree.get_categories('Garden'), ())
+        self.assertEqual(self.sqlite_tree.get_products('Home', 'Garden'), {})
+
+    def test_add_and_remove_product(self):
+        for tree in (self.sqlite_tree, self.tree):
+            tree.add_product('Home', 'Bath', 'Towel', 5.0, 1)
+            self.assertTrue(tree.remove_product('Home', 'Bath', 'Towel'))
+            self.assertFalse(tree.remove_product('Home', 'Bath', 'Towel'))
+            self.assertFalse(tree.remove_product('Home', 'Bath', 'Robe'))
+            self.assertTrue(tree.delete_product('Home', 'Kitchen', 'Kettle'))
+            self.assertFalse(tree.delete_product('Home', 'Kitchen', 'Kettle'))
+        self.assert_same_catalog()
+
+    def test_hot_cache_follows_changes(self):
+        self.assertEqual(self.sqlite_tree.get_product_node('Bandana').quantity, 4)
+        self.assertEqual(self.sqlite_tree.get_product_node('Bandana').quantity, 4)
+        self.assertTrue(self.sqlite_tree.reserve('Bandana', 4))
+        self.assertFalse(self.sqlite_tree.reserve('Bandana'))
+        self.assertEqual(self.sqlite_tree.get_product_node('Bandana').quantity, 0)
+        self.assertTrue(self.sqlite_tree.release('Bandana', 2))
+        self.assertEqual(self.sqlite_tree.get_product_node('Bandana').quantity, 2)
+        self.assertIsNone(self.sqlite_tree.get_product_node('Robe'))
+        self.sqlite_tree.get_product_node('Belt')
+        self.sqlite_tree.get_product_node('Kettle')
+        stats = self.sqlite_tree.cache_stats()
+        self.assertEqual((stats['hits'], stats['size']), (1, 2))
+
+    def test_failed_batch_leaves_catalog_unchanged(self):
+        with self.assertRaises(ValueError):
+            self.sqlite_tree.add_products([('Garden', 'Tools', 'Rake', 12.0, 1), ('Garden', 'Tools', 'Hoe')])
+        self.assertEqual(self.sqlite_tree.get_departments(), ('Clothing', 'Home'))
+
+    def test_cart_prices_from_sqlite_tree(self):
+        cart = shopping.engine.structures.ShoppingCart(self.sqlite_tree)
+        cart.add_many([('Bandana', 2), ('Kettle', 1)])
+        self.assertEqual(cart.total_price, Decimal('43.5'))
+
+    def test_csv_to_sqlite_reuses_current_database(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        csv_file_path = os.path.join(directory.name, 'catalog.csv')
+        with open(csv_file_path, 'w', encoding='utf-8-sig', newline='') as file:
+            file.write('Department,Category,Product,Price,Quantity\n'
+                       'Clothing,Accessories,Bandana,10.00,10\n'
+                       'Electronics,Laptops,MacBook,"1,200.00",3\n')
+        progress = []
+        tree = shopping.store_products.csv_to_sqlite(csv_file_path, progress=progress.append)
+        self.assertEqual(tree.get_products('Electronics', 'Laptops'), {'MacBook': {'price': 1200.0, 'quantity': 3}})
+        tree.close()
+        self.assertEqual(progress, [2])
+
+        tree = shopping.store_products.csv_to_sqlite(csv_file_path, progress=progress.append)
+        self.assertEqual(progress, [2])
+        self.assertEqual(tree.get_departments(), ('Clothing', 'Electronics'))
+        tree.close()
+
+        with open(csv_file_path, 'a', encoding='utf-8') as file:
+            file.write('Home,Kitchen,Kettle,25.50,7\n')
+        tree = shopping.store_products.csv_to_sqlite(csv_file_path, departments=['Home'])
+        self.assertEqual(tree.get_departments(), ('Home',))
+        tree.close()
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_file_path = os.path.join(directory.name, 'catalog.csv')
+        self.snapshot_path = shopping.snapshot.snapshot_path(self.csv_file_path)
+        self.write_csv('Clothing,Accessories,Ankle Socks,3.99,95\n'
+                       'Electronics,Laptops,MacBook,"1,200.00",3\n'
+                       'Electronics,Laptops,Zenbook,999.99,0\n')
+
+    def write_csv(self, rows):
+        with open(self.csv_file_path, 'w', encoding='utf-8', newline='') as file:
+            file.write('Department,Category,Product,Price,Quantity\n' + rows)
+
+    def test_load_writes_snapshot(self):
+        shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=True)
+        self.assertTrue(os.path.exists(self.snapshot_path))
+
+    def test_snapshot_is_opt_in(self):
+        shopping.store_products.csv_to_products(self.csv_file_path)
+        self.assertFalse(os.path.exists(self.snapshot_path))
+
+    def test_snapshot_round_trip(self):
+        tree = shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=True)
+        loaded = shopping.snapshot.load_snapshot(self.snapshot_path, self.csv_file_path)
+        self.assertEqual(loaded.print_tree(), tree.print_tree())
+        self.assertEqual(loaded.locate('Zenbook')[:2], ('Electronics', 'Laptops'))
+
+    def test_snapshot_selected_departments(self):
+        shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=True)
+        loaded = shopping.snapshot.load_snapshot(self.snapshot_path, self.csv_file_path, departments=['Clothing'])
+        self.assertEqual(loaded.get_departments(), ('Clothing',))
+
+    def test_changed_csv_invalidates_snapshot(self):
+        shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=True)
+        self.write_csv('Home,Kitchen,Kettle,25.50,7\n')
+        self.assertIsNone(shopping.snapshot.load_snapshot(self.snapshot_path, self.csv_file_path))
+        tree = shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=True)
+        self.assertEqual(tree.get_departments(), ('Home',))
+
+    def test_csv_changed_during_load_invalidates_snapshot(self):
+        shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=True, progress=lambda loaded:
+                                                self.write_csv('Home,Kitchen,Kettle,25.50,7\n'))
+        self.assertIsNone(shopping.snapshot.load_snapshot(self.snapshot_path, self.csv_file_path))
+
+    def test_touched_csv_keeps_snapshot(self):
+        shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=True)
+        stat = os.stat(self.csv_file_path)
+        os.utime(self.csv_file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNotNone(shopping.snapshot.load_snapshot(self.snapshot_path, self.csv_file_path))
+
+    def test_corrupt_snapshot_is_ignored(self):
+        with open(self.snapshot_path, 'wb') as file:
+            file.write(b'not a snapshot')
+        self.assertIsNone(shopping.snapshot.load_snapshot(self.snapshot_path, self.csv_file_path))
+        tree = shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=True)
+        self.assertEqual(len(tree.product_index), 3)
+
+    def test_empty_catalog_snapshot(self):
+        self.write_csv('')
+        shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=True)
+        loaded = shopping.snapshot.load_snapshot(self.snapshot_path, self.csv_file_path)
+        self.assertEqual(loaded.get_departments(), ())
+
+
+class TestCatalogSync(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_file_path = os.path.join(directory.name, 'catalog.csv')
+        self.write_csv('Clothing,Accessories,Ankle Socks,3.99,95\n'
+                       'Clothing,Accessories,Bandana,10.00,10\n'
+                       'Home,Kitchen,Kettle,25.50,7\n')
+        self.tree = shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=False)
+        self.sync = shopping.store_products.CatalogSync(self.tree, self.csv_file_path)
+        self.sync.baseline()
+
+    def write_csv(self, rows):
+        with open(self.csv_file_path, 'w', encoding='utf-8', newline='') as file:
+            file.write('Department,Category,Product,Price,Quantity\n' + rows)
+
+    def append_csv(self, rows):
+        with open(self.csv_file_path, 'a', encoding='utf-8', newline='') as file:
+            file.write(rows)
+
+    def test_sync_applies_changes(self):
+        self.write_csv('Clothing,Accessories,Ankle Socks,4.49,95\n'
+                       'Home,Bath,Bandana,10.00,10\n'
+                       'Home,Kitchen,Toaster,30.00,2\n')
+        delta = self.sync.sync()
+        self.assertEqual(delta.price_updated, ['Ankle Socks'])
+        self.assertEqual(sorted(delta.inserted), ['Bandana', 'Toaster'])
+        self.assertEqual(sorted(delta.deleted), ['Bandana', 'Kettle'])
+        self.assertEqual(self.tree.locate('Bandana')[:2], ('Home', 'Bath'))
+        self.assertEqual(self.tree.get_product_node('Ankle Socks').price, 4.49)
+        self.assertIsNone(self.tree.locate('Kettle'))
+
+    def test_sync_matches_full_load(self):
+        self.write_csv('Home,Kitchen,Kettle,20.00,7\n'
+                       'Clothing,Accessories,Bandana,10.00,10\n'
+                       'Home,Kitchen,Kettle,22.00,4\n')
+        self.sync.sync()
+        loaded = shopping.store_products.csv_to_products(self.csv_file_path, use_snapshot=False)
+        self.assertEqual(sorted(self.tree.product_index), sorted(loaded.product_index))
+        for product in loaded.product_index:
+            department, category, p_node = self.tree.locate(product)
+            l_department, l_category, l_node = loaded.locate(product)
+            self.assertEqual((department, category, p_node.price, p_node.quantity),
+                             (l_department, l_category, l_node.price, l_node.quantity))
+
+    def test_unchanged_rows_keep_sales(self):
+        self.assertTrue(self.tree.reserve('Bandana', 4))
+        self.write_csv('Clothing,Accessories,Ankle Socks,3.99,90\n'
+                       'Clothing,Accessories,Bandana,10.00,10\n'
+                       'Home,Kitchen,Kettle,25.50,7\n')
+        delta = self.sync.sync()
+        self.assertEqual(delta.quantity_updated, ['Ankle Socks'])
+        self.assertEqual(self.tree.get_product_node('Bandana').quantity, 6)
+
+    def test_price_edit_keeps_held_stock(self):
+        engine = InventoryEngine(self.tree)
+        cart = shopping.engine.structures.ShoppingCart(self.tree)
+        engine.add_to_cart(cart, 'Bandana', 3)
+        self.write_csv('Clothing,Accessories,Ankle Socks,3.99,95\n'
+                       'Clothing,Accessories,Bandana,12.00,10\n'
+                       'Home,Kitchen,Kettle,25.50,7\n')
+        delta = self.sync.sync()
+        self.assertEqual(delta.price_updated, ['Bandana'])
+        self.assertEqual(delta.quantity_updated, [])
+        self.assertEqual(self.tree.get_product_node('Bandana').price, 12.0)
+        self.assertEqual(self.tree.get_product_node('Bandana').quantity, 7)
+        engine.set_quantity(cart, 'Bandana', 0)
+        self.assertEqual(self.tree.get_product_node('Bandana').quantity, 10)
+
+    def test_quantity_edit_is_applied_as_a_difference(self):
+        self.assertTrue(self.tree.reserve('Bandana', 3))
+        self.write_csv('Clothing,Accessories,Ankle Socks,3.99,95\n'
+                       'Clothing,Accessories,Bandana,10.00,15\n'
+                       'Home,Kitchen,Kettle,25.50,7\n')
+        self.assertEqual(self.sync.sync().quantity_updated, ['Bandana'])
+        self.assertEqual(self.tree.get_product_node('Bandana').quantity, 12)
+
+    def test_poll_unchanged_file(self):
+        self.assertIsNone(self.sync.poll())
+
+    def test_poll_reads_appended_rows(self):
+        self.append_csv('Home,Kitchen,Toaster,30.00,2\nClothing,Accessories,Bandana,12.00,10\n')
+        delta = self.sync.poll()
+        self.assertEqual(delta.inserted, ['Toaster'])
+        self.assertEqual(delta.price_updated, ['Bandana'])
+        self.assertIsNone(self.sync.poll())
+
+    def test_poll_waits_for_partial_line(self):
+        self.append_csv('Home,Kitchen,Toaster,30.0')
+        self.assertFalse(self.sync.poll())
+        self.assertIsNone(self.tree.locate('Toaster'))
+        self.append_csv('0,2\n')
+        self.assertEqual(self.sync.poll().inserted, ['Toaster'])
+        self.assertEqual(self.tree.get_product_node('Toaster').price, 30.0)
+
+    def test_poll_rewritten_file(self):
+        self.write_csv('Home,Kitchen,Kettle,25.50,7\n')
+        delta = self.sync.poll()
+        self.assertEqual(sorted(delta.deleted), ['Ankle Socks', 'Bandana'])
+        self.assertEqual(list(self.tree.product_index), ['Kettle'])
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.instrumentation = shopping.engine.instrumentation
+        self.registry = self.instrumentation.Registry()
+        enabled = self.instrumentation.enabled
+        self.addCleanup(setattr, self.instrumentation, 'enabled', enabled)
+        patcher = patch.object(self.instrumentation, 'registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disabled_decorator_returns_function(self):
+        self.instrumentation.disable()
+
+        def add(a, b):
+            return a + b
+        self.assertIs(self.instrumentation.instrumented('add')(add), add)
+        self.assertIs(self.instrumentation.timed('block'), self.instrumentation.NOT_TIMED)
+
+    def test_records_calls(self):
+        self.instrumentation.enable()
+
+        @self.instrumentation.instrumented('add')
+        def add(a, b):
+            return a + b
+        self.assertEqual(add(1, 2), 3)
+        self.assertEqual(add.__name__, 'add')
+        with self.instrumentation.timed('block'):
+            add(3, 4)
+        self.assertEqual(self.registry.operations['add'].count, 2)
+        self.assertEqual(sum(self.registry.operations['add'].buckets), 2)
+        self.assertEqual(self.registry.operations['block'].count, 1)
+
+    def test_records_failed_calls(self):
+        self.instrumentation.enable()
+
+        @self.instrumentation.instrumented('fail')
+        def fail():
+            raise ValueError
+        with self.assertRaises(ValueError):
+            fail()
+        self.assertEqual(self.registry.operations['fail'].count, 1)
+
+    def test_dumps(self):
+        self.registry.record('tree.add_product', 2e-6)
+        self.registry.record('tree.add_product', 2.0)
+        report = json.loads(self.registry.to_json())['tree.add_product']
+        self.assertEqual(report['count'], 2)
+        self.assertEqual(dict((str(bound), calls) for bound, calls in report['buckets'])['5e-06'], 1)
+        text = self.registry.to_prometheus()
+        self.assertIn('# TYPE shopping_operation_seconds histogram', text)
+        self.assertIn('shopping_operation_seconds_bucket{operation="tree.add_product",le="5e-06"} 1', text)
+        self.assertIn('shopping_operation_seconds_bucket{operation="tree.add_product",le="5.0"} 2', text)
+        self.assertIn('shopping_operation_seconds_count{operation="tree.add_product"} 2', text)
+
+
+class TestLazyImports(unittest.TestCase):
+    def imported_modules(self, statement):
+        result = subprocess.run([sys.executable, '-c', f'import sys; {statement}; print(" ".join(sys.modules))'],
+                                capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return set(result.stdout.split())
+
+    def test_headless_imports_skip_tk(self):
+        modules = self.imported_modules('import shopping.engine, shopping.store_products')
+        self.assertNotIn('tkinter', modules)
+        self.assertNotIn('shopping.gui', modules)
+        self.assertNotIn('concurrent.futures.process', modules)
+
+    def test_attribute_access_imports_module(self):
+        modules = self.imported_modules('import shopping; shopping.orders.read_orders')
+        self.assertIn('shopping.orders', modules)
+        self.assertNotIn('tkinter', modules)
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(AttributeError):
+            shopping.nothing
+
+
+class TestGUI(unittest.TestCase):
+    def setUp(self):
+        for name in ('tk', 'ttk', 'messagebox', 'csv_to_products', 'OrderLog', 'CartStore', 'CatalogSync',
+                     'replay_orders', 'read_promotions', 'catalog_checkpoint'):
+            patcher = patch.object(shopping.gui, name)
+            setattr(self, 'mock_' + name.lower(), patcher.start())
+            self.addCleanup(patcher.stop)
+        self.mock_read_promotions.return_value = ([], 0)
+        self.tree = shopping.engine.structures.ProductTree()
+        self.tree.add_product('Home', 'Kitchen', 'Kettle', 25.5, 2)
+        self.mock_csv_to_products.return_value = self.tree
+        self.mock_orderlog.return_value.append.return_value = 1
+        self.mock_cartstore.return_value.saved_lines.return_value = None
+        self.gui = GUI(MagicMock())
+
+    def test_gui_initialization(self):
+        self.assertIs(self.gui.product_tree, self.tree)
+        checkpoint = self.mock_catalog_checkpoint.return_value
+        self.mock_replay_orders.assert_called_with(self.tree, source=checkpoint)
+        self.mock_orderlog.assert_called_with(source=checkpoint)
+        self.gui.catalog_sync.baseline.assert_called()
+
+    def test_add_to_cart_updates_cart(self):
+        self.gui.add_to_cart('Kettle')
+        self.assertEqual(self.gui.shopping_cart.get_cart_items(), ['Kettle'])
+        self.gui.total_price_label.config.assert_any_call(text="Total Price: $25.50")
+
+    def test_add_sold_out_product(self):
+        self.gui.add_to_cart('Kettle')
+        self.gui.add_to_cart('Kettle')
+        self.gui.add_to_cart('Kettle')
+        self.assertEqual(self.gui.shopping_cart.get_quantity('Kettle'), 2)
+
+    def test_checkout_clears_cart(self):
+        self.gui.add_to_cart('Kettle')
+        self.gui.checkout()
+        self.assertTrue(self.gui.shopping_cart.is_empty())
+        self.gui.order_log.append.assert_called_with([['Kettle', 1]], Decimal('25.5'))
+        self.assertEqual(self.tree.get_product_node('Kettle').quantity, 1)
+
+    def test_checkout_empty_cart(self):
+        self.gui.checkout()
+        self.mock_messagebox.showinfo.assert_called_with("Checkout", "Your cart is empty.")
+        self.gui.order_log.append.assert_not_called()
+
+    def test_import_order_updates_listbox_once(self):
+        self.tree.add_product('Home', 'Kitchen', 'Mug', 4.0, 5000)
+        self.gui.cart_listbox.reset_mock()
+        self.gui.import_order('Mug,1000\nKettle\nNo Such Thing,2\n')
+        self.assertEqual(self.gui.shopping_cart.total_quantity, 1001)
+        self.gui.cart_listbox.insert.assert_called_once()
+        self.assertEqual(len(self.gui.cart_listbox.insert.call_args.args), 1002)
+        self.mock_messagebox.showwarning.assert_called_with(
+            "Paste Order", "These items could not be added: No Such Thing")
+
+    def test_import_order_skips_non_positive_quantities(self):
+        self.gui.import_order('Mug,0\nKettle\nMug,-2\n')
+        self.assertEqual(self.gui.shopping_cart.get_cart_items(), ['Kettle'])
+        self.mock_messagebox.showwarning.assert_called_with(
+            "Paste Order", "These items could not be added: Mug, Mug")
+
+    def test_saved_cart_is_restored(self):
+        self.mock_cartstore.return_value.saved_lines.return_value = [('Kettle', 1)]
+        gui = GUI(MagicMock())
+        self.mock_cartstore.return_value.saved_lines.assert_called_with('gui')
+        self.assertEqual(gui.shopping_cart.get_cart_items(), ['Kettle'])
+        self.assertEqual(self.tree.get_product_node('Kettle').quantity, 1)
+
+    def test_total_shows_savings_and_tax(self):
+        self.gui.pricing_engine.add_rules([shopping.engine.pricing.PercentOff(10, department='Home')])
+        self.gui.pricing_engine.tax_rate = Decimal('0.1')
+        self.gui.add_to_cart('Kettle')
+        self.gui.total_price_label.config.assert_any_call(
+            text="Total Price: $25.25 (you save $2.55, incl. $2.30 tax)")
 
-class GUI(unittest.TestCase):
-    @patch('tkinter.Tk')
-    @patch('shopping.gui.csv_to_products')
-    @patch('shopping.gui.ShoppingCart')
-    def gui_initialization(self, mock_tk, mock_csv_to_products, mock_shopping_cart):
-        gui = GUI(mock_tk)
-        self.assertIsNotNone(gui)
-
-    @patch('tkinter.Tk')
-    @patch('shopping.gui.csv_to_products')
-    @patch('shopping.gui.ShoppingCart')
-    def add_to_cart_updates_cart(self, mock_tk, mock_csv_to_products, mock_shopping_cart):
-        gui = GUI(mock_tk)
-        gui.add_to_cart('product')
-        gui.shopping_cart.add_to_cart.assert_called_with('product')
-
-    @patch('tkinter.Tk')
-    @patch('shopping.gui.csv_to_products')
-    @patch('shopping.gui.ShoppingCart')
-    def checkout_clears_cart(self, mock_tk, mock_csv_to_products, mock_shopping_cart):
-        gui = GUI(mock_tk)
-        gui.checkout()
-        gui.shopping_cart.clear_cart.assert_called()
+    def test_refresh_cart_only_touches_changed_rows(self):
+        self.tree.add_product('Home', 'Kitchen', 'Mug', 4.0, 5)
+        self.gui.import_order('Mug\nKettle\nMug\n')
+        self.gui.cart_listbox.reset_mock()
+        self.gui.inventory.remove_from_cart(self.gui.shopping_cart, 'Mug')
+        self.gui.cart_listbox.delete.assert_called_once_with(0, 0)
+        self.gui.cart_listbox.insert.assert_not_called()
+        self.gui.add_to_cart('Kettle')
+        self.gui.cart_listbox.insert.assert_called_once_with(2, 'Kettle')
 
 
 if __name__ == "__main__":